@@ -0,0 +1,248 @@
+"""
+Headless batch pipeline over a directory of statements.
+
+Every statement goes through the same steps as the dashboard (read, validate
+and normalise, categorise, aggregate) without Streamlit, one per process of a
+process pool. Each statement's transactions, quarantined rows and aggregates
+are written as Parquet, and the run is summarised in report.json and
+summary.csv. With --profile the statements run in this process under cProfile
+instead, which makes it the harness for profiling the pipeline.
+
+Run from the app directory:
+
+    python -m src.batch statements/ --output out/ --categories categories.json
+    python -m src.batch statements/ --output out/ --google-id 1234 --warm
+    python -m src.batch statements/ --output out/ --categories categories.json --profile
+"""
+import argparse
+import cProfile
+import glob
+import json
+import multiprocessing
+import os
+import pstats
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.logger import logger
+from src.metrics import metrics
+from src.transactions.pipeline import build_aggregates, categories_version, categorise, clean_statement
+from src.transactions.rules import parse_rules
+
+
+STATEMENT_PATTERNS = ("*.xlsx", "*.csv")
+
+STEPS = ["read", "clean", "categorise", "aggregate", "write"]
+
+SUMMARY_COLUMNS = [
+    "statement", "status", "error", "rows", "valid_rows", "quarantined_rows", "uncategorised_rows",
+    "missing_rates", "total_debits", "total_credits", "seconds", *[f"timings_{step}" for step in STEPS]
+]
+
+
+def load_categories_file(path: str) -> Tuple[Dict[str, List[str]], List[Dict[str, Any]]]:
+    """
+    Categories (and rules) from a JSON file
+
+    The file is either a category -> keywords mapping, or an object with
+    "categories" and "rules" like a user's document.
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if "categories" in data and isinstance(data["categories"], dict):
+        return data["categories"], data.get("rules", data.get("category_rules", []))
+    return data, []
+
+
+def load_user_categories(google_id: str) -> Tuple[Dict[str, List[str]], List[Dict[str, Any]]]:
+    """A user's categories and rules from Mongo"""
+    from src.login.mongodb_manager import MongoDBManager
+    db_manager = MongoDBManager(os.getenv("MONGODB_URI"), "Streamlit_app")
+    return db_manager.get_user_categories(google_id), db_manager.get_user_rules(google_id)
+
+
+def read_statement(path: str) -> pd.DataFrame:
+    if path.lower().endswith(".csv"):
+        return pd.read_csv(path)
+    return pd.read_excel(path)
+
+
+def _output_name(path: str) -> str:
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+def process_statement(path: str, output_dir: str, categories: Dict[str, List[str]], rules: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Run one statement through the pipeline and write its outputs
+
+    Errors are caught and reported, so one bad statement doesn't stop the batch.
+
+    Returns:
+        Summary of the statement: row counts, totals, outputs and seconds per step
+    """
+    summary: Dict[str, Any] = {"statement": path, "status": "ok", "timings": {}}
+    timings = summary["timings"]
+    started = time.perf_counter()
+
+    def step(name: str) -> None:
+        nonlocal started
+        now = time.perf_counter()
+        timings[name] = round(now - started, 4)
+        started = now
+
+    try:
+        raw = read_statement(path)
+        step("read")
+        df, report = clean_statement(raw)
+        step("clean")
+        df = categorise(df, categories, rules)
+        step("categorise")
+        aggregates = build_aggregates(df)
+        step("aggregate")
+
+        statement_dir = os.path.join(output_dir, _output_name(path))
+        os.makedirs(statement_dir, exist_ok=True)
+        outputs = {"transactions": df, **aggregates}
+        if not report.ok:
+            # Quarantined rows are whatever was in the file, so they are kept as text
+            outputs["quarantined"] = report.quarantined.astype(str)
+        for name, frame in outputs.items():
+            frame.to_parquet(os.path.join(statement_dir, f"{name}.parquet"), index=False)
+        step("write")
+
+        debits = df["Credit/Debit"] == "Debit"
+        credits = df["Credit/Debit"] == "Credit"
+        summary.update({
+            "output_dir": statement_dir,
+            "rows": len(raw),
+            "valid_rows": len(df),
+            "quarantined_rows": len(report.quarantined),
+            "quarantine_summary": None if report.ok else report.summary(),
+            "uncategorised_rows": int((df["Category"] == "Uncategorised").sum()),
+            "total_debits": round(float(abs(df.loc[debits, "Base Amount"].sum())), 2),
+            "total_credits": round(float(df.loc[credits, "Base Amount"].sum()), 2),
+            "missing_rates": int(df["Base Amount"].isna().sum()),
+        })
+    except Exception as e:
+        logger.error(f"Processing {path} failed: {str(e)}")
+        summary.update({"status": "failed", "error": str(e)})
+
+    summary["seconds"] = round(sum(timings.values()), 4)
+    return summary
+
+
+def run_batch(
+    paths: List[str],
+    output_dir: str,
+    categories: Dict[str, List[str]],
+    rules: List[Dict[str, Any]],
+    workers: int
+) -> List[Dict[str, Any]]:
+    """Process the statements on a process pool (or in this process with one worker), in the order given"""
+    if workers <= 1 or len(paths) <= 1:
+        return [process_statement(path, output_dir, categories, rules) for path in paths]
+
+    # Spawned rather than forked, the logger's writer thread doesn't survive a fork
+    context = multiprocessing.get_context("spawn")
+    summaries: Dict[str, Dict[str, Any]] = {}
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+        futures = {executor.submit(process_statement, path, output_dir, categories, rules): path for path in paths}
+        for future in as_completed(futures):
+            summary = future.result()
+            summaries[futures[future]] = summary
+            logger.info(f"{summary['status']}: {futures[future]} in {summary['seconds']}s")
+    return [summaries[path] for path in paths]
+
+
+def warm_history(google_id: str, summaries: List[Dict[str, Any]], categories, rules) -> Optional[int]:
+    """
+    Store the processed statements as the user's dashboard history, so their first dashboard is a cache read
+
+    Returns:
+        Number of transactions stored, or None if there was nothing to store
+    """
+    from src.precompute import precompute_worker
+
+    frames = [
+        pd.read_parquet(os.path.join(summary["output_dir"], "transactions.parquet"))
+        for summary in summaries if summary["status"] == "ok"
+    ]
+    if not frames:
+        return None
+    df = pd.concat(frames, ignore_index=True)
+    precompute_worker.store_history(google_id, df, build_aggregates(df), categories_version(categories, rules), source="batch")
+    return len(df)
+
+
+def write_reports(output_dir: str, summaries: List[Dict[str, Any]], run: Dict[str, Any]) -> None:
+    with open(os.path.join(output_dir, "report.json"), "w") as f:
+        json.dump({"run": run, "statements": summaries}, f, indent=4, default=str)
+
+    # One row per statement, with a column per step's seconds
+    table = pd.json_normalize(summaries, sep="_").reindex(columns=SUMMARY_COLUMNS)
+    table.to_csv(os.path.join(output_dir, "summary.csv"), index=False)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("input_dir", help="Directory of .xlsx/.csv statements")
+    parser.add_argument("--output", required=True, help="Directory the Parquet outputs and reports are written to")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--categories", help="JSON file of categories (and optionally rules)")
+    source.add_argument("--google-id", help="Load the categories and rules of this user from Mongo")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--warm", action="store_true", help="Store the result as the user's dashboard history (needs --google-id)")
+    parser.add_argument("--profile", action="store_true", help="Run in this process under cProfile and write profile.prof")
+    parser.add_argument("--profile-top", type=int, default=25, help="Functions shown from the profile")
+    args = parser.parse_args(argv)
+
+    if args.warm and not args.google_id:
+        parser.error("--warm needs --google-id")
+
+    paths = sorted({path for pattern in STATEMENT_PATTERNS for path in glob.glob(os.path.join(args.input_dir, pattern))})
+    if not paths:
+        parser.error(f"No statements found in {args.input_dir}")
+
+    categories, rules = load_categories_file(args.categories) if args.categories else load_user_categories(args.google_id)
+    # Bad rules fail the run up front rather than every statement
+    rules = [rule.model_dump(mode="json") for rule in parse_rules(rules)]
+    os.makedirs(args.output, exist_ok=True)
+
+    workers = 1 if args.profile else args.workers
+    started = time.perf_counter()
+    with metrics.track("batch.run"):
+        if args.profile:
+            profiler = cProfile.Profile()
+            summaries = profiler.runcall(run_batch, paths, args.output, categories, rules, workers)
+        else:
+            summaries = run_batch(paths, args.output, categories, rules, workers)
+    elapsed = time.perf_counter() - started
+
+    run = {
+        "input_dir": args.input_dir,
+        "statements": len(paths),
+        "failed": sum(summary["status"] != "ok" for summary in summaries),
+        "rows": sum(summary.get("valid_rows", 0) for summary in summaries),
+        "workers": workers,
+        "seconds": round(elapsed, 3),
+        "categories": len(categories),
+        "rules": len(rules),
+    }
+    if args.warm:
+        run["warmed_rows"] = warm_history(args.google_id, summaries, categories, rules)
+    write_reports(args.output, summaries, run)
+
+    print(f"Processed {run['statements']} statements ({run['rows']} transactions, {run['failed']} failed) in {run['seconds']}s")
+    if args.profile:
+        profile_path = os.path.join(args.output, "profile.prof")
+        profiler.dump_stats(profile_path)
+        pstats.Stats(profiler).sort_stats("cumulative").print_stats(args.profile_top)
+        print(f"Profile written to {profile_path}")
+    return 1 if run["failed"] else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,183 @@
+import hashlib
+import os
+import threading
+import weakref
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.logger import logger
+
+
+class StoredDataset:
+    """One shared, read-only statement frame plus the position views every session needs"""
+
+    def __init__(self, key: str, frame: pd.DataFrame) -> None:
+        self.key = key
+        self.frame = frame
+        self.nbytes = int(frame.memory_usage(deep=True).sum())
+        self.refcount = 0
+
+        # Debits and credits are the same for every session, so they are worked out once
+        credit_debit = frame["Credit/Debit"].to_numpy() if "Credit/Debit" in frame.columns else np.array([], dtype=object)
+        self.shared_views: Dict[str, np.ndarray] = {
+            "all": np.arange(len(frame), dtype=np.int64),
+            "debits": np.flatnonzero(credit_debit == "Debit"),
+            "credits": np.flatnonzero(credit_debit == "Credit"),
+        }
+
+
+class DatasetHandle:
+    """
+    Lightweight reference to a dataset in the store, kept in st.session_state.
+
+    Holds the dataset key and any session specific views (e.g. the current
+    filter) as arrays of row positions. The reference is released when the
+    handle is garbage collected, e.g. when the session ends or it is replaced.
+    """
+
+    def __init__(self, store: "DatasetStore", key: str) -> None:
+        self.store = store
+        self.key = key
+        self.views: Dict[str, np.ndarray] = {}
+        store._acquire(key)
+        weakref.finalize(self, store._release, key)
+
+    @property
+    def frame(self) -> pd.DataFrame:
+        """The shared frame, which must be treated as read-only"""
+        return self.store._get(self.key).frame
+
+    def positions(self, name: str) -> np.ndarray:
+        """Row positions of a session view, falling back to the shared debits/credits/all views"""
+        if name in self.views:
+            return self.views[name]
+        return self.store._get(self.key).shared_views[name]
+
+    def set_view(self, name: str, positions: np.ndarray) -> None:
+        self.views[name] = np.asarray(positions, dtype=np.int64)
+
+    def view(self, name: str, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """Materialise a view (only `columns`, if given) for the current rerun, don't keep the result around"""
+        frame = self.frame if columns is None else self.frame[columns]
+        return frame.iloc[self.positions(name)]
+
+    def __len__(self) -> int:
+        return len(self.frame)
+
+    def __repr__(self) -> str:
+        return f"DatasetHandle(key={self.key[:12]}, rows={len(self)}, views={list(self.views)})"
+
+
+class DatasetStore:
+    """
+    Process-wide store of statement frames keyed by a hash of their content.
+
+    Sessions that load the same statement share one frame. Datasets no session
+    references any more stay cached until the store goes over its memory
+    budget, then the least recently used of them are evicted first.
+    """
+
+    def __init__(self, memory_budget_bytes: int) -> None:
+        self.memory_budget_bytes = memory_budget_bytes
+        self.datasets: "OrderedDict[str, StoredDataset]" = OrderedDict()
+        self.lock = threading.RLock()
+
+
+    @staticmethod
+    def content_hash(frame: pd.DataFrame) -> str:
+        """Hash of the values, index and column names of a frame"""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update("\x1f".join(map(str, frame.columns)).encode())
+        digest.update(pd.util.hash_pandas_object(frame, index=True).to_numpy().tobytes())
+        return digest.hexdigest()
+
+
+    def put(self, frame: pd.DataFrame) -> DatasetHandle:
+        """
+        Add a frame to the store (or reuse an identical one already there)
+
+        Args:
+            frame: The frame to share, the caller shouldn't modify it afterwards
+
+        Returns:
+            A handle referencing the stored dataset
+        """
+        key = self.content_hash(frame)
+        with self.lock:
+            if key in self.datasets:
+                self.datasets.move_to_end(key)
+            else:
+                self.datasets[key] = StoredDataset(key, frame)
+                logger.debug("Stored dataset %s (%d rows)", key, len(frame))
+            handle = DatasetHandle(self, key)
+            self._evict()
+        return handle
+
+
+    def handle(self, key: str) -> DatasetHandle:
+        """
+        A new handle to a dataset already in the store, e.g. for another session
+
+        Raises:
+            KeyError: If the dataset isn't (or is no longer) in the store
+        """
+        with self.lock:
+            self.datasets.move_to_end(key)
+            return DatasetHandle(self, key)
+
+
+    def _get(self, key: str) -> StoredDataset:
+        with self.lock:
+            self.datasets.move_to_end(key)
+            return self.datasets[key]
+
+    def _acquire(self, key: str) -> None:
+        with self.lock:
+            self.datasets[key].refcount += 1
+
+    def _release(self, key: str) -> None:
+        with self.lock:
+            dataset = self.datasets.get(key)
+            if dataset is not None:
+                dataset.refcount -= 1
+            self._evict()
+
+
+    @property
+    def total_bytes(self) -> int:
+        with self.lock:
+            return sum(dataset.nbytes for dataset in self.datasets.values())
+
+
+    def _evict(self) -> None:
+        """Drop unreferenced datasets, least recently used first, until the store fits its budget"""
+        with self.lock:
+            total = sum(dataset.nbytes for dataset in self.datasets.values())
+            for key in list(self.datasets):
+                if total <= self.memory_budget_bytes:
+                    return
+                dataset = self.datasets[key]
+                if dataset.refcount <= 0:
+                    total -= dataset.nbytes
+                    del self.datasets[key]
+                    logger.debug("Evicted dataset %s (%d bytes)", key, dataset.nbytes)
+
+            if total > self.memory_budget_bytes:
+                logger.warning(f"Dataset store is over its memory budget ({total} bytes) but every dataset is in use")
+
+
+    def stats(self) -> Dict[str, int]:
+        with self.lock:
+            return {
+                "datasets": len(self.datasets),
+                "referenced": sum(1 for dataset in self.datasets.values() if dataset.refcount > 0),
+                "bytes": sum(dataset.nbytes for dataset in self.datasets.values()),
+                "budget_bytes": self.memory_budget_bytes,
+            }
+
+
+# Initialising the process-wide store (budget in MB, shared by every session)
+dataset_store = DatasetStore(memory_budget_bytes=int(float(os.getenv("DATASET_STORE_MB", 512)) * 1024 * 1024))
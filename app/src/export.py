@@ -0,0 +1,309 @@
+"""
+Streaming exports of the dashboard's data.
+
+A session registers what it wants to export (a view of a stored dataset, as
+row positions) and gets a one-off link to a small HTTP server running next to
+Streamlit. The server writes the file straight into the response with chunked
+transfer encoding, a chunk of rows at a time, so the download starts at once
+and there is never a full copy of the export in memory:
+
+    CSV       each chunk is encoded and sent as it is made
+    Parquet   each chunk is one row group
+    XLSX      openpyxl's write-only mode, which keeps the rows in a temporary file until
+              the zip is written, so the data only starts arriving once every row is
+
+Streamlit's own download button holds the whole file in memory, which is why
+exports go through this server instead.
+"""
+import io
+import os
+import secrets
+import threading
+import time
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from src.dataset_store import DatasetHandle, dataset_store
+from src.logger import logger
+from src.metrics import metrics
+
+
+# format: (MIME type, file extension)
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+}
+
+EXPORT_COLUMNS = ["Completed Date", "Description", "Type", "Amount", "Currency", "Base Amount", "Category", "Credit/Debit"]
+
+CHUNK_ROWS = 50_000
+
+# Rows in an Excel sheet, less the header
+MAX_XLSX_ROWS = 1_048_575
+
+
+def iter_chunks(frame: pd.DataFrame, positions: np.ndarray, columns: List[str], chunk_rows: int = CHUNK_ROWS) -> Iterator[pd.DataFrame]:
+    """
+    The rows at `positions`, `chunk_rows` at a time, only ever copying one chunk
+
+    Without any rows a single empty chunk is yielded, so exports still get their header and schema.
+    """
+    if not len(positions):
+        yield frame.iloc[:0][columns]
+    for start in range(0, len(positions), chunk_rows):
+        yield frame.iloc[positions[start:start + chunk_rows]][columns]
+
+
+def monthly_summary(frame: pd.DataFrame, positions: np.ndarray, chunk_rows: int = CHUNK_ROWS) -> pd.DataFrame:
+    """
+    Absolute amounts per month and category, plus each month's total, from the rows at `positions`
+
+    Summed chunk by chunk, so only the partial sums are ever kept.
+    """
+    partial_sums = []
+    for chunk in iter_chunks(frame, positions, ["Completed Date", "Category", "Base Amount"], chunk_rows):
+        if chunk.empty:
+            continue
+        months = pd.to_datetime(chunk["Completed Date"]).dt.to_period("M").dt.to_timestamp()
+        partial_sums.append(chunk.groupby([months.rename("Month"), "Category"])["Base Amount"].sum())
+    if not partial_sums:
+        return pd.DataFrame(columns=["Month", "Total"])
+
+    by_category = pd.concat(partial_sums).groupby(level=["Month", "Category"]).sum().abs().unstack("Category", fill_value=0)
+    by_category.columns.name = None
+    by_category.insert(0, "Total", by_category.sum(axis=1))
+    return by_category.round(2).reset_index()
+
+
+def write_csv(chunks: Iterator[pd.DataFrame], out) -> int:
+    rows = 0
+    for i, chunk in enumerate(chunks):
+        out.write(chunk.to_csv(index=False, header=i == 0).encode())
+        rows += len(chunk)
+    return rows
+
+
+def write_parquet(chunks: Iterator[pd.DataFrame], out) -> int:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    rows = 0
+    writer = None
+    sink = pa.PythonFile(out, mode="w")
+    try:
+        for chunk in chunks:
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(sink, table.schema)
+            # Every chunk is written out as its own row group
+            writer.write_table(table.cast(writer.schema), row_group_size=max(len(chunk), 1))
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def write_xlsx(sheets: Dict[str, Callable[[], Iterator[pd.DataFrame]]], out) -> int:
+    """Write each sheet's chunks with openpyxl's write-only mode (sheet name -> function returning its chunks)"""
+    from openpyxl import Workbook
+
+    rows = 0
+    workbook = Workbook(write_only=True)
+    for name, chunks in sheets.items():
+        sheet = workbook.create_sheet(title=name)
+        for i, chunk in enumerate(chunks()):
+            if i == 0:
+                sheet.append([str(column) for column in chunk.columns])
+            # Excel has no NaN, missing values are written as empty cells
+            chunk = chunk.astype(object).where(chunk.notna(), None)
+            for row in chunk.itertuples(index=False, name=None):
+                sheet.append(row)
+            rows += len(chunk)
+    workbook.save(out)
+    return rows
+
+
+class ChunkedResponse(io.RawIOBase):
+    """Write-only, unseekable stream that sends everything written to it as HTTP chunks"""
+
+    def __init__(self, wfile) -> None:
+        self.wfile = wfile
+        self.sent = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if data:
+            self.wfile.write(f"{len(data):X}\r\n".encode())
+            self.wfile.write(data)
+            self.wfile.write(b"\r\n")
+            self.sent += len(data)
+        return len(data)
+
+    def finish(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+
+
+@dataclass
+class Export:
+    """What a link exports, kept until it expires"""
+    handle: DatasetHandle
+    positions: np.ndarray
+    columns: List[str]
+    fmt: str
+    file_name: str
+    summary: bool = False
+    expires_at: float = field(default_factory=time.monotonic)
+
+
+class ExportServer:
+    """
+    Serves registered exports at /export/<token> from a daemon thread.
+
+    The server is started with the first registration. Links are unguessable
+    and expire after `ttl` seconds, and each export holds a handle to its
+    dataset so the store can't evict it halfway through a download.
+    """
+
+    def __init__(self, host: str, port: int, public_url: str, ttl: float = 600) -> None:
+        self.host = host
+        self.port = port
+        self.public_url = public_url.rstrip("/")
+        self.ttl = ttl
+        self.exports: Dict[str, Export] = {}
+        self.lock = threading.Lock()
+        self.server: Optional[ThreadingHTTPServer] = None
+
+
+    def register(
+        self,
+        dataset_key: str,
+        positions: np.ndarray,
+        fmt: str,
+        file_name: str,
+        summary: bool = False,
+        columns: Optional[List[str]] = None
+    ) -> str:
+        """
+        Register an export of the rows at `positions` of a stored dataset
+
+        Args:
+            dataset_key: Key of the dataset in the dataset store
+            positions: Row positions to export, e.g. the session's filtered view
+            fmt: One of EXPORT_FORMATS
+            file_name: Name the browser saves the file as, without the extension
+            summary: Export the monthly summary of the rows instead of the rows themselves (XLSX has both)
+            columns: Columns to export, defaults to the EXPORT_COLUMNS the dataset has
+
+        Returns:
+            The download link
+        """
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt}")
+        if fmt == "xlsx" and len(positions) > MAX_XLSX_ROWS:
+            raise ValueError(f"Excel sheets hold at most {MAX_XLSX_ROWS:,} rows, export {len(positions):,} rows as CSV or Parquet instead")
+        self.start()
+
+        handle = dataset_store.handle(dataset_key)
+        columns = columns or [column for column in EXPORT_COLUMNS if column in handle.frame.columns]
+        token = secrets.token_urlsafe(24)
+        with self.lock:
+            self._drop_expired()
+            self.exports[token] = Export(
+                handle=handle,
+                positions=np.asarray(positions, dtype=np.int64),
+                columns=columns,
+                fmt=fmt,
+                file_name=f"{file_name}.{EXPORT_FORMATS[fmt][1]}",
+                summary=summary,
+                expires_at=time.monotonic() + self.ttl
+            )
+        return f"{self.public_url}/export/{token}"
+
+
+    def _drop_expired(self) -> None:
+        now = time.monotonic()
+        for token in [token for token, export in self.exports.items() if export.expires_at < now]:
+            # Dropping the export releases its dataset handle
+            del self.exports[token]
+
+
+    def lookup(self, token: str) -> Optional[Export]:
+        with self.lock:
+            self._drop_expired()
+            return self.exports.get(token)
+
+
+    def write(self, export: Export, out) -> int:
+        """Write an export to a stream, returning the number of rows written"""
+        frame = export.handle.frame
+        chunks = lambda: iter_chunks(frame, export.positions, export.columns)
+        summary = lambda: iter([monthly_summary(frame, export.positions)])
+
+        with metrics.track(f"export.{export.fmt}"):
+            if export.fmt == "xlsx":
+                rows = write_xlsx({"Transactions": chunks, "Monthly Summary": summary}, out)
+            elif export.fmt == "parquet":
+                rows = write_parquet(summary() if export.summary else chunks(), out)
+            else:
+                rows = write_csv(summary() if export.summary else chunks(), out)
+        metrics.increment("export_rows", f"export.{export.fmt}", rows)
+        return rows
+
+
+    def start(self) -> None:
+        with self.lock:
+            if self.server is not None:
+                return
+            exports = self
+
+            class ExportHandler(BaseHTTPRequestHandler):
+                # Chunked transfer encoding needs HTTP/1.1
+                protocol_version = "HTTP/1.1"
+
+                def do_GET(self) -> None:
+                    parts = self.path.split("?")[0].strip("/").split("/")
+                    export = exports.lookup(parts[1]) if len(parts) == 2 and parts[0] == "export" else None
+                    if export is None:
+                        self.send_error(404, "This download link has expired, create a new one in the dashboard")
+                        return
+
+                    self.send_response(200)
+                    self.send_header("Content-Type", EXPORT_FORMATS[export.fmt][0])
+                    self.send_header("Content-Disposition", f'attachment; filename="{export.file_name}"')
+                    self.send_header("Transfer-Encoding", "chunked")
+                    self.send_header("Connection", "close")
+                    self.end_headers()
+
+                    response = ChunkedResponse(self.wfile)
+                    try:
+                        rows = exports.write(export, response)
+                        response.finish()
+                        logger.info(f"Exported {rows} rows as {export.file_name} ({response.sent} bytes)")
+                    except (BrokenPipeError, ConnectionResetError):
+                        logger.info(f"Export of {export.file_name} cancelled by the browser")
+                    self.close_connection = True
+
+                def log_message(self, format, *args) -> None:
+                    pass
+
+            self.server = ThreadingHTTPServer((self.host, self.port), ExportHandler)
+            self.server.daemon_threads = True
+            threading.Thread(target=self.server.serve_forever, daemon=True, name="export-server").start()
+            logger.info(f"Serving exports on {self.host}:{self.port}")
+
+
+# Initialising the process-wide export server, started when the first export is registered
+_export_port = int(os.getenv("EXPORT_PORT", 8502))
+export_server = ExportServer(
+    host=os.getenv("EXPORT_HOST", "127.0.0.1"),
+    port=_export_port,
+    public_url=os.getenv("EXPORT_PUBLIC_URL", f"http://localhost:{_export_port}")
+)
@@ -1,16 +1,61 @@
 import logging
-from datetime import datetime
+from datetime import datetime, timezone
 from typing import Optional, Dict, Any
-import traceback
+import atexit
+import json
+import queue
 import sys
 import os
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+
+class LevelFilter(logging.Filter):
+    """Only lets through records of exactly one level, so each level gets its own file"""
+
+    def __init__(self, levelno: int) -> None:
+        super().__init__()
+        self.levelno = levelno
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        return record.levelno == self.levelno
+
+
+class LazyQueueHandler(QueueHandler):
+    """
+    QueueHandler that puts the record on the queue untouched.
+
+    The default `prepare` formats the message (and traceback) on the calling
+    thread; here that is left to the background listener, so the request path
+    only pays for creating the record. Log arguments should therefore not be
+    mutated after the call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Formats each record as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName,
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
 
 
 class AppLogger:
-    def __init__(self, name: str = "finance_app", log_level: str = "INFO"):
+    def __init__(self, name: str = "finance_app", log_level: str = "INFO", json_lines: Optional[bool] = None):
         self.logger = logging.getLogger(name)
         self.logger.setLevel(log_level)
+        self.json_lines = json_lines if json_lines is not None else os.getenv("LOG_JSON_LINES", "").lower() in ("1", "true")
+        self.listener: Optional[QueueListener] = None
 
         # Prevent adding handles multiple times
         if not self.logger.handlers:
@@ -18,58 +63,63 @@ class AppLogger:
 
 
     def _setup_handlers(self):
-        """Configuring logging handlers"""
+        """
+        Configuring logging handlers
+
+        The logger itself only has a QueueHandler. A single QueueListener thread
+        takes records off the queue and writes them to the console and the
+        per-level rotating files, so no file writes or rotations happen on the
+        Streamlit script threads.
+        """
+        handlers = []
+
         # Console Handler
         console_handler = logging.StreamHandler()
         console_handler.setFormatter(self._get_formatter())
-        self.logger.addHandler(console_handler)
+        handlers.append(console_handler)
 
-        # File handler with rotation
+        # File handlers with rotation, one per level
         os.makedirs("logs", exist_ok=True)
-        
-        # Info handler
-        info_handler = RotatingFileHandler(
-            "logs/info.log",
-            maxBytes=100*1024*1024,
-            backupCount=3
-        )
-        info_handler.setLevel(logging.INFO)
-        info_handler.setFormatter(self._get_formatter())
-        info_handler.addFilter(lambda record: record.levelno == logging.INFO)
-        self.logger.addHandler(info_handler)
-
-        # Warning handler
-        warning_handler = RotatingFileHandler(
-            "logs/warning.log",
-            maxBytes=100*1024*1024,
-            backupCount=3
-        )
-        warning_handler.setLevel(logging.WARNING)
-        warning_handler.setFormatter(self._get_formatter())
-        warning_handler.addFilter(lambda record: record.levelno == logging.WARNING)
-        self.logger.addHandler(warning_handler)
-
-        # Error handler (fixed this section)
-        error_handler = RotatingFileHandler(
-            "logs/error.log", 
-            maxBytes=100*1024*1024,
-            backupCount=3
-        )
-        error_handler.setLevel(logging.ERROR)
-        error_handler.setFormatter(self._get_formatter())
-        error_handler.addFilter(lambda record: record.levelno == logging.ERROR)
-        self.logger.addHandler(error_handler)
-
-        # Critical handler
-        critical_handler = RotatingFileHandler(
-            "logs/critical.log",
-            maxBytes=100*1024*1024,
-            backupCount=3
-        )
-        critical_handler.setLevel(logging.CRITICAL)
-        critical_handler.setFormatter(self._get_formatter())
-        critical_handler.addFilter(lambda record: record.levelno == logging.CRITICAL)
-        self.logger.addHandler(critical_handler)
+        for level, filename in [
+            (logging.INFO, "logs/info.log"),
+            (logging.WARNING, "logs/warning.log"),
+            (logging.ERROR, "logs/error.log"),
+            (logging.CRITICAL, "logs/critical.log"),
+        ]:
+            file_handler = RotatingFileHandler(
+                filename,
+                maxBytes=100*1024*1024,
+                backupCount=3
+            )
+            file_handler.setLevel(level)
+            file_handler.setFormatter(self._get_formatter())
+            file_handler.addFilter(LevelFilter(level))
+            handlers.append(file_handler)
+
+        # Optional structured output with every level in one file
+        if self.json_lines:
+            json_handler = RotatingFileHandler(
+                "logs/app.jsonl",
+                maxBytes=100*1024*1024,
+                backupCount=3
+            )
+            json_handler.setFormatter(JsonLinesFormatter())
+            handlers.append(json_handler)
+
+        log_queue = queue.SimpleQueue()
+        self.logger.addHandler(LazyQueueHandler(log_queue))
+        self.listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        self.listener.start()
+
+        # Flush whatever is still queued when the process exits
+        atexit.register(self.stop)
+
+
+    def stop(self):
+        """Stop the background writer after it has written every queued record"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
 
 
     def _get_formatter(self):
@@ -78,35 +128,33 @@ class AppLogger:
         )
 
 
-    def log(self, level: str, message: str, extra: Optional[Dict[str, Any]] = None):
-        """Main Logging Method"""
+    def log(self, level: str, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None, exc_info: bool = False):
+        """Main Logging Method (`args` are %-formatted into the message lazily, by the background writer)"""
         # getattr is a built-in Python function that in this case gets the attributes of this class (e.g. for example getting the logger.info() function, and executes that particular function)
         log_method = getattr(self.logger, level.lower(), self.logger.info)
-        log_method(message, extra=extra)
+        log_method(message, *args, extra=extra, exc_info=exc_info)
 
 
-    def debug(self, message: str, extra: Optional[Dict[str, Any]] = None):
-        self.log("DEBUG", message, extra)
+    def debug(self, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None):
+        self.log("DEBUG", message, *args, extra=extra)
 
-    def info(self, message: str, extra: Optional[Dict[str, Any]] = None):
-        self.log("INFO", message, extra)
+    def info(self, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None):
+        self.log("INFO", message, *args, extra=extra)
 
-    def warning(self, message: str, extra: Optional[Dict[str, Any]] = None):
-        self.log("WARNING", message, extra)
+    def warning(self, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None):
+        self.log("WARNING", message, *args, extra=extra)
 
-    def error(self, message: str, extra: Optional[Dict[str, Any]] = None):
-        self.log("ERROR", message, extra)
-        exc_info = sys.exc_info()
-        if exc_info[0] is not None:
-            self.logger.error(traceback.format_exc())
+    def error(self, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None):
+        # Attach the traceback of the exception being handled, if there is one
+        self.log("ERROR", message, *args, extra=extra, exc_info=sys.exc_info()[0] is not None)
 
-    def critical(self, message: str, extra: Optional[Dict[str, Any]] = None):
-        self.log("CRITICAL", message, extra)
+    def critical(self, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None):
+        self.log("CRITICAL", message, *args, extra=extra)
 
-    def exception(self, message: str, extra: Optional[Dict[str, Any]] = None):
-        self.logger.exception(message, extra=extra)
+    def exception(self, message: str, *args: Any, extra: Optional[Dict[str, Any]] = None):
+        self.logger.exception(message, *args, extra=extra)
 
 
 
 # Initialising the default logger instance
-logger = AppLogger()
\ No newline at end of file
+logger = AppLogger()
@@ -1,20 +1,59 @@
 import streamlit as st
-from .mongodb_manager import JWTAuthManager, MongoDBManager
 import os
 
+
+class LazyResource:
+    """
+    Stands in for a shared resource and only creates it on first attribute access.
+
+    Importing `db_manager` therefore doesn't import pymongo or connect to Mongo,
+    which only happens once a page actually talks to the database.
+    """
+
+    def __init__(self, factory) -> None:
+        self._factory = factory
+        self._instance = None
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the proxy itself
+        if self._instance is None:
+            self._instance = self._factory()
+        return getattr(self._instance, name)
+
+
 # this is most likely not right as it should be accessible to each individual user instead of everyone (Maybe - look into it)
 @st.cache_resource
 def get_jwt_auth_manager():
+    from .mongodb_manager import JWTAuthManager
     return JWTAuthManager(os.getenv("JWT_SECRET_KEY"))
 
+@st.cache_resource
+def get_google_token_verifier():
+    # One verifier per process, so Google's signing keys are fetched once and shared by every session
+    from .google_auth import GoogleIdTokenVerifier
+    return GoogleIdTokenVerifier(os.getenv("GOOGLE_CLIENT_ID"))
+
 @st.cache_resource
 def get_mongodb_manager():
+    from .mongodb_manager import MongoDBManager
     return MongoDBManager(os.getenv("MONGODB_URI"), "Streamlit_app")
 
-auth_manager = get_jwt_auth_manager()
-db_manager = get_mongodb_manager()
+auth_manager = LazyResource(get_jwt_auth_manager)
+db_manager = LazyResource(get_mongodb_manager)
+google_token_verifier = LazyResource(get_google_token_verifier)
 
 
-__all__ = [ 'auth_manager', 'db_manager']
+def is_admin() -> bool:
+    """Whether the session is signed in as one of ADMIN_EMAILS (comma-separated), nobody is when it isn't set"""
+    admin_emails = {email.strip().lower() for email in os.getenv("ADMIN_EMAILS", "").split(",") if email.strip()}
+    if not admin_emails:
+        return False
+    try:
+        # The email is read from the signed session token, not from anything the session could change
+        claims = auth_manager.verify_session_token(st.session_state)
+    except ValueError:
+        return False
+    return claims is not None and claims.email.lower() in admin_emails
 
 
+__all__ = [ 'auth_manager', 'db_manager', 'google_token_verifier', 'is_admin']
@@ -0,0 +1,139 @@
+import json
+import re
+import threading
+import time
+import urllib.request
+from typing import Any, Callable, Dict, Optional, Tuple, Union
+
+import jwt
+
+from src.logger import logger
+from src.metrics import metrics
+
+
+GOOGLE_JWKS_URL = "https://www.googleapis.com/oauth2/v3/certs"
+GOOGLE_ISSUERS = ("accounts.google.com", "https://accounts.google.com")
+
+# A key set fetcher returns the JWKS document, optionally with how long (in seconds) it may be cached for
+KeySetFetcher = Callable[[], Union[Dict[str, Any], Tuple[Dict[str, Any], Optional[float]]]]
+
+
+def fetch_google_jwks(url: str = GOOGLE_JWKS_URL, timeout: float = 5.0) -> Tuple[Dict[str, Any], Optional[float]]:
+    """
+    Fetch Google's public signing keys
+
+    Returns:
+        The JWKS document and the max-age from its Cache-Control header (None if missing)
+    """
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        cache_control = response.headers.get("Cache-Control", "")
+        jwks = json.load(response)
+
+    max_age = re.search(r"max-age=(\d+)", cache_control)
+    return jwks, float(max_age.group(1)) if max_age else None
+
+
+class JWKSCache:
+    """
+    In-process cache of a JWKS key set.
+
+    Keys are refreshed when the cache expires (using the server's max-age when
+    given) or when a token is signed with a key id that isn't known yet, i.e.
+    after a key rotation. Unknown key ids can only force a refresh once every
+    `min_refresh_interval` seconds, so bad tokens can't hammer the key endpoint.
+    """
+
+    def __init__(
+        self,
+        fetch_keys: KeySetFetcher = fetch_google_jwks,
+        default_ttl: float = 3600.0,
+        min_refresh_interval: float = 60.0
+    ) -> None:
+        self.fetch_keys = fetch_keys
+        self.default_ttl = default_ttl
+        self.min_refresh_interval = min_refresh_interval
+        self.keys: Dict[str, Any] = {}
+        self.expires_at = 0.0
+        self.refreshed_at: Optional[float] = None
+        self.lock = threading.Lock()
+
+
+    def _refresh(self) -> None:
+        self.refreshed_at = time.monotonic()
+        try:
+            with metrics.track("auth.fetch_jwks"):
+                result = self.fetch_keys()
+        except Exception as e:
+            # Carry on with the keys we have rather than locking every user out
+            logger.warning(f"Could not refresh the JWKS key set: {str(e)}")
+            if self.keys:
+                return
+            raise ValueError("Could not fetch the keys to verify the sign-in") from e
+
+        jwks, max_age = result if isinstance(result, tuple) else (result, None)
+        self.keys = {
+            jwk["kid"]: jwt.PyJWK(jwk).key
+            for jwk in jwks.get("keys", [])
+            if "kid" in jwk
+        }
+        self.expires_at = time.monotonic() + (max_age if max_age is not None else self.default_ttl)
+        logger.info(f"Refreshed the JWKS key set ({len(self.keys)} keys)")
+
+
+    def get_key(self, kid: Optional[str]) -> Any:
+        """
+        Get the public key for a key id
+
+        Raises:
+            ValueError: If the key id isn't in the (refreshed) key set
+        """
+        with self.lock:
+            now = time.monotonic()
+            if now >= self.expires_at:
+                self._refresh()
+            elif kid not in self.keys and (self.refreshed_at is None or now - self.refreshed_at >= self.min_refresh_interval):
+                self._refresh()
+
+            if kid not in self.keys:
+                raise ValueError("The sign-in token was signed with an unknown key")
+            return self.keys[kid]
+
+
+class GoogleIdTokenVerifier:
+    """Verifies the signature, audience, issuer and expiry of Google ID tokens"""
+
+    def __init__(self, client_id: str, key_cache: Optional[JWKSCache] = None, leeway: float = 10.0) -> None:
+        self.client_id = client_id
+        self.key_cache = key_cache or JWKSCache()
+        self.leeway = leeway
+
+
+    def verify(self, id_token: str) -> Dict[str, Any]:
+        """
+        Verify a Google ID token and return its claims
+
+        Raises:
+            ValueError: If the token is invalid, expired, not meant for this app, or its email isn't verified
+        """
+        try:
+            header = jwt.get_unverified_header(id_token)
+            key = self.key_cache.get_key(header.get("kid"))
+            claims = jwt.decode(
+                id_token,
+                key,
+                algorithms=["RS256"],
+                audience=self.client_id,
+                leeway=self.leeway
+            )
+        except jwt.ExpiredSignatureError:
+            raise ValueError("Google sign-in has expired, please try again")
+        except jwt.InvalidTokenError as e:
+            raise ValueError(f"Invalid Google sign-in token: {str(e)}")
+
+        if claims.get("iss") not in GOOGLE_ISSUERS:
+            raise ValueError("Google sign-in token has an unexpected issuer")
+        # Accounts are looked up and signed into by email, so it has to belong to whoever signed in
+        # (older tokens send the flag as a string)
+        if claims.get("email_verified") not in (True, "true"):
+            raise ValueError("The Google account's email address isn't verified")
+        return claims
@@ -4,7 +4,7 @@ import streamlit as st
 import bcrypt
 
 # Dependencies for managing tokens
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 from dotenv import load_dotenv
 import jwt
 import os
@@ -17,8 +17,9 @@ from src.login.schemas import UserInDB, TokenData
 from typing import Optional, Dict, Any, List, Union
 from pydantic import BaseModel, Field, SecretStr
 
-# Import logging
+# Import logging and metrics
 from src.logger import logger
+from src.metrics import metrics
 
 # Load environment variables
 load_dotenv()
@@ -60,6 +61,28 @@ class JWTAuthManager:
             st.error("Invalid token")
             raise ValueError("Invalid token")
 
+    def verify_session_token(self, session_state) -> Optional[TokenData]:
+        """
+        Verify the session's token, reusing the claims verified on an earlier rerun until they expire
+
+        Args:
+            session_state: st.session_state (or any dict-like), where the verified claims are cached
+
+        Returns:
+            The token's claims, or None if the session has no token
+        """
+        token = session_state.get("token")
+        if not token:
+            return None
+
+        cached = session_state.get("verified_token")
+        if cached and cached["token"] == token and cached["claims"].exp > datetime.now(timezone.utc):
+            return cached["claims"]
+
+        claims = self.verify_token(token)
+        session_state["verified_token"] = {"token": token, "claims": claims}
+        return claims
+
 
 
 
@@ -71,6 +94,7 @@ class MongoDBManager:
         self.users_collection = self.db['users']
         
     
+    @metrics.timed("db.get_or_create_user_from_google")
     def get_or_create_user_from_google(
         self,
         id_token: dict
@@ -96,13 +120,16 @@ class MongoDBManager:
                     "categories": {"Uncategorised": []}
                 }
                 self.users_collection.insert_one(user_data)
-            logger.log("INFO", str(json.dumps(user_data, indent=4, sort_keys=True )))
+            logger.info("Signed in user %s", google_id)
+            # Only formatted (by the background log writer) when DEBUG logging is on
+            logger.debug("User data: %s", user_data)
             return UserInDB(**user_data)
             
         except Exception as e:
             logger.log("ERROR", str(e))        
 
     # Adding categories to DB
+    @metrics.timed("db.get_user_categories")
     def get_user_categories(
         self, 
         google_id: str
@@ -131,6 +158,7 @@ class MongoDBManager:
             return {"Uncategorised": []}
 
 
+    @metrics.timed("db.save_user_categories")
     def save_user_categories(
         self, 
         google_id: str, 
@@ -158,6 +186,105 @@ class MongoDBManager:
             logger.log("ERROR", str(e))
             return False
 
+    @metrics.timed("db.get_user_rules")
+    def get_user_rules(
+        self,
+        google_id: str
+        ) -> List[Dict[str, Any]]:
+        """
+        Get a user's categorisation rules, stored next to their categories
+
+        Args:
+            google_id: Google ID of the user to lookup
+
+        Returns:
+            List of rules (see src/transactions/rules.py), empty if there are none
+        """
+        try:
+            user = self.users_collection.find_one({'google_id': google_id}, {'category_rules': 1})
+            return (user or {}).get("category_rules", [])
+        except Exception as e:
+            logger.error(f"Error getting rules for {google_id}: {str(e)}")
+            return []
+
+    @metrics.timed("db.save_user_rules")
+    def save_user_rules(
+        self,
+        google_id: str,
+        rules: List[Dict[str, Any]]
+        ) -> bool:
+        """
+        Save a user's categorisation rules
+
+        Args:
+            google_id: Google ID of the user to update
+            rules: Validated rules, as dictionaries
+
+        Returns:
+            True if operation was successful
+        """
+        try:
+            self.users_collection.update_one(
+                {'google_id': google_id},
+                {'$set': {'category_rules': rules}},
+                upsert=True
+            )
+            return True
+        except PyMongoError as e:
+            st.error(f"Error saving rules: {str(e)}")
+            logger.log("ERROR", str(e))
+            return False
+
+    @metrics.timed("db.get_user_budgets")
+    def get_user_budgets(
+        self,
+        google_id: str
+        ) -> Dict[str, float]:
+        """
+        Get a user's monthly budgets, stored next to their categories
+
+        Args:
+            google_id: Google ID of the user to lookup
+
+        Returns:
+            Dictionary of category -> monthly budget, empty if there are none
+        """
+        try:
+            user = self.users_collection.find_one({'google_id': google_id}, {'budgets': 1})
+            return (user or {}).get("budgets", {})
+        except Exception as e:
+            logger.error(f"Error getting budgets for {google_id}: {str(e)}")
+            return {}
+
+    @metrics.timed("db.save_user_budgets")
+    def save_user_budgets(
+        self,
+        google_id: str,
+        budgets: Dict[str, float]
+        ) -> bool:
+        """
+        Save a user's monthly budgets
+
+        Args:
+            google_id: Google ID of the user to update
+            budgets: Validated budgets, category -> monthly amount in the base currency
+
+        Returns:
+            True if operation was successful
+        """
+        try:
+            self.users_collection.update_one(
+                {'google_id': google_id},
+                {'$set': {'budgets': budgets}},
+                upsert=True
+            )
+            return True
+        except PyMongoError as e:
+            st.error(f"Error saving budgets: {str(e)}")
+            logger.log("ERROR", str(e))
+            return False
+
+    @metrics.timed("db.add_category_keyword")
     def add_category_keyword(
         self, 
         google_id: str, 
@@ -168,7 +295,7 @@ class MongoDBManager:
         Add a keyword to a category
         
         Args:
-            username: Username to update
+            google_id: Google ID of the user to update
             category: Category to add to
             keyword: Keyword to add
             
@@ -181,7 +308,8 @@ class MongoDBManager:
             
         try:
             # If the user already has a categories field, it adds the keyword to that corresponding category
-            result = self.db['categories'].update_one(
+            # (in the users collection, where get_user_categories reads them from)
+            result = self.users_collection.update_one(
                 {'google_id': google_id, f"categories.{category}": {'$exists': True}},
                 {'$addToSet': {f"categories.{category}": keyword}}
             )
@@ -189,7 +317,7 @@ class MongoDBManager:
             # If there is no categories field, it creates the categories field and adds the keyword to it
             if result.matched_count == 0:
                 # Category doesn't exist, create it
-                self.db['categories'].update_one(
+                self.users_collection.update_one(
                     {'google_id': google_id},
                     {'$set': {f"categories.{category}": [keyword]}},
                     upsert=True
@@ -202,6 +330,110 @@ class MongoDBManager:
             return False
         
 
+    @metrics.timed("db.get_bank_link")
+    def get_bank_link(
+        self,
+        google_id: str
+        ) -> Dict[str, Any]:
+        """
+        Get a user's linked bank accounts and any requisition still waiting for the bank
+
+        Args:
+            google_id: Google ID of the user to lookup
+
+        Returns:
+            Dictionary with the linked "accounts" ids and, while linking, the pending
+            "requisition_id" and its "reference". Defaults to {} if the user never linked a bank
+        """
+        try:
+            user = self.users_collection.find_one({'google_id': google_id}, {'bank_link': 1})
+            return (user or {}).get('bank_link', {})
+        except PyMongoError as e:
+            logger.error(f"Error getting the bank link of {google_id}: {str(e)}")
+            return {}
+
+
+    @metrics.timed("db.save_bank_link")
+    def save_bank_link(
+        self,
+        google_id: str,
+        link: Dict[str, Any]
+        ) -> bool:
+        """
+        Save a user's linked bank accounts (see get_bank_link)
+
+        Args:
+            google_id: Google ID of the user to save for
+            link: Dictionary with the "accounts" and the pending "requisition_id" and "reference", if any
+
+        Returns:
+            True if operation was successful
+        """
+        try:
+            self.users_collection.update_one(
+                {'google_id': google_id},
+                {'$set': {'bank_link': link}},
+                upsert=True
+            )
+            return True
+        except PyMongoError as e:
+            st.error(f"Error saving bank accounts: {str(e)}")
+            logger.log("ERROR", str(e))
+            return False
+
+
+    @metrics.timed("db.get_sync_cursors")
+    def get_sync_cursors(
+        self,
+        google_id: str
+        ) -> Dict[str, Dict[str, Any]]:
+        """
+        Get where the last bank-feed sync stopped for each of a user's accounts
+
+        Args:
+            google_id: Google ID of the user to lookup
+
+        Returns:
+            Dictionary of account id to cursor ({"date_from": ..., "seen_ids": [...]})
+            Defaults to {} if the user never synced
+        """
+        try:
+            user = self.users_collection.find_one({'google_id': google_id}, {'bank_sync_cursors': 1})
+            return (user or {}).get('bank_sync_cursors', {})
+        except PyMongoError as e:
+            logger.error(f"Error getting sync cursors for {google_id}: {str(e)}")
+            return {}
+
+
+    @metrics.timed("db.save_sync_cursors")
+    def save_sync_cursors(
+        self,
+        google_id: str,
+        cursors: Dict[str, Dict[str, Any]]
+        ) -> bool:
+        """
+        Save the bank-feed sync cursors of a user's accounts
+
+        Args:
+            google_id: Google ID of the user to save for
+            cursors: Dictionary of account id to cursor
+
+        Returns:
+            True if operation was successful
+        """
+        try:
+            # Only the synced accounts are set, cursors of other accounts are left alone
+            self.users_collection.update_one(
+                {'google_id': google_id},
+                {'$set': {f'bank_sync_cursors.{account_id}': cursor for account_id, cursor in cursors.items()}},
+                upsert=True
+            )
+            return True
+        except PyMongoError as e:
+            logger.log("ERROR", str(e))
+            return False
+
+
     def display_user_info(self, username: str) -> str:
         """
         Returns a string representation of a user's data for debugging/display purposes.
@@ -0,0 +1,208 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+import os
+
+
+# Upper bounds (in seconds) of the latency histogram buckets, matching the Prometheus client defaults plus a few slower ones for LLM calls
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+
+# Number of recent samples kept per operation to work out p50/p95/p99
+SAMPLE_WINDOW = 2048
+
+# The page that is currently running in this script thread, so DB/LLM helpers don't need to be told where they were called from
+current_page: ContextVar[str] = ContextVar("current_page", default="app")
+
+
+class LatencyHistogram:
+    """Cumulative bucket counts for Prometheus plus a window of recent samples for percentiles"""
+
+    def __init__(self) -> None:
+        self.bucket_counts = [0] * len(LATENCY_BUCKETS)
+        self.count = 0
+        self.total = 0.0
+        self.samples = deque(maxlen=SAMPLE_WINDOW)
+
+    def observe(self, seconds: float) -> None:
+        self.count += 1
+        self.total += seconds
+        self.samples.append(seconds)
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if seconds <= bound:
+                self.bucket_counts[i] += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class Metrics:
+    """
+    Process-wide metrics registry.
+
+    Every metric is labelled by page and operation. Operations are timed with
+    `track` (context manager) or `timed` (decorator), which record a latency
+    histogram, an ok/error counter and an in-flight gauge.
+    """
+
+    def __init__(self, namespace: str = "finance_app") -> None:
+        self.namespace = namespace
+        self.lock = threading.Lock()
+        self.histograms: Dict[Tuple[str, str], LatencyHistogram] = {}
+        self.counters: Dict[Tuple[str, str, str], float] = {}
+        self.in_flight: Dict[Tuple[str, str], int] = {}
+
+
+    def set_page(self, page: str) -> None:
+        """Set the page label used by every operation recorded on this script run"""
+        current_page.set(page)
+
+
+    def increment(self, name: str, operation: str, amount: float = 1, page: Optional[str] = None) -> None:
+        """Increment the counter `name` for an operation"""
+        key = (name, page or current_page.get(), operation)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+
+    def observe(self, operation: str, seconds: float, page: Optional[str] = None, status: str = "ok") -> None:
+        """Record the latency of a finished operation"""
+        key = (page or current_page.get(), operation)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.observe(seconds)
+            counter_key = (f"operations_{status}", *key)
+            self.counters[counter_key] = self.counters.get(counter_key, 0) + 1
+
+
+    @contextmanager
+    def track(self, operation: str, page: Optional[str] = None) -> Iterator[None]:
+        """Time the wrapped block, counting it as an error if it raises"""
+        key = (page or current_page.get(), operation)
+        with self.lock:
+            self.in_flight[key] = self.in_flight.get(key, 0) + 1
+
+        status = "ok"
+        t1 = time.perf_counter()
+        try:
+            yield
+        except BaseException:
+            status = "error"
+            raise
+        finally:
+            self.observe(operation, time.perf_counter() - t1, page=key[0], status=status)
+            with self.lock:
+                self.in_flight[key] -= 1
+
+
+    def timed(self, operation: Optional[str] = None, page: Optional[str] = None):
+        """Decorator version of `track`, the operation defaults to the function name"""
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.track(operation or func.__name__, page=page):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+
+    def summary(self) -> List[Dict[str, object]]:
+        """One row per (page, operation) with call counts and latency percentiles in milliseconds"""
+        rows = []
+        with self.lock:
+            for (page, operation), histogram in sorted(self.histograms.items()):
+                to_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 2)
+                rows.append({
+                    "page": page,
+                    "operation": operation,
+                    "calls": histogram.count,
+                    "errors": int(self.counters.get(("operations_error", page, operation), 0)),
+                    "in_flight": self.in_flight.get((page, operation), 0),
+                    "mean_ms": to_ms(histogram.total / histogram.count) if histogram.count else None,
+                    "p50_ms": to_ms(histogram.percentile(0.50)),
+                    "p95_ms": to_ms(histogram.percentile(0.95)),
+                    "p99_ms": to_ms(histogram.percentile(0.99)),
+                })
+        return rows
+
+
+    def to_prometheus(self) -> str:
+        """Render every metric in the Prometheus text exposition format"""
+        prefix = self.namespace
+        labels = lambda page, operation: f'page="{_escape(page)}",operation="{_escape(operation)}"'
+        lines = []
+
+        with self.lock:
+            lines.append(f"# HELP {prefix}_operation_duration_seconds Latency of timed operations")
+            lines.append(f"# TYPE {prefix}_operation_duration_seconds histogram")
+            for (page, operation), histogram in sorted(self.histograms.items()):
+                for bound, count in zip(LATENCY_BUCKETS, histogram.bucket_counts):
+                    lines.append(f'{prefix}_operation_duration_seconds_bucket{{{labels(page, operation)},le="{bound}"}} {count}')
+                lines.append(f'{prefix}_operation_duration_seconds_bucket{{{labels(page, operation)},le="+Inf"}} {histogram.count}')
+                lines.append(f"{prefix}_operation_duration_seconds_sum{{{labels(page, operation)}}} {histogram.total}")
+                lines.append(f"{prefix}_operation_duration_seconds_count{{{labels(page, operation)}}} {histogram.count}")
+
+            lines.append(f"# HELP {prefix}_operation_in_flight Operations currently running")
+            lines.append(f"# TYPE {prefix}_operation_in_flight gauge")
+            for (page, operation), value in sorted(self.in_flight.items()):
+                lines.append(f"{prefix}_operation_in_flight{{{labels(page, operation)}}} {value}")
+
+            for name in sorted({key[0] for key in self.counters}):
+                lines.append(f"# TYPE {prefix}_{name}_total counter")
+                for (counter_name, page, operation), value in sorted(self.counters.items()):
+                    if counter_name == name:
+                        lines.append(f"{prefix}_{name}_total{{{labels(page, operation)}}} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+    def write_prometheus_file(self, path: str = "logs/metrics.prom") -> str:
+        """Write the metrics to a text file (e.g. for the node_exporter textfile collector)"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as f:
+            f.write(self.to_prometheus())
+        # Rename so a scraper never reads a half-written file
+        os.replace(temp_path, path)
+        return path
+
+
+    def start_http_server(self, port: int = 9464, host: str = "127.0.0.1") -> ThreadingHTTPServer:
+        """Serve the metrics on http://host:port/metrics from a daemon thread"""
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Initialising the default metrics registry
+metrics = Metrics()
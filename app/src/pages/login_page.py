@@ -1,6 +1,5 @@
 import streamlit as st
 from streamlit_oauth import OAuth2Component
-import jwt
 import os
 from datetime import datetime, timedelta
 from functools import wraps
@@ -10,7 +9,9 @@ import json
 # Static typing
 from typing import Optional, Dict, Any
 # DB and Session Management
-from src.login import auth_manager, db_manager
+from src.login import auth_manager, db_manager, google_token_verifier
+from src.metrics import metrics
+from src.tracing import tracer
 
 
 # Google OAuth Configuration
@@ -18,6 +19,7 @@ GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID")
 GOOGLE_CLIENT_SECRET = os.getenv("GOOGLE_CLIENT_SECRET")
 REDIRECT_URI = "http://localhost:8501"  # Change for production
 
+metrics.set_page("login_page")
 
 
 # --- Decorators ---
@@ -31,7 +33,7 @@ def login_required(func):
             st.stop()
             
         try:
-            token_data: Optional[TokenData] = auth_manager.verify_token(st.session_state.token)
+            token_data: Optional[TokenData] = auth_manager.verify_session_token(st.session_state)
             if not token_data:
                 st.error("Invalid or expired session")
                 login_page()
@@ -57,7 +59,9 @@ def login_page() -> None:
     # Redirect if already logged in
     if st.session_state.token:
         try:
-            if auth_manager.verify_token(st.session_state.token):
+            with tracer.span("verify_token"):
+                token_data = auth_manager.verify_session_token(st.session_state)
+            if token_data:
                 st.rerun()
         except ValueError:
             pass
@@ -65,40 +69,41 @@ def login_page() -> None:
 
     st.subheader("Sign in with Google")
 
-    oauth2 = OAuth2Component(
-        client_id=os.environ["GOOGLE_CLIENT_ID"],
-        client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
-        authorize_endpoint="https://accounts.google.com/o/oauth2/v2/auth",
-        token_endpoint="https://oauth2.googleapis.com/token",
-        refresh_token_endpoint="https://oauth2.googleapis.com/token",
-        revoke_token_endpoint="https://oauth2.googleapis.com/revoke"
-    )
+    with tracer.span("google_oauth_component"):
+        oauth2 = OAuth2Component(
+            client_id=os.environ["GOOGLE_CLIENT_ID"],
+            client_secret=os.environ["GOOGLE_CLIENT_SECRET"],
+            authorize_endpoint="https://accounts.google.com/o/oauth2/v2/auth",
+            token_endpoint="https://oauth2.googleapis.com/token",
+            refresh_token_endpoint="https://oauth2.googleapis.com/token",
+            revoke_token_endpoint="https://oauth2.googleapis.com/revoke"
+        )
 
-    redirect_uri = os.environ["GOOGLE_REDIRECT_URI"]
-    scope = "openid email profile"
+        redirect_uri = os.environ["GOOGLE_REDIRECT_URI"]
+        scope = "openid email profile"
 
-    google_API_result = oauth2.authorize_button(
-        name="Continue with Google",
-        redirect_uri=redirect_uri,
-        scope=scope,
-        icon=None,
-        use_container_width=True,
-        key="google-login",
-        pkce="S256",
-        extras_params={"prompt": "consent", "access_type": "offline"}
-    )
+        google_API_result = oauth2.authorize_button(
+            name="Continue with Google",
+            redirect_uri=redirect_uri,
+            scope=scope,
+            icon=None,
+            use_container_width=True,
+            key="google-login",
+            pkce="S256",
+            extras_params={"prompt": "consent", "access_type": "offline"}
+        )
 
 
 
     if google_API_result and 'token' in google_API_result:
         try:
-            id_token = jwt.decode(
-                google_API_result['token']['id_token'],
-                options={"verify_signature": False}
-            )
+            # Checked against Google's (cached) signing keys, audience and issuer before it is trusted
+            with tracer.span("verify_google_id_token"):
+                id_token = google_token_verifier.verify(google_API_result['token']['id_token'])
         
             # Get or create user in db
-            user = db_manager.get_or_create_user_from_google(id_token)
+            with tracer.span("get_or_create_user_from_google"):
+                user = db_manager.get_or_create_user_from_google(id_token)
 
             # Create session
             st.session_state.user = {
@@ -109,9 +114,21 @@ def login_page() -> None:
             }
 
             # Create JWT token
-            st.session_state.token = auth_manager.create_token(
-                google_id=id_token["sub"],
-                email=id_token["email"],
+            with tracer.span("create_token"):
+                st.session_state.token = auth_manager.create_token(
+                    google_id=id_token["sub"],
+                    email=id_token["email"],
+                )
+
+            # The dashboard starts warming up in the background while the user is redirected
+            from src.precompute import precompute_worker
+            google_id = id_token["sub"]
+            precompute_worker.submit(
+                google_id,
+                db_manager.get_user_categories(google_id),
+                db_manager.get_user_rules(google_id),
+                deltas=precompute_worker.bank_feed_deltas(db_manager, google_id),
+                persist=True
             )
 
             st.rerun()
@@ -127,7 +144,9 @@ def main() -> None:
         login_page()
     else:
         try:
-            if auth_manager.verify_token(st.session_state.token):
+            with tracer.span("verify_token"):
+                token_data = auth_manager.verify_session_token(st.session_state)
+            if token_data:
                 return
             login_page()
 
@@ -136,4 +155,5 @@ def main() -> None:
             login_page()
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    with tracer.run("login_page"):
+        main()
\ No newline at end of file
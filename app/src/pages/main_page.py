@@ -1,26 +1,50 @@
 import streamlit as st
 import pandas as pd
-import plotly.express as px
-import plotly.graph_objects as go
+import numpy as np
 import json
 import os
+import secrets
 from src.login import auth_manager, db_manager
 from src.logger import logger
+from src.metrics import metrics
+from src.tracing import tracer
+from src.dataset_store import dataset_store
+from src.export import EXPORT_FORMATS, export_server
+from src.precompute import precompute_worker
+from src.transactions.anomalies import FLAGS as ANOMALY_FLAGS, category_spikes, detect_anomalies
+from src.transactions.budgets import TABLE_COLUMNS as BUDGET_COLUMNS, budgets_from_table, budgets_to_table, forecast_month
+from src.transactions.currency import fx_rate_store
+from src.transactions.pipeline import TYPE_TO_DEBIT_CREDIT, build_aggregates, categories_version, categorise, clean_statement
+from src.transactions.recurring import detect_recurring_payments
+from src.transactions.rollups import ROLLING_WINDOWS, category_trends
+from src.transactions.rules import TABLE_COLUMNS, rules_from_table, rules_to_table
+from src.transactions.schema import TransactionSchemaError
 
 # LLM Categorisation
-from src.utils.llm_api import recategorise_transactions, ammend_transaction_categories 
+from src.utils.llm_api import stream_recategorise_transactions, ammend_transaction_categories 
 
 
 
 category_file = "app/src/pages/categories.json"
 
+metrics.set_page("main_page")
 
-if 'user' in st.session_state:
-    # Load user's categories from the DB
-    st.session_state.categories = db_manager.get_user_categories(st.session_state.user['google_id'])
-    logger.info("Saved the categories field to st.session_state")
-else:
-    st.session_state.categories = {"Uncategorised": []}
+# Totals are shown in the base currency (see src/transactions/currency.py)
+BASE_CURRENCY = fx_rate_store.base_currency
+
+
+def load_user_categories():
+    if 'user' in st.session_state:
+        # Load user's categories from the DB
+        st.session_state.categories = db_manager.get_user_categories(st.session_state.user['google_id'])
+        st.session_state.category_rules = db_manager.get_user_rules(st.session_state.user['google_id'])
+        st.session_state.budgets = db_manager.get_user_budgets(st.session_state.user['google_id'])
+        logger.info("Saved the categories field to st.session_state")
+    else:
+        # Without a user there is nowhere to load them from, so keep the ones made in this session
+        st.session_state.setdefault("categories", {"Uncategorised": []})
+        st.session_state.setdefault("category_rules", [])
+        st.session_state.setdefault("budgets", {})
 
 
         
@@ -30,51 +54,68 @@ def save_categories():
         logger.info("Saved user categories to DB")
 
 
+def save_rules():
+    if "user" in st.session_state:
+        db_manager.save_user_rules(st.session_state.user['google_id'], st.session_state.category_rules)
+        logger.info("Saved user rules to DB")
+
+
+def save_budgets():
+    if "user" in st.session_state:
+        db_manager.save_user_budgets(st.session_state.user['google_id'], st.session_state.budgets)
+        logger.info("Saved user budgets to DB")
+
+
+def current_categories_version():
+    """Key of everything categorisation depends on, the keyword categories and the rules"""
+    return categories_version(st.session_state.categories, st.session_state.get("category_rules"))
+
+
+@metrics.timed("categorisation.categorise_transactions")
 def categorise_transactions(df):
-    """Categorise transactions using the current category mapping"""
-    # Iterating through the categories and keywords, and mapping categories found in the mapping to the associated keywords, on the df
+    """Categorise transactions using the current category mapping and rules"""
+    return categorise(df, st.session_state.categories, st.session_state.get("category_rules"))
 
-    df["Category"] = "Uncategorised"
-    for category, keywords in st.session_state.categories.items():
-        if category == "Uncategorised" or not keywords:
-            continue
-        
-        lowered_keywords = [keyword.lower().strip() for keyword in keywords]
-        
-        for idx, row in df.iterrows():
-            description = row["Description"].lower().strip()
-            if description in lowered_keywords:
-                df.at[idx, "Category"] = category
+type_to_debit_credit = TYPE_TO_DEBIT_CREDIT
 
-    logger.info("Categorised transactions on the st.session_state.df")
-    return df  
 
-type_to_debit_credit = {
-    "CARD_PAYMENT": "Debit",
-    "ATM": "Debit",
-    "EXCHANGE": "Debit",  # depends, might need special handling
-    "TRANSFER": "Credit",
-    "TOPUP": "Credit",
-    "CARD_REFUND": "Credit",
-    "REWARD": "Credit"
-}
+def show_quarantined(summary, quarantined):
+    st.warning(summary)
+    with st.expander("Quarantined rows"):
+        st.dataframe(quarantined, use_container_width=True)
 
 
+def prepare_transactions(df):
+    """
+    Turn a raw statement (uploaded or synced from a bank feed) into the dashboard's frame
+
+    Raises:
+        TransactionSchemaError: If a required column is missing
+    """
+    df, report = clean_statement(df)
+    if not report.ok:
+        show_quarantined(report.summary(), report.quarantined.head(100))
+        metrics.increment("transactions_quarantined", "ingestion.load_transactions", len(report.quarantined))
+
+    metrics.increment("transactions_ingested", "ingestion.load_transactions", len(df))
+    #df["Completed Date"] = pd.to_datetime(df["Completed Date"], format="%d %b %Y") 
+    
+    # Mapping the categories on the df, with the associated keywords
+    # (Check the categorise_transactions function for more detail)
+    return categorise_transactions(df)
+
+
+@metrics.timed("ingestion.load_transactions")
 def load_transactions(file):
     try:
-        df = pd.read_excel(file)
-        # Changing columns from object type to string
-        df = df.astype({col: str for col in df.select_dtypes(include='object').columns})
-        print("read the excel file")
-        df.columns = [col.strip() for col in df.columns]
-        df["Credit/Debit"] = df["Type"].map(type_to_debit_credit)
-        #df["Completed Date"] = pd.to_datetime(df["Completed Date"], format="%d %b %Y") 
-        
-        # Mapping the categories on the df, with the associated keywords
-        # (Check the categorise_transactions function for more detail)
-        return categorise_transactions(df)
+        return prepare_transactions(pd.read_excel(file))
+    except TransactionSchemaError as e:
+        st.error(str(e))
+        metrics.increment("ingestion_failures", "ingestion.load_transactions")
+        return None
     except Exception as e:
         st.error(f"Error processing file: {str(e)}")
+        metrics.increment("ingestion_failures", "ingestion.load_transactions")
         return None
 
 def add_keyword_to_category(category, keyword):
@@ -84,7 +125,7 @@ def add_keyword_to_category(category, keyword):
     if keyword and keyword not in st.session_state.categories.get(category, []):
 
         # Making a list for the category and appending the new keyword, otherwise append the keyword to the existing list for that category
-        if keyword and keyword not in st.session_state.categories:
+        if category not in st.session_state.categories:
             st.session_state.categories[category] = []
         st.session_state.categories[category].append(keyword)
 
@@ -98,201 +139,787 @@ def add_keyword_to_category(category, keyword):
     
     return False
 
+def recategorise_dataset():
+    """Re-apply the session's categories to its current dataset in memory, without reading the file again"""
+    dataset = st.session_state.get("dataset")
+    if dataset is None:
+        return
+    with tracer.span("recategorise_dataset"):
+        # The stored frame is shared with other sessions, so the result goes into a new dataset
+        st.session_state.dataset = dataset_store.put(categorise_transactions(dataset.frame.copy()))
+        file_id, _ = st.session_state.get("statement_key", (None, None))
+        st.session_state.statement_key = (file_id, current_categories_version())
+
+
+@st.fragment
+def add_category_fragment():
+    # Category management section
+    col1, col2 = st.columns(2)
+    with col1:
+        new_category = st.text_input("New Category Name")
+    with col2:
+        st.write("") # For alignment 
+        add_button = st.button("Add Category")
+    
+    if add_button and new_category:
+        if new_category not in st.session_state.categories:
+            st.session_state.categories[new_category] = []
+            save_categories()
+            # The editor's category options changed; the statement itself is still cached
+            st.rerun()
+
+
+@st.fragment
+def category_editor_fragment(dataset):
+    """Editing cells only reruns this fragment, applying the changes refreshes the aggregates"""
+    st.subheader("Your Expenses")
+    columns = ["Completed Date", "Description", "Amount", "Currency", "Category"]
+    debits_df = dataset.view("debits", columns=[column for column in columns if column in dataset.frame.columns])
+
+    with tracer.span("detect_anomalies"):
+        anomalies = anomalies_for(dataset.key, dataset)
+    debits_df = debits_df.assign(Anomaly=anomalies.to_numpy())
+
+    flagged = int((anomalies != "").sum())
+    shown = st.selectbox(
+        f"Show ({flagged} flagged)",
+        options=["All transactions", "Any anomaly", *ANOMALY_FLAGS],
+        key="anomaly_filter"
+    )
+    if shown == "Any anomaly":
+        debits_df = debits_df[debits_df["Anomaly"] != ""]
+    elif shown != "All transactions":
+        debits_df = debits_df[debits_df["Anomaly"].str.contains(shown, regex=False)]
+
+    with tracer.span("data_editor", rows=len(debits_df)):
+        edited_df = st.data_editor(
+            debits_df,
+            column_config={
+                "Completed Date": st.column_config.DateColumn("Completed Date", format="DD/MM/YYYY"),
+                "Amount": st.column_config.NumberColumn("Amount", format="%.2f"),
+                "Category": st.column_config.SelectboxColumn(
+                    "Category",
+                    options=list(st.session_state.categories.keys())
+                ),
+                "Anomaly": st.column_config.TextColumn(
+                    "Anomaly",
+                    help="Charges repeated within two days, or far above what the merchant (or category) usually charges"
+                )
+            },
+            disabled=["Anomaly"],
+            hide_index=True,
+            use_container_width=True,
+            key="category_editor"
+        )
+
+
+    # Save button to apply changes                  
+    save_button = st.button("Apply Changes", type="primary")
+    if save_button:
+        with tracer.span("apply_category_changes"):
+            changed = edited_df["Category"] != debits_df["Category"]
+            for idx, row in edited_df[changed].iterrows():
+                add_keyword_to_category(row["Category"], row["Description"])
+
+            if changed.any():
+                recategorise_dataset()
+                st.session_state.categories_updated = True
+                # The summary, chart and payments depend on the categories, so the whole page is refreshed
+                st.rerun()
+
+    if st.session_state.pop("categories_updated", False):
+        st.success("Categories Updated 😀")
+
+
+@st.fragment
+def expense_summary_fragment(dataset):
+    """Changing a filter only reruns the filters, summary and chart"""
+    debits_df = dataset.view("debits", columns=["Completed Date", "Description", "Base Amount", "Category"])
+
+    st.subheader('Expense Summary')
+    # Filters
+    col1, col2, col3 = st.columns(3)
+
+
+    # Filtering date ranges
+    with col1:
+        min_data = pd.to_datetime(debits_df["Completed Date"]).min()
+        max_data = pd.to_datetime(debits_df["Completed Date"]).max()
+        
+        date_range = st.date_input(
+            "Date Range",
+            value=(min_data, max_data),
+            min_value=min_data,
+            max_value=max_data
+        )
+
+
+    # Filtering categories
+    with col2:
+        all_categories = ["All"] + sorted(debits_df["Category"].unique().tolist())
+        selected_categories = st.multiselect(
+            "Select Categories",
+            options=all_categories,
+            default="All"
+        )
+
+        if "All" in selected_categories or not selected_categories:
+            selected_categories = all_categories[1:] # exclude "All" as it is added to the all_categories list
+    with col3:
+        search_term = st.text_input("Search Description")
+
+
+    # Filtering df based on the criteria
+    with metrics.track("filtering.filter_debits"), tracer.span("filter_debits"):
+        keep = np.ones(len(debits_df), dtype=bool)
+
+        # Filering df based on the selected date range
+        if len(date_range) == 2:
+            start_date, end_date = date_range
+            completed_dates = pd.to_datetime(debits_df["Completed Date"])
+            keep &= ((completed_dates >= pd.to_datetime(start_date)) & (completed_dates <= pd.to_datetime(end_date))).to_numpy()
+
+        # Filtering df based on the selected cateogires
+        keep &= debits_df["Category"].isin(selected_categories).to_numpy()
+
+        # Filtering df descriptions based on the search term
+        if search_term:
+            keep &= debits_df["Description"].str.contains(search_term, case=False, na=False).to_numpy()
+
+        dataset.set_view("filtered", dataset.positions("debits")[keep])
+        filtered_df = dataset.view("filtered", columns=["Category", "Base Amount"])
+
+    st.write(f"Showing {len(filtered_df)} of {len(debits_df)} transactions")
+
+    # Update summary to use filtered data
+    with tracer.span("expense_summary"):
+        # Without any filter the totals are the ones the background worker already built
+        aggregates = precompute_worker.aggregates(dataset.key) if len(filtered_df) == len(debits_df) else None
+        if aggregates is not None:
+            category_totals = aggregates["debit_category_totals"].copy()
+        else:
+            category_totals = filtered_df.groupby("Category")["Base Amount"].sum().abs().rename("Amount").reset_index()
+            category_totals = category_totals.sort_values("Amount", ascending=False)
+    
+    st.dataframe(
+        category_totals, 
+        column_config={
+         "Amount": st.column_config.NumberColumn("Amount", format=f"%.2f {BASE_CURRENCY}")   
+        },
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    st.metric("Total Filtered Expenses", f"{category_totals['Amount'].sum():,.2f} {BASE_CURRENCY}")
+    missing_rates = int(filtered_df["Base Amount"].isna().sum())
+    if missing_rates:
+        st.caption(f"{missing_rates} transactions have no {BASE_CURRENCY} exchange rate and aren't included, add their rates to {fx_rate_store.path}")
+    
+    with tracer.span("plotly_pie_render"):
+        # Imported here so pages that never draw a chart don't pay for plotly
+        import plotly.express as px
+
+        category_totals["Amount"] = pd.to_numeric(category_totals["Amount"], errors='coerce')
+        fig = px.pie(
+            category_totals,
+            values="Amount",
+            names="Category",
+            title="Expenses by Category"
+        )
+        fig.update_layout(template="plotly_dark")
+        fig.update_traces(
+            textfont=dict(color='black'),  # Dark text for labels
+            marker=dict(line=dict(color='#000000', width=1))  # Dark borders
+        )
+
+        st.plotly_chart(fig, use_container_width=True, theme="streamlit")
+
+    export_controls(dataset)
+
+
+def export_controls(dataset):
+    """Download links for the filtered expenses, streamed by the export server (see src/export.py)"""
+    st.subheader("Export")
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        fmt = st.selectbox("Format", options=list(EXPORT_FORMATS), format_func=str.upper, key="export_format")
+    with col2:
+        what = st.radio(
+            "Contents",
+            options=["Filtered transactions", "Monthly summary"],
+            key="export_contents",
+            disabled=fmt == "xlsx",
+            help="Excel exports have both, on separate sheets"
+        )
+    with col3:
+        st.write("")  # For alignment
+        create_link = st.button("Create download link")
+
+    if create_link:
+        # The link exports the filter as it is now, a new filter needs a new link
+        try:
+            st.session_state.export_link = export_server.register(
+                dataset.key,
+                dataset.positions("filtered"),
+                fmt,
+                file_name="monthly_summary" if what == "Monthly summary" and fmt != "xlsx" else "expenses",
+                summary=what == "Monthly summary"
+            )
+        except ValueError as e:
+            st.error(str(e))
+            st.session_state.pop("export_link", None)
+
+    if st.session_state.get("export_link"):
+        st.link_button("Download", st.session_state.export_link, type="primary")
+        st.caption(f"The link exports the filters as they were when it was created, and works for {export_server.ttl / 60:.0f} minutes")
+
+
+def payments_summary(dataset):
+    st.subheader("Payments Summary")
+    with tracer.span("payments_summary"):
+        credits_df = dataset.view("credits")
+        total_payments = credits_df["Base Amount"].sum()
+        st.metric("Total Payments", f"{total_payments:,.2f} {BASE_CURRENCY}")
+        st.write(credits_df)
+
+
+@st.fragment
+def ai_categorisation_fragment(dataset):
+    """Typing habits or calling the LLM only reruns this tab until new categories are applied"""
+    user_habits = st.text_input("Enter your habits to create more accurate categories for transactions")
+
+    ai_categorisation_button = st.button("Create the categories and keywords with AI")
+    if ai_categorisation_button:
+        transaction_descriptions = dataset.frame['Description'].unique()
+
+        # Categories are shown and applied as soon as each one is streamed back by the LLM
+        streamed_categories_placeholder = st.empty()
+        new_category_keywords = {"Uncategorised": []}
+        with tracer.span("llm_recategorise", descriptions=len(transaction_descriptions)):
+            for category, keywords in stream_recategorise_transactions(transaction_descriptions=transaction_descriptions, habits=user_habits):
+                new_category_keywords[category] = keywords
+                st.session_state.categories = new_category_keywords
+                streamed_categories_placeholder.json(new_category_keywords, expanded=False)
+
+        # Only persist once the stream has finished, keeping whatever was parsed if it was cut short
+        if len(new_category_keywords) > 1:
+            save_categories()
+            recategorise_dataset()
+            st.session_state.ai_categories_updated = True
+            st.rerun()
+        else:
+            st.error("The AI didn't return any categories, please try again")
+
+
+    ammend_category_keyword_button = st.button("Ammend the classification made by the LLM")
+
+    if ammend_category_keyword_button:
+        with tracer.span("llm_ammend_categories"):
+            new_category_keywords = ammend_transaction_categories(category_keyword_json=st.session_state.categories, habits=user_habits)
+
+        # A failed request returns None, which must never overwrite the user's categories
+        if new_category_keywords:
+            st.session_state.categories = new_category_keywords
+            save_categories()
+            logger.info("Saved the categories ammended by the LLM")
+            recategorise_dataset()
+            st.session_state.ai_categories_updated = True
+            st.rerun()
+        else:
+            st.error("The AI couldn't ammend your categories right now, please try again later")
+
+
+    if st.session_state.pop("ai_categories_updated", False):
+        st.write(json.dumps(st.session_state.categories, indent=4, sort_keys=True))
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def anomalies_for(dataset_key, _dataset):
+    """Anomaly flags of the dataset's debits, in the debits view's order (`_dataset` isn't hashed)"""
+    with metrics.track("analysis.detect_anomalies"):
+        columns = ["Completed Date", "Description", "Amount", "Currency", "Base Amount", "Category"]
+        debits = _dataset.view("debits", columns=[column for column in columns if column in _dataset.frame.columns])
+        return detect_anomalies(debits)
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def recurring_payments_for(dataset_key, _dataset):
+    """Detection only depends on the statement, so it runs once per dataset (`_dataset` isn't hashed)"""
+    with metrics.track("analysis.detect_recurring_payments"):
+        debits = _dataset.view("debits", columns=["Completed Date", "Description", "Base Amount"])
+        return detect_recurring_payments(debits.rename(columns={"Base Amount": "Amount"}))
+
+
+@st.fragment
+def recurring_payments_fragment(dataset):
+    """Changing the confidence or showing lapsed payments only reruns this tab"""
+    st.subheader("Recurring Payments")
+    with tracer.span("detect_recurring_payments"):
+        recurring = recurring_payments_for(dataset.key, dataset)
+
+    if recurring.empty:
+        st.write("No subscriptions or recurring bills found in this statement")
+        return
+
+    col1, col2 = st.columns(2)
+    with col1:
+        min_confidence = st.slider("Minimum confidence", min_value=0.5, max_value=1.0, value=0.6, step=0.05)
+    with col2:
+        st.write("") # For alignment 
+        show_lapsed = st.toggle("Show lapsed payments", value=False)
+
+    shown = recurring[(recurring["Confidence"] >= min_confidence) & (recurring["Active"] | show_lapsed)]
+    active = shown[shown["Active"]]
+
+    col1, col2 = st.columns(2)
+    col1.metric("Active recurring payments", len(active))
+    col2.metric("Estimated monthly cost", f"{active['Monthly Cost'].sum():,.2f} {BASE_CURRENCY}")
+
+    st.dataframe(
+        shown,
+        column_config={
+            "Typical Amount": st.column_config.NumberColumn("Typical Amount", format=f"%.2f {BASE_CURRENCY}"),
+            "Monthly Cost": st.column_config.NumberColumn("Monthly Cost", format=f"%.2f {BASE_CURRENCY}"),
+            "Confidence": st.column_config.ProgressColumn("Confidence", min_value=0.0, max_value=1.0, format="%.2f"),
+            "Last Charge": st.column_config.DateColumn("Last Charge", format="DD/MM/YYYY"),
+            "Next Charge": st.column_config.DateColumn("Next Charge", format="DD/MM/YYYY"),
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def aggregates_for(dataset_key, _dataset):
+    """The background worker's aggregates of a dataset, or built here once per dataset (`_dataset` isn't hashed)"""
+    aggregates = precompute_worker.aggregates(dataset_key)
+    if aggregates is not None:
+        return aggregates
+    with metrics.track("analysis.build_aggregates"):
+        return build_aggregates(_dataset.frame)
+
+
+@st.fragment
+def trends_fragment(dataset):
+    """Month-over-month trends, read from the monthly rollups so a long history costs the same as a short one"""
+    st.subheader("Spending Trends")
+    with tracer.span("monthly_rollups"):
+        aggregates = aggregates_for(dataset.key, dataset)
+    averages = aggregates["rolling_category_averages"]
+
+    if averages.empty:
+        st.write("No expenses in this statement yet")
+        return
+
+    months = sorted(averages["Month"].unique(), reverse=True)
+    col1, col2 = st.columns(2)
+    with col1:
+        month = pd.Timestamp(st.selectbox("Month", options=months, format_func=lambda month: pd.Timestamp(month).strftime("%B %Y")))
+    trends = category_trends(averages, month)
+    spikes = category_spikes(aggregates["month_category"])
+    spikes = spikes[spikes["Month"] == month].set_index("Category")["Spike"]
+    trends["Spike"] = trends["Category"].map(spikes).fillna(False).astype(bool)
+
+    with col2:
+        total, previous_total = trends["Amount"].sum(), trends["Previous Month"].sum()
+        st.metric(
+            "Total expenses",
+            f"{total:,.2f} {BASE_CURRENCY}",
+            delta=f"{total - previous_total:,.2f} {BASE_CURRENCY} on the month before",
+            delta_color="inverse"
+        )
+
+    amount_format = f"%.2f {BASE_CURRENCY}"
+    st.dataframe(
+        trends[trends[["Amount", "Previous Month"]].any(axis=1)],
+        column_config={
+            "Amount": st.column_config.NumberColumn(pd.Timestamp(month).strftime("%B %Y"), format=amount_format),
+            "Previous Month": st.column_config.NumberColumn("Previous Month", format=amount_format),
+            "Change": st.column_config.NumberColumn("Change", format="percent"),
+            "Spike": st.column_config.CheckboxColumn("Spike", help="Far above the category's previous 12 months"),
+            **{
+                f"Avg {window}M": st.column_config.NumberColumn(f"{window}-month average", format=amount_format)
+                for window in ROLLING_WINDOWS
+            },
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+
+    with tracer.span("plotly_trends_render"):
+        import plotly.express as px
+
+        ranked = trends["Category"].tolist()
+        selected = st.multiselect("Categories", options=sorted(ranked), default=ranked[:5])
+        measure = st.radio(
+            "Show",
+            options=["Amount", *[f"Avg {window}M" for window in ROLLING_WINDOWS]],
+            format_func=lambda column: "Monthly spend" if column == "Amount" else f"{column[4:-1]}-month average",
+            horizontal=True
+        )
+        fig = px.line(
+            averages[averages["Category"].isin(selected)],
+            x="Month",
+            y=measure,
+            color="Category",
+            markers=True,
+            labels={measure: f"Amount ({BASE_CURRENCY})"},
+            title="Monthly Expenses by Category"
+        )
+        fig.update_layout(template="plotly_dark")
+        st.plotly_chart(fig, use_container_width=True, theme="streamlit")
+
+    month_type = aggregates["month_type"]
+    by_type = month_type[month_type["Month"] == month].drop(columns="Month").sort_values("Amount")
+    st.write("By transaction type")
+    st.dataframe(
+        by_type,
+        column_config={"Amount": st.column_config.NumberColumn("Amount", format=amount_format)},
+        hide_index=True,
+        use_container_width=True
+    )
+
+
+@st.cache_data(max_entries=32, show_spinner=False)
+def forecast_for(dataset_key, _dataset):
+    """This month's forecast, from the dataset's rollups and recurring payments (`_dataset` isn't hashed)"""
+    recurring = recurring_payments_for(dataset_key, _dataset)
+    with metrics.track("analysis.forecast_month"):
+        if not recurring.empty:
+            # Recurring payments are shown by merchant, their category is the one of the merchant's latest charge
+            debits = _dataset.view("debits", columns=["Description", "Category"])
+            merchant_categories = debits.drop_duplicates("Description", keep="last").set_index("Description")["Category"]
+            recurring = recurring.assign(Category=recurring["Merchant"].map(merchant_categories).fillna("Uncategorised"))
+        return forecast_month(aggregates_for(dataset_key, _dataset)["day_category"], recurring)
+
+
+@st.fragment
+def budgets_fragment(dataset):
+    """Budgets only change the comparison, the forecast itself is cached per dataset"""
+    st.subheader("Budgets")
+    with tracer.span("forecast_month"):
+        forecast = forecast_for(dataset.key, dataset)
+
+    if forecast is None:
+        st.write("No transactions to forecast from yet")
+        return
+
+    budgets = st.session_state.get("budgets", {})
+    summary = forecast.summary(budgets)
+    budgeted = summary[summary["Budget"].notna()]
+    month_name = forecast.month.strftime("%B %Y")
+    st.caption(
+        f"{month_name} up to {forecast.as_of:%d/%m/%Y}, the latest transaction. The rest of the month is forecast from "
+        "the average spend of each weekday over the last six months, plus the recurring payments that are due."
+    )
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Spent this month", f"{summary['Spent'].sum():,.2f} {BASE_CURRENCY}")
+    col2.metric(
+        "Projected month-end spend",
+        f"{summary['Projected'].sum():,.2f} {BASE_CURRENCY}",
+        delta=None if budgeted.empty else f"{budgeted['Projected'].sum() - budgeted['Budget'].sum():,.2f} {BASE_CURRENCY} against budgets",
+        delta_color="inverse"
+    )
+    col3.metric("Projected net cash flow", f"{forecast.projected_net:,.2f} {BASE_CURRENCY}")
+
+    amount_format = f"%.2f {BASE_CURRENCY}"
+    st.dataframe(
+        summary,
+        column_config={
+            "Budget": st.column_config.NumberColumn("Budget", format=amount_format),
+            "Spent": st.column_config.NumberColumn("Spent", format=amount_format),
+            "Forecast": st.column_config.NumberColumn("Forecast", format=amount_format, help="Expected spend for the rest of the month"),
+            "Recurring": st.column_config.NumberColumn("Recurring", format=amount_format, help="Recurring payments due, part of the forecast"),
+            "Projected": st.column_config.NumberColumn("Projected", format=amount_format),
+            "Used": st.column_config.ProgressColumn("Used", min_value=0.0, max_value=1.0, format="percent"),
+            "Projected Used": st.column_config.NumberColumn("Projected Used", format="percent"),
+        },
+        hide_index=True,
+        use_container_width=True
+    )
+
+    with tracer.span("plotly_burn_down_render"):
+        import plotly.graph_objects as go
+
+        options = ["All budgeted categories", *budgeted["Category"]] if not budgeted.empty else list(summary["Category"])
+        shown = st.selectbox("Burn-down of", options=options)
+        if shown == "All budgeted categories":
+            categories, budget = list(budgeted["Category"]), float(budgeted["Budget"].sum())
+        else:
+            categories, budget = [shown], budgets.get(shown)
+        burn_down = forecast.burn_down(categories, budget)
+
+        fig = go.Figure()
+        fig.add_trace(go.Scatter(x=burn_down["Day"], y=burn_down["Spent"], name="Spent", mode="lines"))
+        fig.add_trace(go.Scatter(x=burn_down["Day"], y=burn_down["Projected"], name="Projected", mode="lines", line=dict(dash="dash")))
+        if budget is not None:
+            fig.add_hline(y=budget, line_dash="dot", annotation_text=f"Budget {budget:,.2f} {BASE_CURRENCY}")
+        fig.update_layout(template="plotly_dark", title=f"{shown} in {month_name}", yaxis_title=f"Amount ({BASE_CURRENCY})")
+        st.plotly_chart(fig, use_container_width=True, theme="streamlit")
+
+    st.write("Monthly budgets")
+    table = budgets_to_table(budgets, list(st.session_state.categories.keys()))
+    edited = st.data_editor(
+        table,
+        column_config={
+            "Category": st.column_config.TextColumn("Category", disabled=True),
+            "Monthly Budget": st.column_config.NumberColumn("Monthly Budget", min_value=0.0, format=amount_format),
+        },
+        column_order=BUDGET_COLUMNS,
+        hide_index=True,
+        use_container_width=True,
+        key="budgets_editor"
+    )
+    if st.button("Save Budgets", type="primary"):
+        try:
+            new_budgets = budgets_from_table(edited)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        if new_budgets != budgets:
+            st.session_state.budgets = new_budgets
+            save_budgets()
+            st.rerun(scope="fragment")
+
+
+@st.fragment
+def category_rules_fragment():
+    """Rules for what keywords can't express, e.g. transfers over an amount or weekend card payments"""
+    st.subheader("Categorisation Rules")
+    st.caption(
+        "A rule sets the category of the transactions matching all of its conditions. "
+        f"Amounts are absolute and in {BASE_CURRENCY}, the regex is searched in the description (ignoring case), "
+        "and when several rules match the highest priority wins. Rules always win over keywords."
+    )
+
+    table = rules_to_table(st.session_state.category_rules)
+    edited = st.data_editor(
+        table,
+        column_config={
+            "Category": st.column_config.SelectboxColumn("Category", options=list(st.session_state.categories.keys()), required=True),
+            "Priority": st.column_config.NumberColumn("Priority", step=1, default=100),
+            "Types": st.column_config.TextColumn("Types", help="e.g. TRANSFER, ATM"),
+            "Min Amount": st.column_config.NumberColumn("Min Amount", min_value=0.0, format="%.2f"),
+            "Max Amount": st.column_config.NumberColumn("Max Amount", min_value=0.0, format="%.2f"),
+            "From": st.column_config.DateColumn("From", format="DD/MM/YYYY"),
+            "To": st.column_config.DateColumn("To", format="DD/MM/YYYY"),
+            "Weekdays": st.column_config.TextColumn("Weekdays", help="e.g. Sat, Sun"),
+            "Days of Month": st.column_config.TextColumn("Days of Month", help="e.g. 1, 28"),
+            "Description Regex": st.column_config.TextColumn("Description Regex", help="e.g. ^tfl|uber"),
+        },
+        column_order=TABLE_COLUMNS,
+        num_rows="dynamic",
+        hide_index=True,
+        use_container_width=True,
+        key="rules_editor"
+    )
+
+    if st.button("Save Rules", type="primary"):
+        try:
+            rules = rules_from_table(edited)
+        except ValueError as e:
+            st.error(str(e))
+            return
+        if rules != st.session_state.category_rules:
+            st.session_state.category_rules = rules
+            save_rules()
+            with tracer.span("apply_rules"):
+                recategorise_dataset()
+            st.session_state.categories_updated = True
+            st.rerun()
+
+
+def render_dashboard(dataset):
+    tab1, tab2, tab3, tab4, tab5, tab6, tab7 = st.tabs(
+        ["Expenses (Debits)", "Payments (Credits)", "Trends", "Budgets", "Recurring Payments", "Rules", "AI Categorisation"]
+    )
+
+    with tab1:
+        add_category_fragment()
+        category_editor_fragment(dataset)
+        expense_summary_fragment(dataset)
+
+    with tab2:
+        payments_summary(dataset)
+
+    with tab3:
+        trends_fragment(dataset)
+
+    with tab4:
+        budgets_fragment(dataset)
+
+    with tab5:
+        recurring_payments_fragment(dataset)
+
+    with tab6:
+        category_rules_fragment()
+
+    with tab7:
+        ai_categorisation_fragment(dataset)
+
+
+def precompute_user_key():
+    """Signed-in users' dashboards are cached by their Google id, anyone else's only for their session"""
+    user = st.session_state.get("user")
+    if user:
+        return user["google_id"]
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    return f"session:{ctx.session_id if ctx else 'local'}"
+
+
+@st.fragment(run_every=0.5)
+def precompute_progress_fragment(user_key):
+    """Polls the background job, only this fragment reruns until the dashboard is ready"""
+    job = precompute_worker.job(user_key)
+    if job is None:
+        return
+    if job.finished:
+        # The full rerun picks the result up from the cache
+        st.rerun()
+    st.progress(job.progress, text=job.message)
+
+
+def use_precomputed_dashboard(user_key, source, statement_key, **job_args):
+    """
+    Put the precomputed dashboard for `statement_key` in the session, or start computing it in the background
+
+    Returns:
+        True if the session's dataset is ready to render
+    """
+    if st.session_state.get("dataset") is not None and st.session_state.get("statement_key") == statement_key:
+        return True
+
+    _, version = statement_key
+    with tracer.span("read_precomputed"):
+        result = precompute_worker.result(user_key, version, None if source == "history" else source)
+
+    if result is None:
+        retry = st.session_state.pop("retry_precompute", False)
+        job = precompute_worker.submit(
+            user_key, st.session_state.categories, st.session_state.get("category_rules"),
+            source=source, retry=retry, **job_args
+        )
+        if job.status == "failed":
+            st.error(f"Error processing your transactions: {job.error}")
+            if st.button("Try again"):
+                st.session_state.retry_precompute = True
+                st.rerun()
+        elif job.status != "empty":
+            precompute_progress_fragment(user_key)
+        return False
+
+    if result.quarantine_summary:
+        show_quarantined(result.quarantine_summary, result.quarantined)
+    # Sessions with the same statement share one frame, the session only keeps a handle to it
+    # and debits/credits/filtered rows are row positions into it
+    st.session_state.dataset = dataset_store.handle(result.dataset_key)
+    st.session_state.statement_key = statement_key
+    return True
+
+
+# Where the bank sends users back to once they have given access
+BANK_LINK_REDIRECT_URI = os.getenv("GOCARDLESS_REDIRECT_URI") or os.getenv("GOOGLE_REDIRECT_URI") or "http://localhost:8501"
+
+
+def finish_bank_link(google_id, link):
+    """Store the accounts a requisition linked, and rebuild the dashboard so their transactions are synced"""
+    from src.utils.gocardless_client import BankFeedError
+
+    try:
+        accounts = precompute_worker.bank_client().get_requisition_accounts(link["requisition_id"])
+    except BankFeedError as e:
+        st.error(f"Could not read your linked accounts: {str(e)}")
+        return
+    if not accounts:
+        st.info("Your bank hasn't given access to any accounts yet")
+        return
+
+    # The new accounts have no cursor yet, so the next sync pulls their transactions in full
+    db_manager.save_bank_link(google_id, {"accounts": list(dict.fromkeys([*link.get("accounts", []), *accounts]))})
+    precompute_worker.invalidate(precompute_user_key())
+    st.session_state.dataset = None
+    st.query_params.clear()
+    logger.info(f"Linked {len(accounts)} bank accounts for {google_id}")
+    st.rerun()
+
+
+def bank_accounts_sidebar(user):
+    """Linking bank accounts through GoCardless, whose new transactions are added to the user's history"""
+    client = precompute_worker.bank_client()
+    if client is None:
+        return
+    from src.utils.gocardless_client import BankFeedError
+
+    google_id = user["google_id"]
+    link = db_manager.get_bank_link(google_id)
+    with st.sidebar.expander("Bank accounts"):
+        st.write(f"{len(link.get('accounts', []))} linked accounts")
+
+        if link.get("requisition_id"):
+            # The bank sends the user back with the requisition's reference
+            if st.query_params.get("ref") == link.get("reference") or st.button("Check linked accounts"):
+                finish_bank_link(google_id, link)
+
+        institution_id = st.text_input("Bank", placeholder="GoCardless institution id, e.g. REVOLUT_REVOLT21")
+        if st.button("Link a bank account") and institution_id:
+            reference = secrets.token_urlsafe(16)
+            try:
+                requisition = client.create_requisition(institution_id.strip(), BANK_LINK_REDIRECT_URI, reference)
+            except BankFeedError as e:
+                st.error(f"Could not start linking your bank: {str(e)}")
+                return
+            db_manager.save_bank_link(google_id, {**link, "requisition_id": requisition["id"], "reference": reference})
+            st.session_state.bank_link_url = requisition["link"]
+
+        if st.session_state.get("bank_link_url"):
+            st.link_button("Give access at your bank", st.session_state.bank_link_url)
+
+
 def main():
     st.title("Simple Finance Dashboard")
     
 
-    if 'user' in st.session_state:
-        st.sidebar.success(f"Logged in as: {st.session_state.user['name']}")
+    user = st.session_state.get("user")
+    if user:
+        st.sidebar.success(f"Logged in as: {user['name']}")
+        bank_accounts_sidebar(user)
     else:
         st.sidebar.warning("Not logged in - categories won't be saved 🙃")
 
     uploaded_file = st.file_uploader("Upload your transaction CSV file", type=["xlsx"])
     st.session_state.uploaded_file_bool = True
 
+    # Parsing, categorising and summarising happen on the background worker (see src/precompute.py),
+    # the page reads the result, so full reruns only redo the work when the file or the categories change
+    user_key = precompute_user_key()
+    version = current_categories_version()
 
     if uploaded_file is not None:
-        df = load_transactions(uploaded_file)
-        
-        if df is not None:
-            debits_df = df[df["Credit/Debit"] == "Debit"].copy()
-            credits_df = df[df["Credit/Debit"] == "Credit"].copy()
-            
-            st.session_state.debits_df = debits_df.copy()
-            
-            tab1, tab2, tab3 = st.tabs(["Expenses (Debits)", "Payments (Credits)", "AI Categorisation"])
-
-            with tab1:
-                # Category management section
-                col1, col2 = st.columns(2)
-                with col1:
-                    new_category = st.text_input("New Category Name")
-                with col2:
-                    st.write("") # For alignment 
-                    add_button = st.button("Add Category")
-                
-                if add_button and new_category:
-                    if new_category not in st.session_state.categories:
-                        st.session_state.categories[new_category] = []
-                        save_categories()
-                        st.rerun()
-                
-
-                st.subheader("Your Expenses")
-                # Filters
-                col1, col2, col3 = st.columns(3)
-
-
-                # Filtering date ranges
-                with col1:
-                    min_data = pd.to_datetime(debits_df["Completed Date"]).min()
-                    max_data = pd.to_datetime(debits_df["Completed Date"]).max()
-                    
-                    date_range = st.date_input(
-                        "Date Range",
-                        value=(min_data, max_data),
-                        min_value=min_data,
-                        max_value=max_data
-                    )
-
-
-                # Filtering categories
-                with col2:
-                    all_categories = ["All"] + sorted(debits_df["Category"].unique().tolist())
-                    selected_categories = st.multiselect(
-                        "Select Categories",
-                        options=all_categories,
-                        default="All"
-                    )
-
-                    if "All" in selected_categories or not selected_categories:
-                        selected_categories = all_categories[1:] # exclude "All" as it is added to the all_categories list
-                with col3:
-                    search_term = st.text_input("Search Description")
-
-
-                # Filtering df based on the criteria
-                filtered_df = debits_df.copy()
-
-                # Filering df based on the selected date range
-                if len(date_range) == 2:
-                    start_date, end_date = date_range
-                    filtered_df = filtered_df[
-                        (pd.to_datetime(filtered_df["Completed Date"]) >= pd.to_datetime(start_date)) &
-                        (pd.to_datetime(filtered_df["Completed Date"]) <= pd.to_datetime(end_date))
-                    ]
-
-                # Filtering df based on the selected cateogires
-                filtered_df = filtered_df[filtered_df["Category"].isin(selected_categories)]
-
-                # Filtering df descriptions based on the search term
-                if search_term:
-                    filtered_df = filtered_df[
-                        filtered_df["Description"].str.contains(search_term, case=False)
-                    ]
-
-                st.write(f"Showing {len(filtered_df)} of {len(debits_df)} transactions")
-
-
-                edited_df = st.data_editor(
-                    st.session_state.debits_df[["Completed Date", "Description", "Amount", "Category"]],
-                    column_config={
-                        "Completed Date": st.column_config.DateColumn("Completed Date", format="DD/MM/YYYY"),
-                        "Amount": st.column_config.NumberColumn("Amount", format="%.2f GBP"),
-                        "Category": st.column_config.SelectboxColumn(
-                            "Category",
-                            options=list(st.session_state.categories.keys())
-                        )
-                    },
-                    hide_index=True,
-                    use_container_width=True,
-                    key="category_editor"
-                )
-
-
-                # Save button to apply changes                  
-                save_button = st.button("Apply Changes", type="primary")
-                if save_button:
-                    for idx, row in edited_df.iterrows():
-                        new_category = row["Category"]
-                        if new_category == st.session_state.debits_df.at[idx, "Category"]:
-                            continue
-                        
-                        description = row["Description"]
-                        st.session_state.debits_df.at[idx, "Category"] = new_category
-                        add_keyword_to_category(new_category, description)
-                    st.success("Categories Updated 😀")
-
-
-
-            
-                        
-                st.subheader('Expense Summary')
-                # Update summary to use filtered data
-                category_totals = filtered_df.groupby("Category")["Amount"].sum().abs().reset_index()
-                category_totals = category_totals.sort_values("Amount", ascending=False)
-                
-                st.dataframe(
-                    category_totals, 
-                    column_config={
-                     "Amount": st.column_config.NumberColumn("Amount", format="%.2f GBP")   
-                    },
-                    use_container_width=True,
-                    hide_index=True
-                )
-                
-                st.metric("Total Filtered Expenses", f"{category_totals['Amount'].sum():,.2f} GBP")
-                
-                category_totals["Amount"] = pd.to_numeric(category_totals["Amount"], errors='coerce')
-                fig = px.pie(
-                    category_totals,
-                    values="Amount",
-                    names="Category",
-                    title="Expenses by Category"
-                )
-                fig.update_layout(template="plotly_dark")
-                fig.update_traces(
-                    textfont=dict(color='black'),  # Dark text for labels
-                    marker=dict(line=dict(color='#000000', width=1))  # Dark borders
-                )
-
-                st.plotly_chart(fig, use_container_width=True, theme="streamlit")
-
-                st.session_state.credits_df = credits_df 
-
-            with tab2:
-                st.subheader("Payments Summary")
-                total_payments = credits_df["Amount"].sum()
-                st.metric("Total Payments", f"{total_payments:,.2f} GBP")
-                st.write(credits_df)
-
-            with tab3:
-
-                user_habits = st.text_input("Enter your habits to create more accurate categories for transactions")
-
-                ai_categorisation_button = st.button("Create the categories and keywords with AI")
-                if ai_categorisation_button:
-
-    
-                    #TODO: Change this to either merge with st.session_state.credits_df and debits_df or just save df to st.session_state
-                    transaction_descriptions = df['Description'].unique()
-                    new_category_keywords = recategorise_transactions(transaction_descriptions=transaction_descriptions, habits=user_habits)
-                    
-                    # This function only saves categories to DB but doesn't save them to session_state
-                    #TODO: Either get rid of this function or add a line to save categories to st.session_state
-                    db_manager.save_user_categories(st.session_state.user['google_id'], new_category_keywords)
-                    st.session_state.categories = new_category_keywords
-
-
-                ammend_category_keyword_button = st.button("Ammend the classification made by the LLM")
+        source = f"upload:{uploaded_file.file_id}"
+        ready = use_precomputed_dashboard(
+            user_key, source, (source, version),
+            statement=uploaded_file.getvalue(),
+            persist=bool(user)
+        )
+    elif user:
+        # Returning users see their last statement (plus anything new on their bank feeds) straight away
+        ready = use_precomputed_dashboard(
+            user_key, "history", ("history", version),
+            deltas=precompute_worker.bank_feed_deltas(db_manager, user["google_id"]),
+            persist=True
+        )
+    else:
+        ready = False
 
-                if ammend_category_keyword_button:
-                    new_category_keywords = ammend_transaction_categories(category_keyword_json=st.session_state.categories, habits=user_habits)
-                    logger.ingo
-                    db_manager.save_user_categories(st.session_state.user['google_id'], new_category_keywords)
-                    st.session_state.categories = new_category_keywords
+    if ready:
+        render_dashboard(st.session_state.dataset)
 
 
-                if ammend_category_keyword_button or ai_categorisation_button:
-                    st.write(json.dumps(st.session_state.categories, indent=4, sort_keys=True))
-main()
+if __name__ == '__main__':
+    # Each rerun is traced as a whole when TRACE_DIR is set (see src/tracing.py)
+    with tracer.run("main_page"):
+        with tracer.span("get_user_categories"):
+            load_user_categories()
+        main()
@@ -0,0 +1,37 @@
+import streamlit as st
+import pandas as pd
+import os
+from src.login import is_admin
+from src.metrics import metrics
+
+
+def metrics_admin_main():
+    st.title("Metrics")
+
+    if not is_admin():
+        st.error("Only admins (ADMIN_EMAILS) can see the metrics")
+        return
+
+    summary = metrics.summary()
+    if not summary:
+        st.info("No operations have been recorded yet")
+    else:
+        st.subheader("Latency per operation")
+        st.dataframe(pd.DataFrame(summary), use_container_width=True, hide_index=True)
+
+    prometheus_text = metrics.to_prometheus()
+
+    col1, col2 = st.columns(2)
+    with col1:
+        st.download_button("Download Prometheus metrics", prometheus_text, file_name="metrics.prom", mime="text/plain")
+    with col2:
+        if st.button("Write Prometheus text file"):
+            path = metrics.write_prometheus_file(os.getenv("METRICS_TEXTFILE", "logs/metrics.prom"))
+            st.success(f"Metrics written to {path}")
+
+    with st.expander("Raw Prometheus output"):
+        st.code(prometheus_text, language="text")
+
+
+if __name__ == '__main__':
+    metrics_admin_main()
@@ -1,16 +1,94 @@
 import streamlit as st
-import json
+import pandas as pd
+from src.dataset_store import dataset_store
+from src.login import is_admin
+from src.utils.memory_usage import (
+    active_session_states,
+    cache_entry_stats,
+    deep_size,
+    format_bytes,
+    preview,
+    process_rss_bytes,
+)
+
+
+def session_memory_table(state: dict) -> pd.DataFrame:
+    """One row per session key with its type and deep size, largest first"""
+    rows = [
+        {"key": key, "type": type(value).__name__, "bytes": deep_size(value)}
+        for key, value in state.items()
+    ]
+    table = pd.DataFrame(rows, columns=["key", "type", "bytes"]).sort_values("bytes", ascending=False)
+    table["size"] = table["bytes"].map(format_bytes)
+    return table
 
 
 def show_state_main():
-    for key, value in st.session_state.items():
-        if key == "categories":
-            value = json.dumps(value, indent=4, sort_keys=True)
-            st.write(f"{key}:")
-            st.json(value, expanded=False)
+    st.title("Session Diagnostics")
+
+    state = dict(st.session_state.items())
+    key_sizes = session_memory_table(state)
+    store_stats = dataset_store.stats()
+
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Process RSS", format_bytes(process_rss_bytes()))
+    col2.metric("This session", format_bytes(key_sizes["bytes"].sum()))
+    col3.metric(
+        "Shared datasets",
+        format_bytes(store_stats["bytes"]),
+        help=f"{store_stats['datasets']} datasets ({store_stats['referenced']} in use), budget {format_bytes(store_stats['budget_bytes'])}"
+    )
+
+    st.subheader("Session keys")
+    st.dataframe(key_sizes[["key", "type", "size"]], use_container_width=True, hide_index=True)
+
+    # Only small previews are sent to the browser, never whole frames
+    for key in key_sizes["key"]:
+        with st.expander(f"{key}"):
+            value_preview = preview(state[key])
+            if isinstance(value_preview, pd.DataFrame):
+                st.caption(f"First {len(value_preview)} of {len(state[key])} rows")
+                st.dataframe(value_preview, use_container_width=True)
+            elif isinstance(value_preview, (dict, list)):
+                st.json(value_preview, expanded=False)
+            else:
+                st.code(value_preview, language="text")
+
+    st.subheader("Caches")
+    cache_stats = cache_entry_stats()
+    if cache_stats:
+        cache_table = pd.DataFrame(cache_stats)
+        cache_table["size"] = cache_table["bytes"].map(format_bytes)
+        st.dataframe(cache_table[["cache", "function", "entries", "size"]], use_container_width=True, hide_index=True)
+        st.caption("st.cache_resource sizes are only measured when server.enableExpensiveMemoryStats is on")
+    else:
+        st.write("No cache entries")
+
+    st.subheader("All sessions")
+    # Other users' sessions are only listed to admins
+    if not is_admin():
+        st.caption("Only admins (ADMIN_EMAILS) can measure the other sessions")
+        return
+    # Sizing every session walks all of their state, so it only happens on request
+    if st.button("Measure all active sessions"):
+        rows = []
+        for session_id, session_state in active_session_states().items():
+            session_keys = session_memory_table(session_state)
+            largest = session_keys.iloc[0] if len(session_keys) else None
+            rows.append({
+                "session": session_id,
+                "keys": len(session_keys),
+                "bytes": int(session_keys["bytes"].sum()),
+                "largest key": None if largest is None else f"{largest['key']} ({largest['size']})",
+            })
+
+        if rows:
+            sessions_table = pd.DataFrame(rows).sort_values("bytes", ascending=False)
+            sessions_table["size"] = sessions_table["bytes"].map(format_bytes)
+            st.dataframe(sessions_table[["session", "keys", "size", "largest key"]], use_container_width=True, hide_index=True)
         else:
-            st.write(f"{key}: {value}")
+            st.write("Couldn't list the active sessions")
 
 
 if __name__ == '__main__':
-    show_state_main()
\ No newline at end of file
+    show_state_main()
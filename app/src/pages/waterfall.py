@@ -1,29 +1,36 @@
 import streamlit as st
+import numpy as np
 import pandas as pd
-import plotly.express as px
 import plotly.graph_objects as go
 import json
 import os
 from src.pages.main_page import load_transactions
+from src.metrics import metrics
+from src.tracing import tracer
+from src.transactions.currency import fx_rate_store
 
 
+@metrics.timed("render.create_waterfall_chart")
 def create_waterfall_chart(credits_df, debits_df):
     """Generate a Plotly waterfall chart from transaction data."""
 
-    df = pd.merge(credits_df, debits_df)
+    with tracer.span("combine_credits_debits"):
+        # Paired exchanges between pockets are in neither view, so they don't count as money in or out
+        df = pd.concat([credits_df, debits_df])[["Completed Date", "Description", "Credit/Debit", "Base Amount"]]
 
-    # Ensure 'Amount' is numeric and handle debits/credits
-    df["Amount"] = pd.to_numeric(df["Amount"], errors="coerce")
-    df["Amount"] = df.apply(
-        lambda row: -row["Amount"] if row["Credit/Debit"] == "Debit" else row["Amount"],
-        axis=1
-    )
+    with tracer.span("running_balance"):
+        # Everything in the base currency, rows without a known rate are left out like in the expense summary
+        base_amounts = pd.to_numeric(df["Base Amount"], errors="coerce")
+        df = df[base_amounts.notna()]
+        base_amounts = base_amounts[base_amounts.notna()]
+        # Debits always take money out, credits keep their sign (e.g. transfers out)
+        df = df.assign(Amount=np.where(df["Credit/Debit"] == "Debit", -base_amounts.abs(), base_amounts))
     
-    # Sort by date
-    df = df.sort_values("Completed Date")
+        # Sort by date
+        df = df.sort_values("Completed Date", kind="stable")
     
-    # Calculate running balance
-    df["Balance"] = df["Amount"].cumsum()
+        # Calculate running balance
+        df["Balance"] = df["Amount"].cumsum()
     
     # Create waterfall steps
     waterfall_df = pd.DataFrame({
@@ -33,51 +40,60 @@ def create_waterfall_chart(credits_df, debits_df):
         "Balance": df["Balance"]
     })
     
-    # Plotly waterfall
-    fig = go.Figure(go.Waterfall(
-        name="Balance",
-        orientation="v",
-        measure=["relative"] * (len(df) - 1) + ["total"],
-        x=waterfall_df["Date"].astype(str) + "<br>" + waterfall_df["Transaction"],
-        y=waterfall_df["Amount"],
-        textposition="outside",
-        text=waterfall_df["Amount"].apply(lambda x: f"+{x:.2f}" if x > 0 else f"{x:.2f}"),
-        connector={"line": {"color": "gray"}},
-    ))
+    with tracer.span("build_waterfall_figure"):
+        # Plotly checks lists element by element but numeric arrays at once, and formats the labels itself,
+        # which matters now that every transaction is a bar
+        measure = np.full(len(df), "relative", dtype=object)
+        measure[-1:] = "total"
+        fig = go.Figure(go.Waterfall(
+            name="Balance",
+            orientation="v",
+            measure=measure,
+            x=waterfall_df["Date"].astype(str) + "<br>" + waterfall_df["Transaction"],
+            y=waterfall_df["Amount"].to_numpy(),
+            textposition="outside",
+            texttemplate="%{y:+.2f}",
+            connector={"line": {"color": "gray"}},
+        ))
     
-    fig.update_layout(
-        title="Cash Flow Waterfall",
-        xaxis_title="Date & Transaction",
-        yaxis_title="Amount",
-        showlegend=False,
-        template="plotly_dark"  # Match your existing theme
-    )
+        fig.update_layout(
+            title="Cash Flow Waterfall",
+            xaxis_title="Date & Transaction",
+            yaxis_title=f"Amount ({fx_rate_store.base_currency})",
+            showlegend=False,
+            template="plotly_dark"  # Match your existing theme
+        )
     
     return fig
 
 
 
 def waterfall_chart_main():
+    metrics.set_page("waterfall")
     
 
 
       
 
-    if not st.session_state.uploaded_file_bool: 
+    dataset = st.session_state.get("dataset")
+    if dataset is None: 
         st.error("Please upload your personal finances file in the Main Dashboard")
-    elif st.session_state.uploaded_file_bool:
+    else:
         
-        credits_df = st.session_state.credits_df
-        debits_df = st.session_state.debits_df
+        credits_df = dataset.view("credits")
+        debits_df = dataset.view("debits")
 
         tab1, _ = st.tabs(["Expenses over time", "Nothing here yet"])
 
         with tab1:  # Or tab2, depending on where you want it
             st.subheader("Cash Flow Waterfall")
-            waterfall_fig = create_waterfall_chart(credits_df, debits_df)  # Pass your filtered DataFrame
-            st.plotly_chart(waterfall_fig, use_container_width=True, theme="streamlit")
+            with tracer.span("create_waterfall_chart", rows=len(credits_df) + len(debits_df)):
+                waterfall_fig = create_waterfall_chart(credits_df, debits_df)  # Pass your filtered DataFrame
+            with tracer.span("plotly_waterfall_render"):
+                st.plotly_chart(waterfall_fig, use_container_width=True, theme="streamlit")
 
 
 if __name__ == '__main__':
-    waterfall_chart_main()
+    with tracer.run("waterfall"):
+        waterfall_chart_main()
 
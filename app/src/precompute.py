@@ -0,0 +1,364 @@
+"""
+Background precomputation of dashboards.
+
+After a sign-in or an upload the page submits a job, and a worker thread
+reads the statement (or the user's stored history plus any bank-feed
+deltas), categorises it, builds the aggregates and puts the result in the
+dataset store. The page only shows the job's progress and then reads the
+result, so a returning user's first dashboard is a cache read.
+"""
+import hashlib
+import io
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+from src.dataset_store import DatasetHandle, dataset_store
+from src.logger import logger
+from src.metrics import metrics
+from src.transactions.pipeline import build_aggregates, categories_version, categorise, clean_statement, update_aggregates
+
+
+# Bumped whenever the stored frame's columns or aggregates change, older stored histories are ignored
+HISTORY_FORMAT = 3
+
+
+@dataclass
+class PrecomputeJob:
+    """Progress of one background job, read by the page while it runs"""
+    user_key: str
+    source: str
+    categories_version: str = field(repr=False)
+    status: str = "queued"  # queued, running, done, empty (nothing to show), failed
+    progress: float = 0.0
+    message: str = "Waiting for a worker"
+    error: Optional[str] = None
+    submitted_at: float = field(default_factory=time.monotonic)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "empty", "failed")
+
+    def update(self, progress: float, message: str) -> None:
+        self.status, self.progress, self.message = "running", progress, message
+
+
+@dataclass
+class PrecomputedDashboard:
+    """Everything the dashboard needs for a statement, ready to be read by a session"""
+    dataset_key: str
+    aggregates: Dict[str, pd.DataFrame]
+    categories_version: str
+    source: str
+    quarantine_summary: Optional[str] = None
+    quarantined: Optional[pd.DataFrame] = None
+    # Keeps the dataset in the store while the result is cached, sessions get their own handles
+    pin: Optional[DatasetHandle] = field(default=None, repr=False)
+
+
+class BankFeedDeltas:
+    """
+    New transactions on the accounts a user has linked (see bank_accounts_sidebar in the main page).
+
+    An account without a cursor yet is synced in full and gets its first one.
+    The advanced cursors are only stored by `commit`, once the history that
+    includes the new transactions has been saved, so a failed job doesn't lose them.
+    """
+
+    def __init__(self, client, cursor_store, google_id: str) -> None:
+        self.client = client
+        self.cursor_store = cursor_store
+        self.google_id = google_id
+        self.result = None
+
+    def fetch(self) -> pd.DataFrame:
+        cursors = self.cursor_store.get_sync_cursors(self.google_id)
+        linked = self.cursor_store.get_bank_link(self.google_id).get("accounts", [])
+        account_ids = list(dict.fromkeys([*linked, *cursors]))
+        if not account_ids:
+            return pd.DataFrame()
+        self.result = self.client.sync(account_ids, cursors)
+        return self.result.transactions
+
+    def commit(self) -> None:
+        if self.result is not None:
+            self.cursor_store.save_sync_cursors(
+                self.google_id,
+                {account_id: cursor.to_dict() for account_id, cursor in self.result.cursors.items()}
+            )
+
+
+class PrecomputeWorker:
+    """
+    Thread pool with a job per user and an LRU cache of the finished dashboards.
+
+    Results are kept in memory (their datasets pinned in the dataset store) for
+    the most recent `max_cached_users`, and signed-in users' results are also
+    written to `cache_dir` so they survive a restart. Finished jobs are dropped
+    with their result, and those without one (empty or failed) once there are
+    more than `max_cached_users` of them, oldest first.
+    """
+
+    def __init__(self, max_workers: int, cache_dir: str, max_cached_users: int) -> None:
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="precompute")
+        self.cache_dir = cache_dir
+        self.max_cached_users = max_cached_users
+        self.jobs: "OrderedDict[str, PrecomputeJob]" = OrderedDict()
+        self.results: "OrderedDict[str, PrecomputedDashboard]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._bank_client = None
+
+
+    def job(self, user_key: str) -> Optional[PrecomputeJob]:
+        with self.lock:
+            return self.jobs.get(user_key)
+
+
+    def result(self, user_key: str, version: str, source: Optional[str] = None) -> Optional[PrecomputedDashboard]:
+        """The cached dashboard of a user, if it was computed with these categories (and from this source, if given)"""
+        with self.lock:
+            result = self.results.get(user_key)
+            if result is None or result.categories_version != version or (source is not None and result.source != source):
+                return None
+            self.results.move_to_end(user_key)
+            return result
+
+
+    def aggregates(self, dataset_key: str) -> Optional[Dict[str, pd.DataFrame]]:
+        """Precomputed aggregates of a dataset, if a job built them"""
+        with self.lock:
+            for result in self.results.values():
+                if result.dataset_key == dataset_key:
+                    return result.aggregates
+        return None
+
+
+    def submit(
+        self,
+        user_key: str,
+        categories: Dict[str, List[str]],
+        rules: Optional[List[Dict[str, Any]]] = None,
+        source: str = "history",
+        statement: Optional[bytes] = None,
+        deltas: Optional[BankFeedDeltas] = None,
+        persist: bool = False,
+        retry: bool = False
+    ) -> PrecomputeJob:
+        """
+        Start computing a user's dashboard in the background
+
+        A job that is running (or finished, unless `retry`) for the same source
+        and categories is returned instead of starting another one.
+
+        Args:
+            user_key: Google id of a signed-in user, or a per-session key
+            categories: The user's categories, copied before the job starts
+            rules: The user's categorisation rules
+            source: What the dashboard is built from, e.g. "upload:<file id>" or "history"
+            statement: Contents of an uploaded statement, otherwise the stored history is used
+            deltas: New bank-feed transactions to add to the stored history
+            persist: Whether to store the result on disk as the user's history
+            retry: Start again even if the last job for this input finished (e.g. it failed)
+
+        Returns:
+            The job, whose progress the page can show
+        """
+        version = categories_version(categories, rules)
+        with self.lock:
+            existing = self.jobs.get(user_key)
+            if existing is not None and existing.source == source and existing.categories_version == version:
+                if not existing.finished:
+                    return existing
+                # Failed or empty jobs are only retried on request, finished ones as long as their result is cached
+                if existing.status != "done" and not retry:
+                    return existing
+                result = self.results.get(user_key)
+                if existing.status == "done" and result is not None and result.categories_version == version:
+                    return existing
+
+            job = PrecomputeJob(user_key=user_key, source=source, categories_version=version)
+            self.jobs.pop(user_key, None)
+            self.jobs[user_key] = job
+            self._evict_jobs()
+
+        categories = {category: list(keywords) for category, keywords in categories.items()}
+        rules = [dict(rule) for rule in rules or []]
+        self.executor.submit(self._run, job, categories, rules, statement, deltas, persist)
+        metrics.increment("precompute_jobs", "precompute.job")
+        return job
+
+
+    def _evict_jobs(self) -> None:
+        """Drop the oldest finished jobs without a cached result beyond `max_cached_users` (called with the lock held)"""
+        without_result = [
+            user_key for user_key, job in self.jobs.items()
+            if job.finished and user_key not in self.results
+        ]
+        for user_key in without_result[:max(0, len(without_result) - self.max_cached_users)]:
+            del self.jobs[user_key]
+
+
+    def _run(self, job: PrecomputeJob, categories, rules, statement, deltas, persist) -> None:
+        try:
+            with metrics.track("precompute.job"):
+                result = self._compute(job, categories, rules, statement, deltas, persist)
+        except Exception as e:
+            logger.error(f"Precomputing the dashboard for {job.user_key} failed: {str(e)}")
+            job.status, job.error, job.message = "failed", str(e), "Failed"
+            return
+
+        if result is None:
+            job.status, job.progress, job.message = "empty", 1.0, "Nothing to show yet"
+            return
+
+        with self.lock:
+            self.results.pop(job.user_key, None)
+            self.results[job.user_key] = result
+            # Dropping a result releases its dataset, which the store can then evict
+            while len(self.results) > self.max_cached_users:
+                evicted_key, _ = self.results.popitem(last=False)
+                # Its job would only point at a result that is gone
+                if evicted_key in self.jobs and self.jobs[evicted_key].finished:
+                    del self.jobs[evicted_key]
+        job.status, job.progress, job.message = "done", 1.0, "Ready"
+        logger.info(f"Precomputed the dashboard for {job.user_key} from {job.source}")
+
+
+    def _compute(self, job: PrecomputeJob, categories, rules, statement, deltas, persist) -> Optional[PrecomputedDashboard]:
+        report = None
+        stored = None
+        job.update(0.05, "Loading your transactions")
+        if statement is not None:
+            df, report = clean_statement(pd.read_excel(io.BytesIO(statement)))
+        else:
+            stored = self._load_history(job.user_key)
+            df = None if stored is None else stored["frame"]
+
+        new_df = None
+        if deltas is not None:
+            job.update(0.25, "Syncing your bank accounts")
+            new_transactions = deltas.fetch()
+            if len(new_transactions):
+                new_df, _ = clean_statement(new_transactions)
+
+        # A stored history that is already categorised with these categories is used as it is,
+        # and new transactions are categorised and added to its rollups on their own
+        if stored is not None and stored["categories_version"] == job.categories_version and df is not None and not df.empty:
+            aggregates = stored["aggregates"]
+            if new_df is not None and not new_df.empty:
+                job.update(0.5, "Categorising your new transactions")
+                new_df = categorise(new_df, categories, rules)
+                job.update(0.75, "Adding them to your summaries")
+                df = pd.concat([df, new_df], ignore_index=True)
+                aggregates = update_aggregates(aggregates, new_df)
+        else:
+            if new_df is not None:
+                df = new_df if df is None else pd.concat([df, new_df], ignore_index=True)
+            if statement is not None and df.empty:
+                raise ValueError(report.summary())
+            if df is None or df.empty:
+                return None
+
+            job.update(0.5, "Categorising your transactions")
+            df = categorise(df.copy(), categories, rules)
+            job.update(0.75, "Summarising your spending")
+            aggregates = build_aggregates(df)
+
+        job.update(0.9, "Saving")
+        handle = dataset_store.put(df)
+
+        if persist:
+            self.store_history(job.user_key, df, aggregates, job.categories_version, job.source)
+            if deltas is not None:
+                deltas.commit()
+
+        return PrecomputedDashboard(
+            dataset_key=handle.key,
+            aggregates=aggregates,
+            categories_version=job.categories_version,
+            source=job.source,
+            quarantine_summary=None if report is None or report.ok else report.summary(),
+            quarantined=None if report is None or report.ok else report.quarantined.head(100),
+            pin=handle
+        )
+
+
+    def _history_path(self, user_key: str) -> str:
+        # The user's id isn't used as a file name directly
+        name = hashlib.sha256(user_key.encode()).hexdigest()[:32]
+        return os.path.join(self.cache_dir, f"{name}.pkl")
+
+
+    def _load_history(self, user_key: str) -> Optional[Dict[str, Any]]:
+        path = self._history_path(user_key)
+        if not os.path.exists(path):
+            return None
+        try:
+            with metrics.track("precompute.load_history"), open(path, "rb") as f:
+                history = pickle.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read the stored history of {user_key}: {str(e)}")
+            return None
+        return history if history.get("format") == HISTORY_FORMAT else None
+
+
+    def store_history(self, user_key: str, df: pd.DataFrame, aggregates: Dict[str, pd.DataFrame], version: str, source: str) -> None:
+        """Store a categorised frame as the user's history, which their next history job starts from"""
+        self._save_history(user_key, {
+            "frame": df,
+            "aggregates": aggregates,
+            "categories_version": version,
+            "source": source,
+            "format": HISTORY_FORMAT,
+        })
+
+
+    def _save_history(self, user_key: str, history: Dict[str, Any]) -> None:
+        path = self._history_path(user_key)
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Written next to the old file and swapped in, so a crash never leaves half a history
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with metrics.track("precompute.save_history"), open(temporary_path, "wb") as f:
+            pickle.dump(history, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+
+
+    def bank_client(self):
+        """The shared bank-data client, or None if no bank-data credentials are configured"""
+        if not os.getenv("GOCARDLESS_SECRET_ID"):
+            return None
+        with self.lock:
+            if self._bank_client is None:
+                from src.utils.gocardless_client import GoCardlessClient
+                self._bank_client = GoCardlessClient()
+            return self._bank_client
+
+
+    def bank_feed_deltas(self, cursor_store, google_id: str) -> Optional[BankFeedDeltas]:
+        """Deltas of a user's linked accounts, or None if no bank-data credentials are configured"""
+        client = self.bank_client()
+        if client is None:
+            return None
+        return BankFeedDeltas(client, cursor_store, google_id)
+
+
+    def invalidate(self, user_key: str) -> None:
+        """Forget a user's job and cached dashboard, e.g. once new bank accounts are linked, so the next one is built again"""
+        with self.lock:
+            self.jobs.pop(user_key, None)
+            self.results.pop(user_key, None)
+
+
+# Initialising the process-wide worker, shared by every session
+precompute_worker = PrecomputeWorker(
+    max_workers=int(os.getenv("PRECOMPUTE_WORKERS", 2)),
+    cache_dir=os.getenv("PRECOMPUTE_CACHE_DIR", "cache/precompute"),
+    max_cached_users=int(os.getenv("PRECOMPUTE_CACHE_USERS", 50))
+)
@@ -0,0 +1,136 @@
+import json
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+from src.logger import logger
+
+
+# Returned by `span`/`run` when tracing is off, so a disabled span costs one attribute check
+_NO_SPAN = nullcontext()
+
+
+class TraceRun:
+    """Spans collected during one script rerun"""
+
+    def __init__(self, name: str, session_id: str) -> None:
+        self.name = name
+        self.session_id = session_id
+        self.events: List[Dict[str, Any]] = []
+        self.stack: List[str] = []
+
+
+_current_run: ContextVar[Optional[TraceRun]] = ContextVar("current_trace_run", default=None)
+
+
+class Tracer:
+    """
+    Lightweight span tracer writing Chrome trace-event JSON.
+
+    Enable it by setting TRACE_DIR; every rerun wrapped in `run` is then written
+    to `<TRACE_DIR>/<page>-<timestamp>.json` (only runs slower than
+    TRACE_MIN_MS, if set), which can be opened in chrome://tracing or Perfetto.
+    """
+
+    def __init__(self, trace_dir: Optional[str] = None, min_duration_ms: float = 0.0) -> None:
+        self.trace_dir = trace_dir
+        self.min_duration_ms = min_duration_ms
+        self.pid = os.getpid()
+
+    @property
+    def enabled(self) -> bool:
+        return self.trace_dir is not None
+
+
+    def run(self, name: str, session_id: Optional[str] = None):
+        """Root span for a whole rerun, the collected spans are written out when it exits"""
+        if self.trace_dir is None:
+            return _NO_SPAN
+        return self._run(name, session_id or _streamlit_session_id())
+
+    @contextmanager
+    def _run(self, name: str, session_id: str) -> Iterator[TraceRun]:
+        trace_run = TraceRun(name, session_id)
+        token = _current_run.set(trace_run)
+        try:
+            with self._span(name, {"session_id": session_id}):
+                yield trace_run
+        finally:
+            _current_run.reset(token)
+            self._write(trace_run)
+
+
+    def span(self, name: str, **args: Any):
+        """Time a phase of the current rerun, nested inside whichever span is open"""
+        if self.trace_dir is None or _current_run.get() is None:
+            return _NO_SPAN
+        return self._span(name, args)
+
+    @contextmanager
+    def _span(self, name: str, args: Dict[str, Any]) -> Iterator[None]:
+        trace_run = _current_run.get()
+        span_id = uuid.uuid4().hex[:16]
+        parent_id = trace_run.stack[-1] if trace_run.stack else None
+        trace_run.stack.append(span_id)
+        start = time.time_ns() // 1000
+        t1 = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            duration = (time.perf_counter_ns() - t1) // 1000
+            trace_run.stack.pop()
+            trace_run.events.append({
+                "name": name,
+                "cat": trace_run.name,
+                "ph": "X",
+                "ts": start,
+                "dur": duration,
+                "pid": self.pid,
+                "tid": threading.get_ident(),
+                "args": {"span_id": span_id, "parent_id": parent_id, **{key: str(value) for key, value in args.items()}}
+            })
+
+
+    def _write(self, trace_run: TraceRun) -> None:
+        if not trace_run.events:
+            return
+        # The root span is the last one to finish
+        root = trace_run.events[-1]
+        if root["dur"] < self.min_duration_ms * 1000:
+            return
+
+        thread_name = {
+            "name": "thread_name",
+            "ph": "M",
+            "pid": self.pid,
+            "tid": root["tid"],
+            "args": {"name": f"session {trace_run.session_id}"}
+        }
+        path = os.path.join(self.trace_dir, f"{trace_run.name}-{root['ts']}.json")
+        try:
+            os.makedirs(self.trace_dir, exist_ok=True)
+            with open(path, "w") as f:
+                json.dump({"traceEvents": [thread_name] + trace_run.events, "displayTimeUnit": "ms"}, f)
+            logger.debug(f"Wrote trace of {trace_run.name} ({root['dur'] / 1000:.1f}ms) to {path}")
+        except OSError as e:
+            logger.warning(f"Could not write trace to {path}: {str(e)}")
+
+
+def _streamlit_session_id() -> str:
+    try:
+        from streamlit.runtime.scriptrunner import get_script_run_ctx
+        ctx = get_script_run_ctx()
+        return ctx.session_id if ctx else "no-session"
+    except ImportError:
+        return "no-session"
+
+
+# Initialising the default tracer, disabled unless TRACE_DIR is set
+tracer = Tracer(
+    trace_dir=os.getenv("TRACE_DIR"),
+    min_duration_ms=float(os.getenv("TRACE_MIN_MS", 0))
+)
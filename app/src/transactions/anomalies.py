@@ -0,0 +1,193 @@
+"""
+Spending anomaly detection.
+
+Every charge is compared with a robust baseline of the charges before it: the
+median and the median absolute deviation (MAD) of the merchant's last
+MERCHANT_WINDOW charges, or of the category's last CATEGORY_WINDOW charges when
+the merchant hasn't been seen often enough. The baselines are worked out for
+all rows at once, from a matrix of each row's previous charges in its group
+(one column per lag), so there is no Python loop over rows or groups.
+
+Flags:
+
+    Possible duplicate     same description, amount and currency as a charge less than DUPLICATE_WINDOW before it
+    Unusual amount         far above the merchant's baseline
+    Unusual for category   far above the category's baseline (merchants with too little history)
+
+Category spikes are found the same way on the monthly rollups, comparing each
+month's spend in a category with the months before it.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+from src.transactions.recurring import canonical_merchants
+from src.transactions.rollups import monthly_category_spend
+
+
+DUPLICATE_WINDOW = pd.Timedelta(hours=48)
+
+MERCHANT_WINDOW = 12
+CATEGORY_WINDOW = 40
+# Charges a baseline needs before anything is compared with it
+MIN_HISTORY = 5
+MIN_SPIKE_HISTORY = 3
+
+# Amounts more than THRESHOLD robust standard deviations above the median are flagged
+THRESHOLD = 4.0
+# MAD of a normal distribution times this is its standard deviation
+MAD_SCALE = 1.4826
+# Floors for the spread, so charges that never change (e.g. subscriptions) aren't flagged for a few pence
+MIN_RELATIVE_SPREAD = 0.1
+MIN_SPREAD = 1.0
+
+# Rows of lag matrix worked on at a time, to keep the memory of long windows bounded
+CHUNK_ROWS = 250_000
+
+FLAGS = ["Possible duplicate", "Unusual amount", "Unusual for category"]
+
+
+def _row_medians(matrix: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Median of the first `counts` values of each row (the rest are NaN)"""
+    ordered = np.sort(matrix, axis=1)  # NaN sorts last
+    has_values = counts > 0
+    lower = np.clip((counts - 1) // 2, 0, None)[:, None]
+    upper = np.clip(counts // 2, 0, None)[:, None]
+    medians = (np.take_along_axis(ordered, lower, axis=1) + np.take_along_axis(ordered, upper, axis=1))[:, 0] / 2
+    return np.where(has_values, medians, np.nan)
+
+
+def rolling_baseline(groups: np.ndarray, values: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Median and MAD of the `window` values before each one in its group
+
+    Args:
+        groups: Group code per value, with each group's values next to each other in order
+        values: The values
+        window: How many earlier values make up a baseline
+
+    Returns:
+        Baseline median, baseline MAD and the number of earlier values it is based on, per value
+    """
+    n = len(values)
+    rows = np.arange(n)
+    group_starts = np.r_[True, groups[1:] != groups[:-1]] if n else np.zeros(0, dtype=bool)
+    position = rows - np.maximum.accumulate(np.where(group_starts, rows, 0))
+    history = np.minimum(position, window)
+
+    medians = np.full(n, np.nan)
+    mads = np.full(n, np.nan)
+    for start in range(0, n, CHUNK_ROWS):
+        chunk = rows[start:start + CHUNK_ROWS]
+        # Column `lag - 1` holds the value `lag` places earlier in the group, NaN past the group's start
+        lags = np.stack([
+            np.where(position[chunk] >= lag, values[np.maximum(chunk - lag, 0)], np.nan)
+            for lag in range(1, window + 1)
+        ], axis=1)
+        medians[chunk] = _row_medians(lags, history[chunk])
+        mads[chunk] = _row_medians(np.abs(lags - medians[chunk, None]), history[chunk])
+    return medians, mads, history
+
+
+def _is_outlier(amounts: np.ndarray, medians: np.ndarray, mads: np.ndarray, history: np.ndarray, min_history: int) -> np.ndarray:
+    spread = np.maximum(np.maximum(MAD_SCALE * mads, MIN_RELATIVE_SPREAD * medians), MIN_SPREAD)
+    with np.errstate(invalid="ignore"):
+        return (history >= min_history) & (amounts > medians + THRESHOLD * spread)
+
+
+def _grouped_outliers(group_codes: np.ndarray, days: np.ndarray, amounts: np.ndarray, window: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Outlier flag and history length per row, against the row's group baseline"""
+    order = np.lexsort((days, group_codes))
+    # Charges without a base currency amount are left out of every baseline
+    order = order[np.isfinite(amounts[order])]
+    medians, mads, history = rolling_baseline(group_codes[order], amounts[order], window)
+    outliers = np.zeros(len(amounts), dtype=bool)
+    outliers[order] = _is_outlier(amounts[order], medians, mads, history, MIN_HISTORY)
+    row_history = np.zeros(len(amounts), dtype=np.int64)
+    row_history[order] = history
+    return outliers, row_history
+
+
+def duplicate_charges(debits: pd.DataFrame, window: pd.Timedelta = DUPLICATE_WINDOW) -> np.ndarray:
+    """Whether each charge repeats the description, amount and currency of one less than `window` before it"""
+    times = pd.to_datetime(debits["Completed Date"], errors="coerce").to_numpy().astype("datetime64[ns]").astype(np.int64)
+    description_codes, _ = pd.factorize(debits["Description"].astype(str), use_na_sentinel=False)
+    amount_codes, _ = pd.factorize(debits["Amount"], use_na_sentinel=False)
+    if "Currency" in debits.columns:
+        currency_codes, _ = pd.factorize(debits["Currency"].astype(str), use_na_sentinel=False)
+    else:
+        currency_codes = np.zeros(len(debits), dtype=np.int64)
+
+    order = np.lexsort((times, currency_codes, amount_codes, description_codes))
+    same_charge = (
+        (description_codes[order][1:] == description_codes[order][:-1])
+        & (amount_codes[order][1:] == amount_codes[order][:-1])
+        & (currency_codes[order][1:] == currency_codes[order][:-1])
+    )
+    soon_after = np.diff(times[order]) <= window.value
+    duplicates = np.zeros(len(debits), dtype=bool)
+    # Only the later charge is flagged, the first one is the expected one
+    duplicates[order[1:]] = same_charge & soon_after
+    return duplicates
+
+
+def detect_anomalies(debits: pd.DataFrame) -> pd.Series:
+    """
+    Flag duplicated charges and charges far above their merchant's or category's baseline
+
+    Args:
+        debits: Debit transactions with Completed Date, Description, Category, Amount and Base Amount
+            (baselines are in the base currency, duplicates compare the amount and currency charged)
+
+    Returns:
+        The flags of each row (see FLAGS) joined with ", ", empty when there are none, indexed like `debits`
+    """
+    dates = pd.to_datetime(debits["Completed Date"], errors="coerce")
+    days = dates.to_numpy().astype("datetime64[D]").astype(np.int64)
+    amounts = pd.to_numeric(debits["Base Amount"], errors="coerce").abs().to_numpy(dtype=np.float64)
+
+    merchant_codes, _ = canonical_merchants(debits["Description"])
+    unusual, merchant_history = _grouped_outliers(merchant_codes, days, amounts, MERCHANT_WINDOW)
+
+    category_codes, _ = pd.factorize(debits["Category"].astype(str), use_na_sentinel=False)
+    unusual_for_category, _ = _grouped_outliers(category_codes, days, amounts, CATEGORY_WINDOW)
+    # Merchants with enough history are judged against themselves
+    unusual_for_category &= merchant_history < MIN_HISTORY
+
+    flags = np.stack([duplicate_charges(debits), unusual, unusual_for_category], axis=1)
+    # Every combination of flags gets its label once, then each row picks its combination
+    combination = flags @ (1 << np.arange(len(FLAGS)))
+    labels = np.array([
+        ", ".join(flag for i, flag in enumerate(FLAGS) if combination_code >> i & 1)
+        for combination_code in range(1 << len(FLAGS))
+    ], dtype=object)
+    return pd.Series(labels[combination], index=debits.index, name="Anomaly")
+
+
+def category_spikes(month_category: pd.DataFrame) -> pd.DataFrame:
+    """
+    Category months whose spend is far above the category's months before it
+
+    Args:
+        month_category: The month x credit/debit x category rollup
+
+    Returns:
+        Month, Category, Amount, Baseline (median of the previous 12 months) and Spike
+    """
+    spend = monthly_category_spend(month_category)
+    if spend.empty:
+        return pd.DataFrame(columns=["Month", "Category", "Amount", "Baseline", "Spike"])
+
+    # One group per category, its months in order
+    by_category = spend.T.stack()
+    by_category.index.names = ["Category", "Month"]
+    category_codes, _ = pd.factorize(by_category.index.get_level_values("Category"))
+    amounts = by_category.to_numpy(dtype=np.float64)
+    medians, mads, history = rolling_baseline(category_codes, amounts, 12)
+
+    return pd.DataFrame({
+        "Amount": amounts,
+        "Baseline": medians,
+        "Spike": _is_outlier(amounts, medians, mads, history, MIN_SPIKE_HISTORY),
+    }, index=by_category.index).reset_index()[["Month", "Category", "Amount", "Baseline", "Spike"]]
@@ -0,0 +1,216 @@
+"""
+Budgets and month-end forecasts.
+
+Budgets are a monthly amount per category, stored per user next to their
+categories. Month-to-date spend comes from the day x category rollup (see
+rollups.py), and the rest of the month is forecast from the same rollup as:
+
+    seasonal baseline    the category's average spend on each weekday over the last LOOKBACK_DAYS,
+                         less the daily share of its recurring payments
+    recurring payments   the known charges due before the month ends, on the days they are due
+
+Both are worked out for every category and remaining day at once, so the cost
+only depends on the number of categories, not on the length of the history.
+"""
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+LOOKBACK_DAYS = 182
+AVERAGE_MONTH_DAYS = 30.44
+
+TABLE_COLUMNS = ["Category", "Monthly Budget"]
+
+
+def parse_budgets(budgets: Dict[str, float]) -> Dict[str, float]:
+    """
+    Check budgets (category -> monthly amount), leaving out categories without one
+
+    Raises:
+        ValueError: If an amount isn't a positive number
+    """
+    parsed = {}
+    for category, amount in budgets.items():
+        if amount is None or pd.isna(amount):
+            continue
+        try:
+            amount = float(amount)
+        except (TypeError, ValueError):
+            raise ValueError(f"The budget of {category} must be a number")
+        if amount < 0:
+            raise ValueError(f"The budget of {category} can't be negative")
+        if amount > 0:
+            parsed[str(category)] = round(amount, 2)
+    return parsed
+
+
+def budgets_to_table(budgets: Dict[str, float], categories: List[str]) -> pd.DataFrame:
+    """One editable row per category, empty where there is no budget"""
+    return pd.DataFrame({
+        "Category": categories,
+        "Monthly Budget": [budgets.get(category) for category in categories],
+    }, columns=TABLE_COLUMNS).astype({"Monthly Budget": float})
+
+
+def budgets_from_table(table: pd.DataFrame) -> Dict[str, float]:
+    """Budgets from the edited table, see parse_budgets"""
+    return parse_budgets(dict(zip(table["Category"], table["Monthly Budget"])))
+
+
+@dataclass
+class MonthForecast:
+    """A month's spend per day and category, what happened up to `as_of` and the forecast after it"""
+    as_of: pd.Timestamp
+    spend: pd.DataFrame      # day x category, base currency
+    recurring: pd.DataFrame  # day x category, the recurring payments included in the forecast
+    credits: pd.Series       # money in per day, also forecast after `as_of`
+
+    @property
+    def month(self) -> pd.Timestamp:
+        return self.spend.index[0]
+
+    @property
+    def spent(self) -> pd.Series:
+        return self.spend.loc[:self.as_of].sum()
+
+    @property
+    def forecast(self) -> pd.Series:
+        return self.spend.loc[self.as_of + pd.Timedelta(days=1):].sum()
+
+    @property
+    def projected_net(self) -> float:
+        """Money in less money out by the end of the month"""
+        return float(self.credits.sum() - self.spend.to_numpy().sum())
+
+    def summary(self, budgets: Dict[str, float]) -> pd.DataFrame:
+        """
+        Month-to-date spend and the month-end projection of every category against its budget
+
+        Returns:
+            Category, Budget, Spent, Forecast, Recurring (part of the forecast), Projected,
+            Used and Projected Used (fractions of the budget), budgeted categories first
+        """
+        categories = list(dict.fromkeys([*budgets, *self.spend.columns]))
+        summary = pd.DataFrame({
+            "Budget": pd.Series(budgets, dtype=float),
+            "Spent": self.spent,
+            "Forecast": self.forecast,
+            "Recurring": self.recurring.sum(),
+        }).reindex(categories)
+        summary[["Spent", "Forecast", "Recurring"]] = summary[["Spent", "Forecast", "Recurring"]].fillna(0)
+        summary["Projected"] = summary["Spent"] + summary["Forecast"]
+        summary["Used"] = summary["Spent"] / summary["Budget"]
+        summary["Projected Used"] = summary["Projected"] / summary["Budget"]
+        summary.index.name = "Category"
+        summary = summary.reset_index().round(2)
+        return summary.sort_values(["Budget", "Projected"], ascending=False, na_position="last").reset_index(drop=True)
+
+    def burn_down(self, categories: List[str], budget: Optional[float]) -> pd.DataFrame:
+        """
+        Cumulative spend of `categories` through the month, and what is left of their budget
+
+        Returns:
+            Day, Spent (up to `as_of`), Projected (from `as_of`) and Remaining Budget
+        """
+        cumulative = self.spend.reindex(columns=categories, fill_value=0).sum(axis=1).cumsum()
+        actual = cumulative.index <= self.as_of
+        burn_down = pd.DataFrame({
+            "Spent": cumulative.where(actual),
+            # Starting at the last actual day so the two lines join up
+            "Projected": cumulative.where(cumulative.index >= self.as_of),
+            "Remaining Budget": np.nan if budget is None else budget - cumulative,
+        })
+        burn_down.index.name = "Day"
+        return burn_down.reset_index()
+
+
+def _daily(day_category: pd.DataFrame, credit_debit: str, days: pd.DatetimeIndex) -> pd.DataFrame:
+    """Absolute amount per day (rows, every day in `days`) and category (columns)"""
+    rows = day_category[day_category["Credit/Debit"] == credit_debit]
+    daily = rows.pivot_table(index="Day", columns="Category", values="Amount", aggfunc="sum").abs()
+    daily = daily.reindex(days, fill_value=0).fillna(0)
+    daily.columns.name = None
+    return daily
+
+
+def _weekday_averages(daily: pd.DataFrame, start: pd.Timestamp, end: pd.Timestamp) -> pd.DataFrame:
+    history = daily.loc[start:end]
+    return history.groupby(history.index.weekday).mean().reindex(range(7), fill_value=0)
+
+
+def _recurring_charges(recurring: pd.DataFrame, first_day: pd.Timestamp, last_day: pd.Timestamp) -> pd.DataFrame:
+    """Day, Category and Amount of the active recurring payments due between `first_day` and `last_day`"""
+    active = recurring[recurring["Active"]]
+    if active.empty:
+        return pd.DataFrame(columns=["Day", "Category", "Amount"])
+    # Payments that are a little late are expected straight away
+    due = np.maximum(pd.to_datetime(active["Next Charge"]).dt.normalize().to_numpy(), first_day.to_datetime64())
+    # Weekly payments can fall up to five times in a month, the others at most once (their next repeat is a year on)
+    repeats = np.arange(5)
+    step = np.where(active["Frequency"].to_numpy() == "Weekly", 7, 366)
+    days = due[:, None] + (step[:, None] * repeats[None, :]).astype("timedelta64[D]")
+    within = days <= last_day.to_datetime64()
+    return pd.DataFrame({
+        "Day": days[within],
+        "Category": np.repeat(active["Category"].to_numpy(), within.sum(axis=1)),
+        "Amount": np.repeat(active["Typical Amount"].to_numpy(dtype=float), within.sum(axis=1)),
+    })
+
+
+def forecast_month(day_category: pd.DataFrame, recurring: Optional[pd.DataFrame] = None, as_of: Optional[pd.Timestamp] = None) -> Optional[MonthForecast]:
+    """
+    Forecast the rest of the month from the day x category rollup
+
+    Args:
+        day_category: The day x credit/debit x category rollup
+        recurring: Recurring payments (see detect_recurring_payments) with the Category of each merchant
+        as_of: Last day with actual transactions, defaults to the latest day of the statement
+
+    Returns:
+        The month's actual and forecast spend, None if there is nothing to forecast from
+    """
+    if day_category.empty:
+        return None
+    first_day = pd.Timestamp(day_category["Day"].min())
+    as_of = pd.Timestamp(as_of if as_of is not None else day_category["Day"].max()).normalize()
+    month_start = as_of.replace(day=1)
+    month_end = month_start + pd.offsets.MonthEnd(0)
+    history_start = max(first_day, as_of - pd.Timedelta(days=LOOKBACK_DAYS - 1))
+    remaining = pd.date_range(as_of + pd.Timedelta(days=1), month_end)
+
+    days = pd.date_range(min(history_start, month_start), month_end)
+    spend = _daily(day_category, "Debit", days)
+    credits = _daily(day_category, "Credit", days).sum(axis=1)
+
+    recurring_charges = pd.DataFrame(columns=["Day", "Category", "Amount"])
+    recurring_rate = pd.Series(dtype=float)
+    if recurring is not None and not recurring.empty:
+        known = recurring[recurring["Active"]]
+        recurring_rate = known.groupby("Category")["Monthly Cost"].sum() / AVERAGE_MONTH_DAYS
+        if len(remaining):
+            recurring_charges = _recurring_charges(recurring, remaining[0], month_end)
+    categories = list(dict.fromkeys([*spend.columns, *recurring_charges["Category"]]))
+    spend = spend.reindex(columns=categories, fill_value=0)
+
+    # Recurring payments are forecast on their own days, so their share is taken out of the averages
+    baseline = _weekday_averages(spend, history_start, as_of)
+    baseline = (baseline - recurring_rate.reindex(categories, fill_value=0)).clip(lower=0)
+    expected = pd.DataFrame(baseline.to_numpy()[remaining.weekday], index=remaining, columns=categories)
+    known_charges = (
+        recurring_charges.pivot_table(index="Day", columns="Category", values="Amount", aggfunc="sum")
+        .reindex(index=remaining, columns=categories, fill_value=0)
+        .fillna(0)
+    )
+    credits_baseline = _weekday_averages(credits.to_frame(), history_start, as_of).iloc[:, 0].to_numpy()
+    expected_credits = pd.Series(credits_baseline[remaining.weekday], index=remaining)
+
+    month = pd.date_range(month_start, month_end)
+    return MonthForecast(
+        as_of=as_of,
+        spend=pd.concat([spend.loc[month_start:as_of], expected + known_charges]).reindex(month, fill_value=0),
+        recurring=known_charges.reindex(month, fill_value=0),
+        credits=pd.concat([credits.loc[month_start:as_of], expected_credits]).reindex(month, fill_value=0),
+    )
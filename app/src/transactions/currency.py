@@ -0,0 +1,201 @@
+"""
+Currency normalisation.
+
+Every transaction is joined to the daily rate of its currency with an as-of
+merge (the latest rate on or before its date), which gives a "Base Amount" in
+the base currency. The two legs of an EXCHANGE between pockets are paired so
+moving money between currencies doesn't count as spending or income.
+
+Rates come from a local CSV store with Date, Currency and Rate columns, where
+Rate is the value of one unit of Currency in the base currency.
+"""
+import os
+import threading
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+from src.logger import logger
+from src.metrics import metrics
+
+
+RATE_COLUMNS = ["Date", "Currency", "Rate"]
+
+# How old a rate can be and still be used, e.g. over weekends and bank holidays
+MAX_RATE_AGE = pd.Timedelta(days=7)
+
+
+class FXRateStore:
+    """
+    Daily FX rates kept in a local CSV file.
+
+    The file is read once and only read again when it changes on disk, so
+    every statement in the process shares one parsed rate table.
+    """
+
+    def __init__(self, path: str, base_currency: str) -> None:
+        self.path = path
+        self.base_currency = base_currency
+        self._rates: Optional[pd.DataFrame] = None
+        self._mtime: Optional[float] = None
+        self.lock = threading.Lock()
+
+
+    def rates(self) -> pd.DataFrame:
+        """The rate table sorted by date (empty if there is no rates file)"""
+        with self.lock:
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                return pd.DataFrame({"Date": pd.Series(dtype="datetime64[ns]"), "Currency": pd.Series(dtype=object), "Rate": pd.Series(dtype=float)})
+
+            if self._rates is None or mtime != self._mtime:
+                with metrics.track("fx.load_rates"):
+                    rates = pd.read_csv(self.path, usecols=RATE_COLUMNS, dtype={"Currency": str, "Rate": float})
+                rates["Date"] = pd.to_datetime(rates["Date"]).astype("datetime64[ns]")
+                rates["Currency"] = rates["Currency"].str.upper().str.strip()
+                self._rates = rates.dropna().sort_values("Date", kind="stable").reset_index(drop=True)
+                self._mtime = mtime
+                logger.info(f"Loaded {len(self._rates)} FX rates from {self.path}")
+            return self._rates
+
+
+def pair_exchange_legs(df: pd.DataFrame) -> np.ndarray:
+    """
+    Pair the outgoing and incoming legs of EXCHANGE transactions
+
+    Revolut exports an exchange as two rows started at the same moment, one
+    negative in the currency sold and one positive in the currency bought.
+
+    Returns:
+        Pair number per row, -1 for rows that aren't part of a pair
+    """
+    pair_ids = np.full(len(df), -1, dtype=np.int64)
+    is_exchange = (df["Type"] == "EXCHANGE").to_numpy()
+    if not is_exchange.any():
+        return pair_ids
+
+    started = df["Started Date"] if "Started Date" in df.columns else df["Completed Date"]
+    legs = pd.DataFrame({
+        "started": pd.to_datetime(started[is_exchange], errors="coerce"),
+        "outgoing": (df["Amount"][is_exchange] < 0).astype(np.int64),
+    })
+    by_moment = legs.groupby("started", sort=False)
+    # A pair is exactly one outgoing and one incoming leg at the same moment
+    paired = ((by_moment["outgoing"].transform("size") == 2) & (by_moment["outgoing"].transform("sum") == 1)).to_numpy()
+    pair_ids[np.flatnonzero(is_exchange)[paired]] = by_moment.ngroup().to_numpy()[paired]
+    return pair_ids
+
+
+def implied_rates(df: pd.DataFrame, pair_ids: np.ndarray, base_currency: str) -> pd.DataFrame:
+    """Rates implied by exchanges to or from the base currency, used where the store has none"""
+    if "Currency" not in df.columns or (pair_ids < 0).all():
+        return pd.DataFrame(columns=RATE_COLUMNS)
+
+    legs = pd.DataFrame({
+        "pair": pair_ids,
+        "Date": pd.to_datetime(df["Completed Date"], errors="coerce").dt.normalize(),
+        "Currency": df["Currency"].to_numpy(),
+        "Amount": df["Amount"].abs().to_numpy(),
+    })[pair_ids >= 0]
+    base_legs = legs[legs["Currency"] == base_currency].set_index("pair")["Amount"]
+    other_legs = legs[legs["Currency"] != base_currency].set_index("pair")
+    other_legs = other_legs[other_legs.index.isin(base_legs.index)]
+    return pd.DataFrame({
+        "Date": other_legs["Date"].to_numpy(),
+        "Currency": other_legs["Currency"].to_numpy(),
+        "Rate": (base_legs.loc[other_legs.index] / other_legs["Amount"]).to_numpy(),
+    })
+
+
+def lookup_rates(dates: pd.Series, currencies: pd.Series, rates: pd.DataFrame) -> np.ndarray:
+    """
+    Rate of each (date, currency) with an as-of merge on date by currency
+
+    The latest rate on or before the date is used, or failing that the first
+    one after it, as long as it is within MAX_RATE_AGE. Currencies are merged
+    as integer codes, which is much faster than merging on strings.
+    """
+    result = np.full(len(dates), np.nan)
+    if not len(dates) or rates.empty:
+        return result
+
+    codes, uniques = pd.factorize(currencies)
+    rate_codes = pd.Index(uniques).get_indexer(rates["Currency"])
+    right = pd.DataFrame({
+        "Date": rates["Date"].astype("datetime64[ns]").to_numpy()[rate_codes >= 0],
+        "code": rate_codes[rate_codes >= 0],
+        "Rate": rates["Rate"].to_numpy()[rate_codes >= 0],
+    })
+    left = pd.DataFrame({
+        "Date": pd.to_datetime(dates, errors="coerce").astype("datetime64[ns]").to_numpy(),
+        "code": codes,
+        "position": np.arange(len(dates)),
+    }).dropna(subset=["Date"]).sort_values("Date", kind="stable")
+
+    for direction in ("backward", "forward"):
+        if left.empty or right.empty:
+            break
+        merged = pd.merge_asof(left, right, on="Date", by="code", direction=direction, tolerance=MAX_RATE_AGE)
+        found = merged["Rate"].notna().to_numpy()
+        result[merged["position"].to_numpy()[found]] = merged["Rate"].to_numpy()[found]
+        # Only the rows still without a rate are tried in the other direction
+        left = left[~found]
+    return result
+
+
+@metrics.timed("fx.normalise_currencies")
+def normalise_currencies(df: pd.DataFrame, store: "FXRateStore") -> pd.DataFrame:
+    """
+    Add the base currency amount, and take paired exchanges out of debits and credits
+
+    Adds "Base Amount" (NaN where no rate is known) and "Exchange Pair", and
+    sets Credit/Debit to "Exchange" for both legs of a pair. Unpaired EXCHANGE
+    rows are a Debit or Credit depending on their sign.
+    """
+    base_currency = store.base_currency
+    amounts = df["Amount"].to_numpy(dtype=np.float64)
+    pair_ids = pair_exchange_legs(df)
+
+    if "Currency" in df.columns:
+        # Cleaned once per distinct currency rather than per row
+        codes, uniques = pd.factorize(df["Currency"], use_na_sentinel=False)
+        clean_uniques = pd.Series(uniques, dtype=object).astype(str).str.upper().str.strip().to_numpy()
+        currencies = pd.Series(clean_uniques[codes], index=df.index)
+        foreign = clean_uniques[codes] != base_currency
+        base_amounts = amounts.copy()
+        if foreign.any():
+            foreign_dates, foreign_currencies = df["Completed Date"][foreign], currencies[foreign]
+            foreign_rates = lookup_rates(foreign_dates, foreign_currencies, store.rates())
+
+            # Rates implied by this statement's own exchanges fill the gaps in the store
+            still_missing = np.isnan(foreign_rates)
+            if still_missing.any() and (pair_ids >= 0).any():
+                fallback = implied_rates(df.assign(Currency=currencies), pair_ids, base_currency)
+                foreign_rates[still_missing] = lookup_rates(
+                    foreign_dates[still_missing], foreign_currencies[still_missing],
+                    fallback.sort_values("Date", kind="stable")
+                )
+            base_amounts[foreign] = amounts[foreign] * foreign_rates
+
+            missing_rates = int(np.isnan(base_amounts).sum())
+            if missing_rates:
+                logger.warning(f"No {base_currency} rate for {missing_rates} transactions")
+                metrics.increment("fx_missing_rates", "fx.normalise_currencies", missing_rates)
+    else:
+        base_amounts = amounts
+
+    credit_debit = df["Credit/Debit"].to_numpy(dtype=object).copy()
+    is_exchange = (df["Type"] == "EXCHANGE").to_numpy()
+    credit_debit[is_exchange] = np.where(amounts[is_exchange] < 0, "Debit", "Credit")
+    credit_debit[pair_ids >= 0] = "Exchange"
+
+    return df.assign(**{"Base Amount": base_amounts, "Exchange Pair": pair_ids, "Credit/Debit": credit_debit})
+
+
+# Initialising the process-wide rate store
+fx_rate_store = FXRateStore(
+    path=os.getenv("FX_RATES_PATH", "data/fx_rates.csv"),
+    base_currency=os.getenv("BASE_CURRENCY", "GBP").upper()
+)
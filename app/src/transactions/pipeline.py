@@ -0,0 +1,107 @@
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+
+from src.logger import logger
+from src.transactions.currency import fx_rate_store, normalise_currencies
+from src.transactions.rollups import build_rollups, merge_rollups, rolling_category_averages
+from src.transactions.rules import RuleFeatures, apply_rules, compile_rules, keyword_categories, rules_version
+from src.transactions.schema import ValidationReport, validate_transactions
+
+
+TYPE_TO_DEBIT_CREDIT = {
+    "CARD_PAYMENT": "Debit",
+    "ATM": "Debit",
+    "EXCHANGE": "Debit",  # paired exchange legs become "Exchange", see normalise_currencies
+    "TRANSFER": "Credit",
+    "TOPUP": "Credit",
+    "CARD_REFUND": "Credit",
+    "REWARD": "Credit"
+}
+
+
+def categories_version(categories: Dict[str, List[str]], rules: Optional[List[Dict[str, Any]]] = None) -> str:
+    """Key for the categories and rules that affect categorisation (categories without keywords don't change anything)"""
+    version = json.dumps({category: keywords for category, keywords in categories.items() if keywords}, sort_keys=True)
+    # Kept the same as before rules existed when there are none, so stored histories stay valid
+    return f"{version}|{rules_version(rules)}" if rules else version
+
+
+def categorise(df: pd.DataFrame, categories: Dict[str, List[str]], rules: Optional[List[Dict[str, Any]]] = None) -> pd.DataFrame:
+    """
+    Categorise transactions using a category mapping (category -> description keywords) and the user's rules
+
+    Keywords are looked up once per distinct description, then the compiled
+    rules overwrite the rows they match, highest priority last.
+    """
+    features = RuleFeatures(df)
+    category = keyword_categories(features, categories)
+    if rules:
+        category = apply_rules(compile_rules(rules), features, category)
+    df["Category"] = category
+
+    logger.info("Categorised transactions on the st.session_state.df")
+    return df
+
+
+def clean_statement(df: pd.DataFrame) -> Tuple[pd.DataFrame, ValidationReport]:
+    """
+    Validate a raw statement and add the Credit/Debit column, without categorising it
+
+    Returns:
+        The valid rows ready to be categorised, and the validation report
+
+    Raises:
+        TransactionSchemaError: If a required column is missing
+    """
+    df.columns = [str(col).strip() for col in df.columns]
+
+    # Checking the whole statement column by column, bad rows are set aside instead of breaking the dashboard
+    report = validate_transactions(df, TYPE_TO_DEBIT_CREDIT.keys())
+    df = report.valid
+
+    # Changing columns from object type to string
+    df = df.astype({col: str for col in df.select_dtypes(include='object').columns})
+    df["Credit/Debit"] = df["Type"].map(TYPE_TO_DEBIT_CREDIT)
+
+    # Amounts in the base currency, and exchanges between pockets taken out of debits/credits
+    df = normalise_currencies(df, fx_rate_store)
+    return df, report
+
+
+def aggregates_from_rollups(rollups: Dict[str, pd.DataFrame]) -> Dict[str, pd.DataFrame]:
+    """
+    Aggregates the dashboard shows, all read from the monthly rollups
+
+    Returns:
+        Dictionary with the rollups themselves, the debit totals per category (what
+        the expense summary shows unfiltered), debits per month and category,
+        credits per month, and each category's rolling monthly averages
+    """
+    month_category = rollups["month_category"]
+    debits = month_category[month_category["Credit/Debit"] == "Debit"]
+    credits = month_category[month_category["Credit/Debit"] == "Credit"]
+
+    # Summed in the base currency, but kept as "Amount" like the rest of the dashboard's tables
+    category_totals = debits.groupby("Category")["Amount"].sum().abs().reset_index()
+    monthly_debits = debits.groupby(["Month", "Category"])["Amount"].sum().abs().reset_index()
+    monthly_credits = credits.groupby("Month")["Amount"].sum().reset_index()
+
+    return {
+        **rollups,
+        "debit_category_totals": category_totals.sort_values("Amount", ascending=False).reset_index(drop=True),
+        "monthly_debits_by_category": monthly_debits,
+        "monthly_credits": monthly_credits,
+        "rolling_category_averages": rolling_category_averages(month_category),
+    }
+
+
+def build_aggregates(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Roll a categorised statement up by month and derive the dashboard's aggregates from it"""
+    return aggregates_from_rollups(build_rollups(df))
+
+
+def update_aggregates(aggregates: Dict[str, pd.DataFrame], new_df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """Add new categorised rows to existing aggregates, only rolling up the new rows"""
+    return aggregates_from_rollups(merge_rollups([aggregates, build_rollups(new_df)]))
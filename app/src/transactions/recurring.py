@@ -0,0 +1,167 @@
+"""
+Recurring payment and subscription detection.
+
+Debits are grouped by a canonical merchant name and every statistic (interval
+between charges, how regular the intervals are, how stable the amounts are)
+is computed for all merchants at once with sorts and `np.bincount`, so there
+is no Python loop over merchants however many transactions there are.
+"""
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# name: (days between charges, tolerance in days, minimum number of intervals)
+FREQUENCIES = {
+    "Weekly": (7, 1.5, 3),
+    "Monthly": (30.44, 4, 2),
+    "Annual": (365.25, 15, 1),
+}
+
+MIN_CONFIDENCE = 0.5
+
+RESULT_COLUMNS = [
+    "Merchant", "Frequency", "Charges", "Typical Amount", "Interval (days)", "Amount Variation",
+    "Confidence", "Last Charge", "Next Charge", "Active", "Monthly Cost"
+]
+
+
+def canonical_merchants(descriptions: pd.Series) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Group descriptions that only differ by case, digits or punctuation (e.g. "NETFLIX.COM 1234" and "Netflix.com")
+
+    Only the distinct descriptions are normalised, then mapped back onto every row.
+
+    Returns:
+        Merchant code per row, and the canonical name of each code
+    """
+    codes, uniques = pd.factorize(descriptions.astype(str), use_na_sentinel=False)
+    canonical = (
+        pd.Series(uniques)
+        .str.lower()
+        .str.replace(r"[^a-z\s]", " ", regex=True)
+        .str.split()
+        .str.join(" ")
+    )
+    merchant_codes, merchant_names = pd.factorize(canonical, use_na_sentinel=False)
+    return merchant_codes[codes], np.asarray(merchant_names, dtype=object)
+
+
+def _group_median(groups: np.ndarray, values: np.ndarray, n_groups: int) -> np.ndarray:
+    """Median of `values` per group, from one sort of (group, value)"""
+    order = np.lexsort((values, groups))
+    sorted_values = values[order]
+    counts = np.bincount(groups, minlength=n_groups)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+
+    medians = np.full(n_groups, np.nan)
+    has_values = counts > 0
+    lower = starts + (counts - 1) // 2
+    upper = starts + counts // 2
+    medians[has_values] = (sorted_values[lower[has_values]] + sorted_values[upper[has_values]]) / 2
+    return medians
+
+
+def detect_recurring_payments(debits: pd.DataFrame, min_confidence: float = MIN_CONFIDENCE) -> pd.DataFrame:
+    """
+    Find the merchants that charge at a weekly, monthly or annual rhythm
+
+    The confidence combines how many intervals fall within the frequency's
+    tolerance, how stable the amounts are, and how many charges were seen.
+
+    Args:
+        debits: Debit transactions with Completed Date, Description and Amount
+        min_confidence: Merchants scoring below this are left out
+
+    Returns:
+        One row per recurring merchant (see RESULT_COLUMNS), most confident first
+    """
+    dates = pd.to_datetime(debits["Completed Date"], errors="coerce")
+    amounts = pd.to_numeric(debits["Amount"], errors="coerce").abs()
+    usable = (dates.notna() & amounts.notna()).to_numpy()
+    if usable.sum() < 2:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    descriptions = debits["Description"][usable]
+    merchant_codes, merchant_names = canonical_merchants(descriptions)
+    days = dates[usable].to_numpy().astype("datetime64[D]").astype(np.int64)
+    amounts = amounts[usable].to_numpy(dtype=np.float64)
+    n_merchants = len(merchant_names)
+
+    # Charges of the same merchant next to each other, in date order
+    order = np.lexsort((days, merchant_codes))
+    merchant_codes, days, amounts = merchant_codes[order], days[order], amounts[order]
+    # Each merchant's run ends with its latest charge
+    charges = np.bincount(merchant_codes, minlength=n_merchants)
+    run_ends = np.cumsum(charges) - 1
+
+    # The spread of each merchant's amounts
+    amount_sum = np.bincount(merchant_codes, weights=amounts, minlength=n_merchants)
+    amount_square_sum = np.bincount(merchant_codes, weights=amounts ** 2, minlength=n_merchants)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        amount_mean = amount_sum / charges
+        amount_std = np.sqrt(np.maximum(amount_square_sum / charges - amount_mean ** 2, 0))
+        amount_variation = np.where(amount_mean > 0, amount_std / amount_mean, np.inf)
+    typical_amount = _group_median(merchant_codes, amounts, n_merchants)
+
+    # Days between consecutive charges of the same merchant (several charges on one day count as one)
+    same_merchant = merchant_codes[1:] == merchant_codes[:-1]
+    intervals = np.diff(days)
+    keep = same_merchant & (intervals > 0)
+    interval_merchants = merchant_codes[1:][keep]
+    intervals = intervals[keep].astype(np.float64)
+    interval_count = np.bincount(interval_merchants, minlength=n_merchants)
+    median_interval = _group_median(interval_merchants, intervals, n_merchants)
+
+    # Each merchant gets the frequency closest to its median interval
+    names = np.array(list(FREQUENCIES))
+    periods = np.array([period for period, _, _ in FREQUENCIES.values()])
+    tolerances = np.array([tolerance for _, tolerance, _ in FREQUENCIES.values()])
+    min_intervals = np.array([minimum for _, _, minimum in FREQUENCIES.values()])
+    relative_distance = np.abs(median_interval[:, None] - periods[None, :]) / periods[None, :]
+    frequency = np.argmin(np.nan_to_num(relative_distance, nan=np.inf), axis=1)
+
+    # Share of each merchant's intervals within tolerance of its frequency
+    on_rhythm = np.abs(intervals - periods[frequency[interval_merchants]]) <= tolerances[frequency[interval_merchants]]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        regularity = np.bincount(interval_merchants, weights=on_rhythm, minlength=n_merchants) / interval_count
+
+    amount_stability = np.clip(1 - np.nan_to_num(amount_variation, nan=1.0, posinf=1.0), 0, 1)
+    # A couple of regular charges could be a coincidence, more of them make it certain
+    evidence = np.clip(interval_count / (min_intervals[frequency] + 2), 0, 1)
+    confidence = np.nan_to_num(regularity) * (0.5 + 0.5 * amount_stability) * evidence
+    recurring = (interval_count >= min_intervals[frequency]) & (confidence >= min_confidence)
+
+    if not recurring.any():
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+
+    selected = np.flatnonzero(recurring)
+    last_day = days[run_ends]
+    selected_frequency = names[frequency[selected]]
+    last_charge = pd.to_datetime(last_day[selected].astype("datetime64[D]"))
+    # Calendar aware, so a charge on the 31st is expected at the end of shorter months
+    next_charge = np.select(
+        [selected_frequency == "Weekly", selected_frequency == "Monthly"],
+        [last_charge + pd.Timedelta(days=7), last_charge + pd.DateOffset(months=1)],
+        last_charge + pd.DateOffset(years=1)
+    )
+    statement_end = days.max()
+    # Still active if the next charge isn't overdue by more than half a period at the end of the statement
+    active = last_day[selected] + 1.5 * periods[frequency[selected]] >= statement_end
+
+    result = pd.DataFrame({
+        # Shown as the merchant's latest description rather than the canonical name
+        "Merchant": descriptions.to_numpy()[order][run_ends[selected]],
+        "Frequency": selected_frequency,
+        "Charges": charges[selected],
+        "Typical Amount": typical_amount[selected].round(2),
+        "Interval (days)": median_interval[selected].round(1),
+        "Amount Variation": amount_variation[selected].round(3),
+        "Confidence": confidence[selected].round(3),
+        "Last Charge": last_charge,
+        "Next Charge": pd.to_datetime(next_charge),
+        "Active": active,
+        "Monthly Cost": (typical_amount[selected] * 30.44 / periods[frequency[selected]]).round(2),
+    }, columns=RESULT_COLUMNS)
+    return result.sort_values(["Active", "Confidence"], ascending=False).reset_index(drop=True)
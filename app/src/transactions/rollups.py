@@ -0,0 +1,118 @@
+"""
+Materialised monthly rollups.
+
+A statement is summed once into small cubes, month x credit/debit x category,
+month x type and day x credit/debit x category, and everything time based
+(monthly totals, rolling averages, month-over-month trends, budgets and
+forecasts) is read from those instead of the rows.
+Sums add up, so new rows are rolled up on their own and added to the cubes,
+and the size of the cubes only depends on the number of days, months and categories.
+"""
+from typing import Dict, Iterable
+
+import numpy as np
+import pandas as pd
+
+
+ROLLING_WINDOWS = (3, 12)
+
+CATEGORY_CUBE_KEYS = ["Month", "Credit/Debit", "Category"]
+TYPE_CUBE_KEYS = ["Month", "Type"]
+DAY_CUBE_KEYS = ["Day", "Credit/Debit", "Category"]
+
+CUBES = {"month_category": CATEGORY_CUBE_KEYS, "month_type": TYPE_CUBE_KEYS, "day_category": DAY_CUBE_KEYS}
+
+
+def _truncate(dates: pd.Series, unit: str) -> np.ndarray:
+    return pd.to_datetime(dates).to_numpy().astype(f"datetime64[{unit}]").astype("datetime64[ns]")
+
+
+def build_rollups(df: pd.DataFrame) -> Dict[str, pd.DataFrame]:
+    """
+    Roll a categorised statement up by month and by day
+
+    Returns:
+        "month_category" (Month, Credit/Debit, Category), "month_type" (Month, Type) and "day_category"
+        (Day, Credit/Debit, Category), each with the summed base currency Amount and the number of Transactions
+    """
+    rows = pd.DataFrame({
+        "Month": _truncate(df["Completed Date"], "M"),
+        "Day": _truncate(df["Completed Date"], "D"),
+        "Credit/Debit": df["Credit/Debit"].to_numpy(),
+        "Category": df["Category"].to_numpy(),
+        "Type": df["Type"].to_numpy(),
+        "Amount": df["Base Amount"].to_numpy(),
+    })
+    return {name: _sum_cube(rows, keys) for name, keys in CUBES.items()}
+
+
+def _sum_cube(rows: pd.DataFrame, keys) -> pd.DataFrame:
+    return (
+        rows.groupby(keys, sort=True, dropna=False)["Amount"]
+        .agg(Amount="sum", Transactions="size")
+        .reset_index()
+    )
+
+
+def merge_rollups(rollups: Iterable[Dict[str, pd.DataFrame]]) -> Dict[str, pd.DataFrame]:
+    """Add up rollups of different rows, e.g. a stored history's and a sync's new transactions"""
+    rollups = list(rollups)
+    merged = {}
+    for name, keys in CUBES.items():
+        cubes = pd.concat([rollup[name] for rollup in rollups], ignore_index=True)
+        merged[name] = cubes.groupby(keys, sort=True, dropna=False)[["Amount", "Transactions"]].sum().reset_index()
+    return merged
+
+
+def monthly_category_spend(month_category: pd.DataFrame) -> pd.DataFrame:
+    """
+    Spend per month (rows) and category (columns), with every month in between filled in
+
+    Months without spending in a category are 0, so rolling windows count calendar months.
+    """
+    debits = month_category[month_category["Credit/Debit"] == "Debit"]
+    if debits.empty:
+        return pd.DataFrame()
+    spend = debits.pivot_table(index="Month", columns="Category", values="Amount", aggfunc="sum").abs()
+    all_months = pd.date_range(spend.index.min(), spend.index.max(), freq="MS")
+    spend = spend.reindex(all_months, fill_value=0).fillna(0)
+    spend.index.name = "Month"
+    spend.columns.name = None
+    return spend
+
+
+def rolling_category_averages(month_category: pd.DataFrame) -> pd.DataFrame:
+    """Monthly spend per category next to its rolling averages over ROLLING_WINDOWS months"""
+    spend = monthly_category_spend(month_category)
+    if spend.empty:
+        return pd.DataFrame(columns=["Month", "Category", "Amount", *[f"Avg {window}M" for window in ROLLING_WINDOWS]])
+
+    columns = {"Amount": spend.stack()}
+    for window in ROLLING_WINDOWS:
+        columns[f"Avg {window}M"] = spend.rolling(window, min_periods=1).mean().stack()
+    averages = pd.DataFrame(columns)
+    averages.index.names = ["Month", "Category"]
+    return averages.round(2).reset_index()
+
+
+def category_trends(rolling_averages: pd.DataFrame, month: pd.Timestamp) -> pd.DataFrame:
+    """
+    Each category's spend in `month` against the month before and its rolling averages
+
+    Returns:
+        Category, Amount, Previous Month, Change (fraction of the previous month) and the rolling averages up to `month`
+    """
+    averages = rolling_averages.set_index(["Month", "Category"])
+    current = averages.xs(month, level="Month")
+    previous_month = month - pd.DateOffset(months=1)
+    if previous_month in averages.index.get_level_values("Month"):
+        previous = averages.xs(previous_month, level="Month")["Amount"]
+    else:
+        previous = pd.Series(0.0, index=current.index)
+
+    trends = current.assign(**{"Previous Month": previous.reindex(current.index, fill_value=0)})
+    with np.errstate(divide="ignore", invalid="ignore"):
+        change = trends["Amount"] / trends["Previous Month"] - 1
+    trends["Change"] = change.replace([np.inf, -np.inf], np.nan)
+    columns = ["Amount", "Previous Month", "Change", *[f"Avg {window}M" for window in ROLLING_WINDOWS]]
+    return trends[columns].sort_values("Amount", ascending=False).reset_index()
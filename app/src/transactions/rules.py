@@ -0,0 +1,304 @@
+"""
+Categorisation rules beyond description keywords.
+
+A rule assigns its category to transactions matching all of its conditions:
+transaction types, a range of the (base currency) amount, a date range,
+weekdays, days of the month and a regex on the description. Rules are
+compiled once into functions that return boolean masks, and every mask is
+evaluated over whole columns, with description and type checks done on the
+distinct values only. Higher priorities win, and any rule beats the keywords.
+"""
+import json
+import re
+from datetime import date
+from functools import cached_property, lru_cache
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from pydantic import BaseModel, Field, ValidationError, field_validator, model_validator
+
+
+WEEKDAYS = ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"]
+
+
+class CategoryRule(BaseModel):
+    """A categorisation rule as stored next to the user's keyword categories"""
+    category: str = Field(..., description="Category given to matching transactions")
+    priority: int = Field(100, description="Higher priorities win when several rules match, any rule overrides the keywords")
+    types: Optional[List[str]] = Field(None, description="Transaction types, e.g. ['TRANSFER']")
+    min_amount: Optional[float] = Field(None, ge=0, description="Smallest absolute amount in the base currency")
+    max_amount: Optional[float] = Field(None, ge=0, description="Largest absolute amount in the base currency")
+    date_from: Optional[date] = None
+    date_to: Optional[date] = None
+    weekdays: Optional[List[int]] = Field(None, description="0 is Monday, 6 is Sunday")
+    days_of_month: Optional[List[int]] = None
+    description_regex: Optional[str] = Field(None, description="Case-insensitive regex searched in the description")
+
+    @field_validator("category")
+    @classmethod
+    def validate_category(cls, v):
+        if not v.strip():
+            raise ValueError("Category name cannot be empty")
+        return v.strip()
+
+    @field_validator("types")
+    @classmethod
+    def validate_types(cls, v):
+        types = [transaction_type.strip().upper() for transaction_type in v or [] if transaction_type.strip()]
+        return types or None
+
+    @field_validator("weekdays")
+    @classmethod
+    def validate_weekdays(cls, v):
+        if v and any(day < 0 or day > 6 for day in v):
+            raise ValueError("Weekdays go from 0 (Monday) to 6 (Sunday)")
+        return v or None
+
+    @field_validator("days_of_month")
+    @classmethod
+    def validate_days_of_month(cls, v):
+        if v and any(day < 1 or day > 31 for day in v):
+            raise ValueError("Days of the month go from 1 to 31")
+        return v or None
+
+    @field_validator("description_regex")
+    @classmethod
+    def validate_description_regex(cls, v):
+        if not v:
+            return None
+        try:
+            re.compile(v)
+        except re.error as e:
+            raise ValueError(f"Invalid description regex: {str(e)}")
+        return v
+
+    @model_validator(mode="after")
+    def validate_ranges(self):
+        if self.min_amount is not None and self.max_amount is not None and self.min_amount > self.max_amount:
+            raise ValueError("The minimum amount is above the maximum amount")
+        if self.date_from and self.date_to and self.date_from > self.date_to:
+            raise ValueError("The start date is after the end date")
+        conditions = [self.types, self.min_amount, self.max_amount, self.date_from, self.date_to, self.weekdays, self.days_of_month, self.description_regex]
+        if all(condition is None for condition in conditions):
+            raise ValueError("A rule needs at least one condition")
+        return self
+
+
+class RuleFeatures:
+    """
+    The columns rules look at, each worked out once per dataset and only when a rule needs it
+
+    Descriptions and types are factorised, so text checks run on the distinct values.
+    """
+
+    def __init__(self, df: pd.DataFrame) -> None:
+        self.df = df
+
+    @cached_property
+    def descriptions(self) -> Tuple[np.ndarray, pd.Series]:
+        codes, uniques = pd.factorize(self.df["Description"].astype(str), use_na_sentinel=False)
+        return codes, pd.Series(uniques, dtype=object)
+
+    @cached_property
+    def types(self) -> Tuple[np.ndarray, pd.Series]:
+        codes, uniques = pd.factorize(self.df["Type"].astype(str), use_na_sentinel=False)
+        return codes, pd.Series(uniques, dtype=object)
+
+    @cached_property
+    def amounts(self) -> np.ndarray:
+        column = "Base Amount" if "Base Amount" in self.df.columns else "Amount"
+        return np.abs(pd.to_numeric(self.df[column], errors="coerce").to_numpy(dtype=np.float64))
+
+    @cached_property
+    def dates(self) -> pd.Series:
+        return pd.to_datetime(self.df["Completed Date"], errors="coerce")
+
+    @cached_property
+    def days(self) -> np.ndarray:
+        """Days since 1970-01-01, with the smallest int64 for missing dates"""
+        return self.dates.to_numpy().astype("datetime64[D]").astype(np.int64)
+
+    @cached_property
+    def weekdays(self) -> np.ndarray:
+        # 1970-01-01 was a Thursday
+        return (self.days + 3) % 7
+
+    @cached_property
+    def days_of_month(self) -> np.ndarray:
+        return self.dates.dt.day.fillna(0).to_numpy(dtype=np.int64)
+
+
+def _on_distinct(column: str, check: Callable[[pd.Series], Any]) -> Callable[[RuleFeatures], np.ndarray]:
+    """Run `check` on the distinct values of a factorised column and broadcast it to every row"""
+    def mask(features: RuleFeatures) -> np.ndarray:
+        codes, uniques = getattr(features, column)
+        return np.asarray(check(uniques), dtype=bool)[codes]
+    return mask
+
+
+class CompiledRule:
+    """A rule turned into a list of mask functions, all of which must match"""
+
+    def __init__(self, rule: CategoryRule) -> None:
+        self.category = rule.category
+        self.priority = rule.priority
+        self.conditions: List[Callable[[RuleFeatures], np.ndarray]] = []
+
+        # Cheap numeric conditions first, so the text ones can be skipped when nothing is left
+        if rule.min_amount is not None:
+            self.conditions.append(lambda features, low=rule.min_amount: features.amounts >= low)
+        if rule.max_amount is not None:
+            self.conditions.append(lambda features, high=rule.max_amount: features.amounts <= high)
+        if rule.date_from is not None:
+            start = np.datetime64(rule.date_from, "D").astype(np.int64)
+            self.conditions.append(lambda features, start=start: features.days >= start)
+        if rule.date_to is not None:
+            end = np.datetime64(rule.date_to, "D").astype(np.int64)
+            self.conditions.append(lambda features, end=end: (features.days <= end) & (features.days != np.iinfo(np.int64).min))
+        if rule.weekdays:
+            self.conditions.append(lambda features, days=rule.weekdays: np.isin(features.weekdays, days))
+        if rule.days_of_month:
+            self.conditions.append(lambda features, days=rule.days_of_month: np.isin(features.days_of_month, days))
+        if rule.types:
+            self.conditions.append(_on_distinct("types", lambda uniques, types=set(rule.types): uniques.isin(types)))
+        if rule.description_regex:
+            pattern = re.compile(rule.description_regex, re.IGNORECASE)
+            self.conditions.append(_on_distinct("descriptions", lambda uniques, pattern=pattern: [pattern.search(description) is not None for description in uniques]))
+
+    def mask(self, features: RuleFeatures) -> np.ndarray:
+        matches = np.ones(len(features.df), dtype=bool)
+        for condition in self.conditions:
+            matches &= condition(features)
+            if not matches.any():
+                break
+        return matches
+
+
+def parse_rules(rules: Iterable[Any]) -> List[CategoryRule]:
+    """Validate stored rules (dicts or CategoryRule), raising ValueError for the first invalid one"""
+    parsed = []
+    for i, rule in enumerate(rules or []):
+        try:
+            parsed.append(rule if isinstance(rule, CategoryRule) else CategoryRule(**rule))
+        except ValidationError as e:
+            messages = "; ".join(error["msg"] for error in e.errors())
+            raise ValueError(f"Rule {i + 1} is invalid: {messages}")
+    return parsed
+
+
+def rules_version(rules: Optional[Iterable[Any]]) -> str:
+    """Stable key of a list of rules, e.g. for caching"""
+    return json.dumps([rule.model_dump(mode="json") for rule in parse_rules(rules or [])], sort_keys=True)
+
+
+@lru_cache(maxsize=64)
+def _compile(version: str) -> Tuple[CompiledRule, ...]:
+    rules = parse_rules(json.loads(version))
+    # Applied from the lowest priority up so the highest one ends up on top, ties go to the earlier rule
+    order = sorted(range(len(rules)), key=lambda i: (rules[i].priority, -i))
+    return tuple(CompiledRule(rules[i]) for i in order)
+
+
+def compile_rules(rules: Optional[Iterable[Any]]) -> Tuple[CompiledRule, ...]:
+    """Compile rules once per distinct rule set, later calls with the same rules reuse it"""
+    return _compile(rules_version(rules))
+
+
+def keyword_categories(features: RuleFeatures, categories: Dict[str, List[str]]) -> np.ndarray:
+    """
+    Category of every transaction from the exact description keywords
+
+    A description that is a keyword of several categories gets the last one,
+    the same as assigning each category in turn.
+    """
+    keyword_to_category = {}
+    for category, keywords in categories.items():
+        if category == "Uncategorised" or not keywords:
+            continue
+        for keyword in keywords:
+            keyword_to_category[keyword.lower().strip()] = category
+
+    codes, uniques = features.descriptions
+    matched = uniques.str.lower().str.strip().map(keyword_to_category).fillna("Uncategorised")
+    return matched.to_numpy(dtype=object)[codes]
+
+
+def apply_rules(compiled: Iterable[CompiledRule], features: RuleFeatures, categories: np.ndarray) -> np.ndarray:
+    """Overwrite the categories of the transactions each rule matches, lowest priority first"""
+    categories = categories.copy()
+    for rule in compiled:
+        categories[rule.mask(features)] = rule.category
+    return categories
+
+
+TABLE_COLUMNS = [
+    "Category", "Priority", "Types", "Min Amount", "Max Amount",
+    "From", "To", "Weekdays", "Days of Month", "Description Regex"
+]
+
+
+def _split(value: Any) -> List[str]:
+    if value is None or (isinstance(value, float) and np.isnan(value)):
+        return []
+    return [part.strip() for part in str(value).split(",") if part.strip()]
+
+
+def _optional(value: Any) -> Any:
+    return None if value is None or pd.isna(value) or value == "" else value
+
+
+def rules_to_table(rules: Iterable[Any]) -> pd.DataFrame:
+    """Rules as an editable table, lists shown as comma separated text"""
+    rows = []
+    for rule in parse_rules(rules):
+        rows.append({
+            "Category": rule.category,
+            "Priority": rule.priority,
+            "Types": ", ".join(rule.types or []),
+            "Min Amount": rule.min_amount,
+            "Max Amount": rule.max_amount,
+            "From": rule.date_from,
+            "To": rule.date_to,
+            "Weekdays": ", ".join(WEEKDAYS[day] for day in rule.weekdays or []),
+            "Days of Month": ", ".join(str(day) for day in rule.days_of_month or []),
+            "Description Regex": rule.description_regex or "",
+        })
+    table = pd.DataFrame(rows, columns=TABLE_COLUMNS)
+    return table.astype({"Priority": "Int64", "Min Amount": float, "Max Amount": float})
+
+
+def rules_from_table(table: pd.DataFrame) -> List[Dict[str, Any]]:
+    """
+    Rules from an edited table, rows without a category are skipped
+
+    Raises:
+        ValueError: If a row isn't a valid rule
+    """
+    weekday_numbers = {name.lower(): number for number, name in enumerate(WEEKDAYS)}
+    rules = []
+    for i, row in enumerate(table.to_dict("records")):
+        if not _optional(row.get("Category")):
+            continue
+        try:
+            weekdays = [weekday_numbers[day.lower()[:3]] for day in _split(row.get("Weekdays"))]
+            days_of_month = [int(day) for day in _split(row.get("Days of Month"))]
+        except (KeyError, ValueError):
+            raise ValueError(f"Rule {i + 1} is invalid: weekdays are written like 'Sat, Sun' and days of the month like '1, 15'")
+        priority = _optional(row.get("Priority"))
+        rule = {
+            "category": row["Category"],
+            # 0 is a valid priority, only an empty cell gets the default
+            "priority": 100 if priority is None else int(priority),
+            "types": _split(row.get("Types")) or None,
+            "min_amount": _optional(row.get("Min Amount")),
+            "max_amount": _optional(row.get("Max Amount")),
+            "date_from": _optional(row.get("From")),
+            "date_to": _optional(row.get("To")),
+            "weekdays": weekdays or None,
+            "days_of_month": days_of_month or None,
+            "description_regex": _optional(row.get("Description Regex")),
+        }
+        rules.append(rule)
+    # Validated (and dates made JSON friendly) before anything is stored
+    return json.loads(rules_version(rules))
@@ -0,0 +1,153 @@
+from dataclasses import dataclass, field
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+
+# Columns every statement must have for the dashboard to work
+REQUIRED_COLUMNS = ["Type", "Completed Date", "Description", "Amount"]
+
+# Text columns whose values are checked, and passed on, without surrounding whitespace
+TEXT_COLUMNS = ["Type", "Currency", "Description"]
+
+# Sanity bounds for a personal statement
+MIN_DATE = pd.Timestamp("1990-01-01")
+MAX_FUTURE_DAYS = 7
+MAX_ABS_AMOUNT = 10_000_000
+
+
+class TransactionSchemaError(ValueError):
+    """Raised when a statement can't be validated at all, e.g. a required column is missing"""
+
+
+@dataclass
+class ValidationReport:
+    """
+    Result of validating a statement.
+
+    `valid` holds the rows that passed every check (with Amount as float,
+    Completed Date as datetime and TEXT_COLUMNS stripped), `quarantined` holds
+    the rest as uploaded with an "Errors" column, and `issue_counts` maps each
+    check to how many rows failed it.
+    """
+    valid: pd.DataFrame
+    quarantined: pd.DataFrame
+    issue_counts: Dict[str, int] = field(default_factory=dict)
+
+    @property
+    def ok(self) -> bool:
+        return self.quarantined.empty
+
+    def summary(self) -> str:
+        if self.ok:
+            return f"All {len(self.valid)} rows are valid"
+        issues = ", ".join(f"{name} ({count})" for name, count in self.issue_counts.items() if count)
+        return f"{len(self.quarantined)} of {len(self.valid) + len(self.quarantined)} rows quarantined: {issues}"
+
+
+def _distinct_values(column: pd.Series) -> Tuple[np.ndarray, pd.Series, bool]:
+    """
+    Codes and distinct values of a column, with surrounding whitespace stripped from text
+
+    Statement columns like Type, Currency and Description repeat a lot, so
+    checking and cleaning the distinct values is far cheaper than every row.
+
+    Returns:
+        The code of each row (-1 where missing), the stripped distinct values and whether stripping changed any
+    """
+    codes, uniques = pd.factorize(column, use_na_sentinel=True)
+    uniques = pd.Series(uniques, dtype=object)
+    stripped = uniques.map(lambda value: value.strip() if isinstance(value, str) else value)
+    return codes, stripped, bool((stripped != uniques).any())
+
+
+def _check_distinct(distinct_values: Tuple[np.ndarray, pd.Series, bool], is_valid, missing_is_valid: bool = False) -> np.ndarray:
+    """
+    Run a check on the distinct values of a column (see _distinct_values) and broadcast it back to every row
+
+    Returns:
+        Boolean array, True for rows that fail the check
+    """
+    codes, uniques, _ = distinct_values
+    unique_ok = np.asarray(is_valid(uniques.astype(str)), dtype=bool)
+    ok = np.where(codes == -1, missing_is_valid, unique_ok[np.maximum(codes, 0)]) if len(codes) else np.zeros(0, dtype=bool)
+    return ~ok
+
+
+def _from_distinct(column: pd.Series, codes: np.ndarray, uniques: pd.Series) -> pd.Series:
+    """Rebuild a column from its (stripped) distinct values, code -1 picking the NaN appended at the end"""
+    values = np.append(uniques.to_numpy(dtype=object), np.nan)[codes]
+    return pd.Series(values, index=column.index, name=column.name)
+
+
+def validate_transactions(df: pd.DataFrame, transaction_types: Iterable[str]) -> ValidationReport:
+    """
+    Validate a statement column by column and quarantine the bad rows
+
+    Every check is a vectorised operation over a whole column that sets one bit
+    in a per-row error mask, so validation costs a handful of passes over the
+    data however many rows there are.
+
+    Args:
+        df: The statement as read from the upload, with stripped column names
+        transaction_types: Values allowed in the Type column
+
+    Returns:
+        ValidationReport with the valid rows, the quarantined rows and a count per failed check
+
+    Raises:
+        TransactionSchemaError: If a required column is missing
+    """
+    missing = [column for column in REQUIRED_COLUMNS if column not in df.columns]
+    if missing:
+        raise TransactionSchemaError(f"The statement is missing the column(s): {', '.join(missing)}")
+
+    amounts = pd.to_numeric(df["Amount"], errors="coerce").astype("float64")
+    completed_dates = df["Completed Date"]
+    if not pd.api.types.is_datetime64_any_dtype(completed_dates):
+        # The format is inferred from the first date, rows in any other format are quarantined
+        completed_dates = pd.to_datetime(completed_dates, errors="coerce")
+    max_date = pd.Timestamp.now() + pd.Timedelta(days=MAX_FUTURE_DAYS)
+    allowed_types = set(transaction_types)
+
+    # Text is checked without surrounding whitespace, and the valid rows keep exactly the values that were checked
+    distinct = {column: _distinct_values(df[column]) for column in TEXT_COLUMNS if column in df.columns}
+    stripped_columns = {
+        column: _from_distinct(df[column], codes, uniques)
+        for column, (codes, uniques, changed) in distinct.items() if changed
+    }
+
+    # (name, boolean numpy array of failing rows)
+    checks = [
+        ("unknown type", _check_distinct(distinct["Type"], lambda values: values.isin(allowed_types))),
+        ("missing description", _check_distinct(distinct["Description"], lambda values: (values != "") & (values.str.lower() != "nan"))),
+        ("invalid amount", ~np.isfinite(amounts.to_numpy())),
+        ("amount out of range", np.abs(amounts.to_numpy()) > MAX_ABS_AMOUNT),
+        ("invalid date", completed_dates.isna().to_numpy()),
+        ("date out of range", ((completed_dates < MIN_DATE) | (completed_dates > max_date)).to_numpy(dtype=bool, na_value=False)),
+    ]
+    if "Currency" in df.columns:
+        checks.append(("invalid currency", _check_distinct(distinct["Currency"], lambda values: values.str.fullmatch(r"[A-Z]{3}"))))
+
+    error_mask = np.zeros(len(df), dtype=np.int64)
+    issue_counts = {}
+    for bit, (name, failing) in enumerate(checks):
+        error_mask |= failing.astype(np.int64) << bit
+        issue_counts[name] = int(failing.sum())
+
+    bad = error_mask != 0
+    cleaned = df.assign(Amount=amounts, **{"Completed Date": completed_dates}, **stripped_columns)
+    valid = cleaned[~bad]
+    quarantined = df[bad].copy()
+
+    # Describe each distinct combination of failures once, then map it onto the bad rows
+    if bad.any():
+        bad_masks = pd.Series(error_mask[bad], index=quarantined.index)
+        descriptions_by_mask = {
+            mask: ", ".join(name for bit, (name, _) in enumerate(checks) if mask & (1 << bit))
+            for mask in bad_masks.unique()
+        }
+        quarantined["Errors"] = bad_masks.map(descriptions_by_mask)
+
+    return ValidationReport(valid=valid, quarantined=quarantined, issue_counts=issue_counts)
@@ -0,0 +1,279 @@
+"""
+Local stub of the GoCardless Bank Account Data API.
+
+Serves tokens, requisitions and paginated account transactions (filtered by
+`date_from`) for a few generated accounts, so the sync client can be checked
+offline. Point the client at it with GOCARDLESS_BASE_URL=http://127.0.0.1:8766/api/v2/,
+or run this file directly to start the stub and run a few incremental syncs
+against it:
+
+    python -m src.utils.gocardless_stub_server --accounts 3 --transactions 2000
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+
+STUB_ACCESS_TOKEN = "stub-access-token"
+
+MERCHANTS = ["Tesco", "Sainsbury's", "TfL", "Uber", "Netflix", "Spotify", "Pret A Manger", "Amazon", "Trainline", "Lidl"]
+CODES = ["CARD_PAYMENT", "CARD_PAYMENT", "CARD_PAYMENT", "ATM", "TOPUP", "TRANSFER", "CARD_REFUND"]
+
+
+def generate_transactions(account_id: str, count: int, start: str = "2024-01-01", days: int = 365, seed: int = 0) -> List[Dict[str, Any]]:
+    """Bank-data shaped booked transactions for an account, sorted by booking date"""
+    rng = np.random.default_rng(seed)
+    booking_dates = (pd.Timestamp(start) + pd.to_timedelta(rng.integers(0, days, count), unit="D")).sort_values()
+    transactions = []
+    for i, booking_date in enumerate(booking_dates):
+        code = CODES[rng.integers(len(CODES))]
+        amount = round(float(rng.gamma(2.0, 15.0)), 2)
+        if code in ("CARD_PAYMENT", "ATM"):
+            amount = -amount
+        transaction = {
+            "transactionId": f"{account_id}-{i}-{uuid.uuid4().hex[:8]}",
+            "bookingDate": booking_date.strftime("%Y-%m-%d"),
+            "valueDate": booking_date.strftime("%Y-%m-%d"),
+            "bookingDateTime": (booking_date + pd.Timedelta(minutes=int(rng.integers(0, 1440)))).strftime("%Y-%m-%dT%H:%M:%SZ"),
+            "transactionAmount": {"amount": f"{amount:.2f}", "currency": "GBP"},
+            "proprietaryBankTransactionCode": code,
+            "remittanceInformationUnstructured": f"Ref {i}",
+        }
+        merchant = MERCHANTS[rng.integers(len(MERCHANTS))]
+        transaction["creditorName" if amount < 0 else "debtorName"] = merchant
+        transactions.append(transaction)
+    return transactions
+
+
+class BankStubConfig:
+    """Accounts and behaviour of the stub server, shared by every request handler thread"""
+
+    def __init__(
+        self,
+        accounts: int = 2,
+        transactions_per_account: int = 500,
+        page_size: int = 100,
+        latency: float = 0.05,
+        token_lifetime: int = 3600
+    ) -> None:
+        self.page_size = page_size
+        self.latency = latency
+        self.token_lifetime = token_lifetime
+        self.requests_served = 0
+        # Requests per (method, first path segment), e.g. ("POST", "token")
+        self.request_counts: Counter = Counter()
+        # The next N requests of a method ("GET"/"POST") answer 503, to exercise retries
+        self.failures: Counter = Counter()
+        # Most transaction pages being served at once, to check accounts are fetched concurrently
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+        self.transactions: Dict[str, List[Dict[str, Any]]] = {
+            f"stub-account-{i}": generate_transactions(f"stub-account-{i}", transactions_per_account, seed=i)
+            for i in range(accounts)
+        }
+
+    def add_transactions(self, account_id: str, count: int, booking_date: Optional[str] = None) -> None:
+        """Simulate new transactions arriving on an account"""
+        booking_date = booking_date or pd.Timestamp.now().strftime("%Y-%m-%d")
+        with self.lock:
+            new = generate_transactions(account_id, count, start=booking_date, days=1, seed=len(self.transactions[account_id]))
+            self.transactions[account_id].extend(new)
+
+
+class BankStubHandler(BaseHTTPRequestHandler):
+    # Set by start_bank_stub_server
+    config: BankStubConfig
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def _start_request(self, method: str, parts: List[str]) -> bool:
+        """Count the request, and answer 503 instead if a failure is queued for its method"""
+        config = self.config
+        with config.lock:
+            config.requests_served += 1
+            config.request_counts[(method, parts[0] if parts else "")] += 1
+            failing = config.failures[method] > 0
+            if failing:
+                config.failures[method] -= 1
+        if failing:
+            self._send_json(503, {"summary": "Service unavailable", "status_code": 503})
+        return not failing
+
+    def _send_json(self, status: int, body: dict) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _authorised(self) -> bool:
+        if self.headers.get("Authorization") != f"Bearer {STUB_ACCESS_TOKEN}":
+            self._send_json(401, {"summary": "Authentication failed", "status_code": 401})
+            return False
+        return True
+
+    def _parts(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        # Everything is served under /api/v2/
+        if parts[:2] == ["api", "v2"]:
+            parts = parts[2:]
+        return parts, {key: values[0] for key, values in parse_qs(url.query).items()}
+
+    def do_POST(self) -> None:
+        config = self.config
+        parts, _ = self._parts()
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self._start_request("POST", parts):
+            return
+
+        if parts == ["token", "new"]:
+            if not body.get("secret_id") or not body.get("secret_key"):
+                self._send_json(401, {"summary": "Authentication failed", "status_code": 401})
+                return
+            self._send_json(200, {
+                "access": STUB_ACCESS_TOKEN,
+                "access_expires": config.token_lifetime,
+                "refresh": "stub-refresh-token",
+                "refresh_expires": config.token_lifetime * 24
+            })
+        elif parts == ["requisitions"] and self._authorised():
+            requisition_id = uuid.uuid4().hex
+            self._send_json(201, {
+                "id": requisition_id,
+                "status": "CR",
+                "institution_id": body.get("institution_id"),
+                "link": f"http://127.0.0.1/stub-bank/{requisition_id}",
+                "accounts": []
+            })
+        elif parts != ["requisitions"]:
+            self._send_json(404, {"summary": f"Unknown path {self.path}", "status_code": 404})
+
+    def do_GET(self) -> None:
+        config = self.config
+        parts, query = self._parts()
+        if not self._start_request("GET", parts) or not self._authorised():
+            return
+
+        if len(parts) == 2 and parts[0] == "requisitions":
+            self._send_json(200, {"id": parts[1], "status": "LN", "accounts": list(config.transactions)})
+            return
+
+        if len(parts) == 3 and parts[0] == "accounts" and parts[2] == "transactions":
+            account_id = parts[1]
+            if account_id not in config.transactions:
+                self._send_json(404, {"summary": "Account not found", "status_code": 404})
+                return
+
+            with config.lock:
+                config.in_flight += 1
+                config.max_in_flight = max(config.max_in_flight, config.in_flight)
+            time.sleep(config.latency)
+            with config.lock:
+                config.in_flight -= 1
+            date_from = query.get("date_from", "")
+            page = int(query.get("page", 1))
+            with config.lock:
+                matching = [transaction for transaction in config.transactions[account_id] if transaction["bookingDate"] >= date_from]
+
+            start = (page - 1) * config.page_size
+            next_url = None
+            if start + config.page_size < len(matching):
+                next_query = f"page={page + 1}" + (f"&date_from={date_from}" if date_from else "")
+                next_url = f"http://{self.headers.get('Host')}/api/v2/accounts/{account_id}/transactions/?{next_query}"
+            self._send_json(200, {
+                "transactions": {"booked": matching[start:start + config.page_size], "pending": []},
+                "next": next_url
+            })
+            return
+
+        self._send_json(404, {"summary": f"Unknown path {self.path}", "status_code": 404})
+
+
+def start_bank_stub_server(host: str = "127.0.0.1", port: int = 8766, config: Optional[BankStubConfig] = None) -> ThreadingHTTPServer:
+    """Start the stub server on a daemon thread and return it (call `shutdown()` to stop it)"""
+    handler = type("ConfiguredBankStubHandler", (BankStubHandler,), {"config": config or BankStubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class InMemoryCursorStore:
+    """Stands in for the db manager's sync cursor and bank link methods"""
+
+    def __init__(self) -> None:
+        self.cursors: Dict[str, Dict[str, Any]] = {}
+        self.links: Dict[str, Dict[str, Any]] = {}
+
+    def get_bank_link(self, google_id: str) -> Dict[str, Any]:
+        return dict(self.links.get(google_id, {}))
+
+    def save_bank_link(self, google_id: str, link: Dict[str, Any]) -> bool:
+        self.links[google_id] = dict(link)
+        return True
+
+    def get_sync_cursors(self, google_id: str) -> Dict[str, Any]:
+        return dict(self.cursors.get(google_id, {}))
+
+    def save_sync_cursors(self, google_id: str, cursors: Dict[str, Any]) -> bool:
+        self.cursors.setdefault(google_id, {}).update(cursors)
+        return True
+
+
+if __name__ == '__main__':
+    from src.utils.gocardless_client import GoCardlessClient, sync_user_accounts
+
+    parser = argparse.ArgumentParser(description="Run the stub bank-data server and sync against it")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--accounts", type=int, default=3)
+    parser.add_argument("--transactions", type=int, default=2000, help="Transactions per account")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.05, help="Seconds per transactions page")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--serve-only", action="store_true", help="Only run the stub server")
+    args = parser.parse_args()
+
+    config = BankStubConfig(
+        accounts=args.accounts,
+        transactions_per_account=args.transactions,
+        page_size=args.page_size,
+        latency=args.latency
+    )
+    server = start_bank_stub_server(port=args.port, config=config)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}/api/v2/"
+    print(f"Stub bank-data server listening on {base_url}")
+
+    if args.serve_only:
+        threading.Event().wait()
+    else:
+        client = GoCardlessClient("stub-id", "stub-key", base_url=base_url, max_workers=args.workers)
+        store = InMemoryCursorStore()
+        account_ids = client.get_requisition_accounts("stub-requisition")
+
+        def timed_sync(label):
+            t1 = time.perf_counter()
+            result = sync_user_accounts(client, store, "stub-user", account_ids)
+            print(f"{label:<28} {len(result.transactions):>7} new rows  {time.perf_counter() - t1:8.3f} s  {result.new_per_account}")
+            return result
+
+        timed_sync("Initial sync")
+        timed_sync("Sync with nothing new")
+        for account_id in account_ids:
+            config.add_transactions(account_id, 5)
+        timed_sync("Sync after 5 new per account")
+        print(f"Requests served: {config.requests_served}")
+        client.close()
+        server.shutdown()
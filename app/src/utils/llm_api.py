@@ -1,33 +1,40 @@
-from openai import OpenAI
+from functools import lru_cache
 from src.login import db_manager
 from src.logger import logger
-import pandas as pd
+from src.metrics import metrics
+from src.utils.llm_scheduler import LLMScheduler, completion_usage, estimate_tokens
 import time
 import json
 import os
+from typing import Any, Iterator, List, Tuple
 from dotenv import load_dotenv
 
 load_dotenv()
 
 
 
-client = OpenAI(
-  api_key=os.getenv("GROK_API_KEY"),
-  base_url="https://api.x.ai/v1",
+@lru_cache(maxsize=None)
+def get_client():
+    """Create the OpenAI client on first use, so importing this module doesn't pay for the openai package"""
+    from openai import OpenAI
 
-)
+    # Retries are handled by the scheduler, so the client itself never retries
+    # (set LLM_BASE_URL to the stub server in src/utils/llm_stub_server.py to run offline)
+    return OpenAI(
+      api_key=os.getenv("GROK_API_KEY"),
+      base_url=os.getenv("LLM_BASE_URL", "https://api.x.ai/v1"),
+      max_retries=0,
+    )
 
-def timeit(func):
-    def wrapper_function(*args, **kwargs):
-        t1 = time.time()
-        result = func(*args, **kwargs)
-        t2 = time.time()
-        print(f'Function {func.__name__!r} executed in {(t2-t1):.4f}s')
-        return result
-    
-    return wrapper_function
+scheduler = LLMScheduler(
+    requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", 60)),
+    tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", 100_000)),
+    max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", 4)),
+    request_timeout=float(os.getenv("LLM_REQUEST_TIMEOUT", 120)),
+)
 
 def get_descriptions_bank_statement(df = None):
+    import pandas as pd
 
     df = pd.read_excel("../account-statement_2023-10-20_2025-04-21.xlsx")
 
@@ -47,23 +54,40 @@ def get_user_categories(google_id):
     return categories
 
 
-@timeit
+def _recategorise_messages(transaction_descriptions=None, habits=None):
+    """Build the chat messages used to categorise transaction descriptions"""
+    #TODO: in the future ammend the prompt to consider whether the user is a higher net worth person or other such factors
+    return [
+        {"role": "system", "content": f"You are a financial advisor and the user's habits are: {habits}; If the habits are unintelligible, don't consider any sort of habits and just consider the average user; " + " You are designed to output JSON with the following schema: `{ [key: string]: string[] }` "},
+
+        {"role": "user", "content": "Based on these descriptions of transactions for a personal bank statement, categorise based on the different types, for example as accomodation or transport; " + 
+        " Each category name should be one word long, usually, if there is the option to have a category with 2 words such as 'Online Services', write it as so, not as 'OnlineServices'. " +
+        "If unsure of any transaction description google the description to see what it comes up with. " + 
+        "Do not add the same the same description to more than one category. " + 
+        "The JSON dictionary should contain all of the transaction descriptions which were given, do not exclude anything under any circumstances. The categories can be biased towards what the habits are. " +
+        f"These are the transaction descriptions: {transaction_descriptions}" }
+    ]
+
+
+def _recategorise_estimated_tokens(messages):
+    """Tokens to reserve for a categorisation request, the answer repeats every description so it is roughly as long as the prompt"""
+    return estimate_tokens(messages, max_output_tokens=len(messages[-1]["content"]) // 4)
+
+
+@metrics.timed("llm.recategorise_transactions")
 def recategorise_transactions(transaction_descriptions=None, habits=None):
 
     try:
-        #TODO: in the future ammend the prompt to consider whether the user is a higher net worth person or other such factors
-        completion = client.chat.completions.create(
-        model="grok-3-mini-fast-beta",
-        messages=[
-            {"role": "system", "content": f"You are a financial advisor and the user's habits are: {habits}; If the habits are unintelligible, don't consider any sort of habits and just consider the average user; " + " You are designed to output JSON with the following schema: `{ [key: string]: string[] }` "},
-
-            {"role": "user", "content": "Based on these descriptions of transactions for a personal bank statement, categorise based on the different types, for example as accomodation or transport; " + 
-            " Each category name should be one word long, usually, if there is the option to have a category with 2 words such as 'Online Services', write it as so, not as 'OnlineServices'. " +
-            "If unsure of any transaction description google the description to see what it comes up with. " + 
-            "Do not add the same the same description to more than one category. " + 
-            "The JSON dictionary should contain all of the transaction descriptions which were given, do not exclude anything under any circumstances. The categories can be biased towards what the habits are. " +
-            f"These are the transaction descriptions: {transaction_descriptions}" }
-        ])
+        messages = _recategorise_messages(transaction_descriptions, habits)
+        completion = scheduler.run(
+            lambda timeout: get_client().chat.completions.create(
+                model="grok-3-mini-fast-beta",
+                messages=messages,
+                timeout=timeout
+            ),
+            estimated_tokens=_recategorise_estimated_tokens(messages),
+            usage_fn=completion_usage
+        )
 
         logger.info("Grok-Mini was used to categorise transaction descriptions")
 
@@ -74,19 +98,149 @@ def recategorise_transactions(transaction_descriptions=None, habits=None):
         logger.error(f"There was an error when using the Grok API Util: {str(e)}")
 
 
-@timeit
+class CategoryStreamParser:
+    """
+    Incrementally parses a `{ [key: string]: string[] }` JSON object as it is streamed.
+
+    Text is fed in chunks with `feed`, and every category whose keyword list has
+    been closed is returned straight away, so a truncated or malformed tail only
+    loses the category that was being written when the stream broke.
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.position = 0
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.string_start = None
+        self.value_start = None
+        self.current_key = None
+
+    def feed(self, text: str) -> List[Tuple[str, List[str]]]:
+        """
+        Add a chunk of streamed text to the parser
+
+        Args:
+            text: The next piece of the completion
+
+        Returns:
+            List of (category, keywords) pairs completed by this chunk
+        """
+        self.buffer += text
+        completed = []
+
+        while self.position < len(self.buffer):
+            char = self.buffer[self.position]
+
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif char == "\\":
+                    self.escaped = True
+                elif char == '"':
+                    self.in_string = False
+                    # A string directly inside the top-level object is a category name
+                    if self.depth == 1:
+                        self.current_key = self._decode(self.string_start, self.position + 1)
+            elif char == '"':
+                self.in_string = True
+                self.string_start = self.position
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 2 and char == "[":
+                    self.value_start = self.position
+            elif char in "}]":
+                if self.depth == 2 and char == "]" and self.value_start is not None:
+                    keywords = self._decode(self.value_start, self.position + 1)
+                    if isinstance(self.current_key, str) and isinstance(keywords, list):
+                        completed.append((self.current_key, [str(keyword) for keyword in keywords]))
+                    self.current_key = None
+                    self.value_start = None
+                self.depth = max(self.depth - 1, 0)
+
+            self.position += 1
+
+        return completed
+
+    def _decode(self, start: int, end: int) -> Any:
+        try:
+            return json.loads(self.buffer[start:end])
+        except json.JSONDecodeError:
+            logger.warning(f"Skipping malformed section of streamed categories: {self.buffer[start:end][:100]}")
+            return None
+
+
+def stream_recategorise_transactions(transaction_descriptions=None, habits=None) -> Iterator[Tuple[str, List[str]]]:
+    """
+    Categorise transaction descriptions, yielding each category as soon as it is complete
+
+    Args:
+        transaction_descriptions: Unique transaction descriptions to categorise
+        habits: Free text describing the user's habits
+
+    Yields:
+        (category, keywords) pairs in the order the model writes them
+    """
+    t1 = time.perf_counter()
+    parser = CategoryStreamParser()
+    categories_count = 0
+
+    try:
+        # The scheduler covers opening the stream, chunks are then read outside of its concurrency slot
+        messages = _recategorise_messages(transaction_descriptions, habits)
+        stream = scheduler.run(
+            lambda timeout: get_client().chat.completions.create(
+                model="grok-3-mini-fast-beta",
+                messages=messages,
+                stream=True,
+                timeout=timeout
+            ),
+            estimated_tokens=_recategorise_estimated_tokens(messages)
+        )
+
+        for chunk in stream:
+            if not chunk.choices:
+                continue
+            content = chunk.choices[0].delta.content
+            if not content:
+                continue
+
+            for category, keywords in parser.feed(content):
+                if categories_count == 0:
+                    metrics.observe("llm.stream_first_category", time.perf_counter() - t1)
+                categories_count += 1
+                yield category, keywords
+
+        logger.info("Grok-Mini was used to categorise transaction descriptions (streamed)")
+        metrics.observe("llm.stream_recategorise_transactions", time.perf_counter() - t1)
+
+    except Exception as e:
+        # Everything yielded before the stream broke has already been handed to the caller
+        logger.error(f"The Grok API stream stopped after {categories_count} categories: {str(e)}")
+        metrics.observe("llm.stream_recategorise_transactions", time.perf_counter() - t1, status="error")
+
+
+@metrics.timed("llm.ammend_transaction_categories")
 def ammend_transaction_categories(category_keyword_json=None, habits=None):
    
     try:
         #TODO: in the future ammend the prompt to consider whether the user is a higher net worth person or other such factors
-        completion = client.chat.completions.create(
-        model="grok-3-mini-fast-beta",
-        messages=[
+        messages = [
             {"role": "system", "content": f"You are a financial advisor and the user's habits are: {habits}; If the habits are unintelligible, don't consider any sort of habits and just consider the average user; " + " You are designed to output JSON with the following schema: `{ [key: string]: string[] }` "},
 
             {"role": "user", "content": f"Based on these categories and keywords that are created for the user, from a bank statement, ammend them and try to minimise the number of keywords that are in the Uncategorised section: {category_keyword_json}" +
             "Format is: '{ [key: string]: string[] }'"}
-        ])
+        ]
+        completion = scheduler.run(
+            lambda timeout: get_client().chat.completions.create(
+                model="grok-3-mini-fast-beta",
+                messages=messages,
+                timeout=timeout
+            ),
+            estimated_tokens=estimate_tokens(messages, max_output_tokens=len(str(category_keyword_json)) // 4),
+            usage_fn=completion_usage
+        )
 
         logger.info("Grok-Mini was used to ammend the categories and keywords of transaction descriptions")
 
@@ -0,0 +1,261 @@
+import random
+import threading
+import time
+from typing import Any, Callable, Optional
+
+from src.logger import logger
+from src.metrics import metrics
+
+
+# Status codes that are worth retrying, anything else (e.g. 400, 401) will fail the same way again
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+class LLMUnavailableError(Exception):
+    """Raised when an LLM request could not be completed after retries, or the circuit breaker is open"""
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket that refills continuously at `capacity` per minute.
+
+    The level may go negative when a request ends up using more than was
+    reserved, which simply delays the next caller until the debt is refilled.
+    """
+
+    def __init__(self, capacity_per_minute: float) -> None:
+        self.capacity = float(capacity_per_minute)
+        self.refill_rate = self.capacity / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.refill_rate)
+        self.updated_at = now
+
+    def acquire(self, amount: float = 1.0, timeout: Optional[float] = None) -> bool:
+        """
+        Block until `amount` tokens are available and take them
+
+        Args:
+            amount: Number of tokens to take, capped at the bucket capacity
+            timeout: Maximum number of seconds to wait, None waits forever
+
+        Returns:
+            True if the tokens were taken, False if the timeout was reached first
+        """
+        amount = min(float(amount), self.capacity)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                self._refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return True
+                wait = (amount - self.level) / self.refill_rate
+
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                wait = min(wait, remaining)
+            time.sleep(wait)
+
+    def adjust(self, amount: float) -> None:
+        """Take (or give back, if negative) tokens without waiting, e.g. once the real usage is known"""
+        with self.lock:
+            self._refill()
+            self.level = min(self.capacity, self.level - amount)
+
+
+class CircuitBreaker:
+    """
+    Stops sending requests after `failure_threshold` consecutive failures.
+
+    After `reset_timeout` seconds a single trial request is let through
+    (half-open); if it succeeds the breaker closes again, otherwise it re-opens.
+    """
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0) -> None:
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+        self.trial_in_flight = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self.lock:
+            if self.opened_at is None:
+                return "closed"
+            if time.monotonic() - self.opened_at >= self.reset_timeout:
+                return "half-open"
+            return "open"
+
+    def allow_request(self) -> bool:
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            if time.monotonic() - self.opened_at < self.reset_timeout or self.trial_in_flight:
+                return False
+            self.trial_in_flight = True
+            return True
+
+    def record_success(self) -> None:
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.trial_in_flight = False
+
+    def release_trial(self) -> None:
+        """End a request that says nothing about the API's health, so a half-open breaker can let another trial through"""
+        with self.lock:
+            self.trial_in_flight = False
+
+    def record_failure(self) -> None:
+        with self.lock:
+            self.failures += 1
+            self.trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.warning(f"LLM circuit breaker opened after {self.failures} consecutive failures")
+                self.opened_at = time.monotonic()
+
+
+def get_status_code(error: Exception) -> Optional[int]:
+    """Get the HTTP status code from an OpenAI SDK (or requests/httpx) error, if it has one"""
+    status_code = getattr(error, "status_code", None)
+    if status_code is None:
+        response = getattr(error, "response", None)
+        status_code = getattr(response, "status_code", None)
+    return status_code
+
+
+def is_retryable(error: Exception) -> bool:
+    """Rate limits, server errors, timeouts and dropped connections are retried, everything else is not"""
+    status_code = get_status_code(error)
+    if status_code is not None:
+        return status_code in RETRYABLE_STATUS_CODES
+
+    # The OpenAI SDK raises APITimeoutError/APIConnectionError without a status code
+    return isinstance(error, (TimeoutError, ConnectionError)) or type(error).__name__ in {"APITimeoutError", "APIConnectionError"}
+
+
+def get_retry_after(error: Exception) -> Optional[float]:
+    """Read the Retry-After header (in seconds) from an error response, if the server sent one"""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class LLMScheduler:
+    """
+    Schedules requests to the LLM API.
+
+    Every request goes through a circuit breaker, a bounded number of
+    concurrent slots, and request/token per minute buckets. Failed requests
+    with a retryable status are retried with full-jitter exponential backoff.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 60,
+        tokens_per_minute: float = 100_000,
+        max_concurrency: int = 4,
+        request_timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_max: float = 20.0,
+        circuit_breaker: Optional[CircuitBreaker] = None
+    ) -> None:
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.request_timeout = request_timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+
+
+    def _backoff(self, attempt: int, error: Exception) -> float:
+        retry_after = get_retry_after(error)
+        if retry_after is not None:
+            return min(retry_after, self.backoff_max)
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * (2 ** attempt)))
+
+
+    def run(
+        self,
+        request_fn: Callable[..., Any],
+        estimated_tokens: int = 0,
+        usage_fn: Optional[Callable[[Any], Optional[int]]] = None
+    ) -> Any:
+        """
+        Run a request through the scheduler
+
+        Args:
+            request_fn: Callable sending the request, it is given the per-request `timeout` in seconds
+            estimated_tokens: Tokens to reserve from the tokens per minute bucket before sending
+            usage_fn: Optional callable returning the real number of tokens used from the result
+
+        Returns:
+            The result of `request_fn`
+
+        Raises:
+            LLMUnavailableError: If the circuit breaker is open, or the request failed after all retries
+        """
+        last_error: Optional[Exception] = None
+
+        for attempt in range(self.max_retries + 1):
+            if not self.circuit_breaker.allow_request():
+                metrics.increment("llm_circuit_open_rejections", "llm.request")
+                raise LLMUnavailableError("The LLM API is currently unavailable, please try again later") from last_error
+
+            with self.slots:
+                self.request_bucket.acquire(1)
+                self.token_bucket.acquire(estimated_tokens)
+
+                try:
+                    result = request_fn(timeout=self.request_timeout)
+                except Exception as e:
+                    last_error = e
+                    if not is_retryable(e):
+                        # e.g. a bad request, which says nothing about the API's health, so the breaker stays as it is
+                        self.circuit_breaker.release_trial()
+                        raise LLMUnavailableError(f"LLM request failed: {str(e)}") from e
+                    self.circuit_breaker.record_failure()
+                    metrics.increment("llm_retryable_failures", "llm.request")
+                    logger.warning(f"LLM request failed with status {get_status_code(e)} (attempt {attempt + 1}): {str(e)}")
+                else:
+                    self.circuit_breaker.record_success()
+                    if usage_fn is not None:
+                        used_tokens = usage_fn(result)
+                        if used_tokens is not None:
+                            self.token_bucket.adjust(used_tokens - estimated_tokens)
+                    return result
+
+            if attempt < self.max_retries:
+                time.sleep(self._backoff(attempt, last_error))
+
+        raise LLMUnavailableError(f"LLM request failed after {self.max_retries + 1} attempts: {str(last_error)}") from last_error
+
+
+def estimate_tokens(messages: list, max_output_tokens: int = 0) -> int:
+    """Rough token estimate for chat messages (~4 characters per token)"""
+    return sum(len(str(message.get("content", ""))) for message in messages) // 4 + max_output_tokens
+
+
+def completion_usage(completion: Any) -> Optional[int]:
+    """Total tokens reported by a (non-streamed) chat completion"""
+    usage = getattr(completion, "usage", None)
+    return getattr(usage, "total_tokens", None)
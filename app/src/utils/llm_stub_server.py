@@ -0,0 +1,217 @@
+"""
+Local OpenAI-compatible stub of the chat completions API.
+
+Used to load-test the LLM scheduler offline. Point the app at it with
+LLM_BASE_URL=http://127.0.0.1:8765/v1, or run this file directly to start the
+stub and fire a load test through `LLMScheduler`:
+
+    python -m src.utils.llm_stub_server --requests 200 --failure-rate 0.2
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+
+from src.utils.llm_scheduler import TokenBucket
+
+
+DEFAULT_RESPONSE = {
+    "Groceries": ["Tesco", "Sainsbury's", "Lidl"],
+    "Transport": ["TfL", "Uber", "Trainline"],
+    "Entertainment": ["Netflix", "Spotify"],
+    "Uncategorised": []
+}
+
+
+class StubConfig:
+    """Behaviour of the stub server, shared by every request handler thread"""
+
+    def __init__(
+        self,
+        latency: float = 0.2,
+        failure_rate: float = 0.0,
+        failure_status: int = 500,
+        requests_per_minute: Optional[float] = None,
+        response_content: Optional[str] = None,
+        stream_chunk_size: int = 8
+    ) -> None:
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.failure_status = failure_status
+        self.rate_limiter = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.response_content = response_content or json.dumps(DEFAULT_RESPONSE)
+        self.stream_chunk_size = stream_chunk_size
+        self.requests_served = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    config: StubConfig = StubConfig()
+
+    def log_message(self, format, *args) -> None:
+        # Keep the load test output readable
+        pass
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, status: int, message: str, headers: Optional[dict] = None) -> None:
+        self._send_json(status, {"error": {"message": message, "type": "stub_error", "code": status}}, headers)
+
+    def do_GET(self) -> None:
+        if self.path.rstrip("/").endswith("/models"):
+            self._send_json(200, {"object": "list", "data": [{"id": "stub-model", "object": "model", "owned_by": "stub"}]})
+        else:
+            self._send_error(404, f"Unknown path {self.path}")
+
+    def do_POST(self) -> None:
+        config = self.config
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_error(404, f"Unknown path {self.path}")
+            return
+
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+
+        with config.lock:
+            config.requests_served += 1
+
+        if config.rate_limiter is not None and not config.rate_limiter.acquire(1, timeout=0):
+            self._send_error(429, "Rate limit reached", {"retry-after": "1"})
+            return
+
+        time.sleep(config.latency)
+
+        if random.random() < config.failure_rate:
+            self._send_error(config.failure_status, "Simulated failure")
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = request.get("model", "stub-model")
+        content = config.response_content
+        prompt_tokens = sum(len(str(message.get("content", ""))) for message in request.get("messages", [])) // 4
+        completion_tokens = len(content) // 4
+
+        if request.get("stream"):
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            for start in range(0, len(content), config.stream_chunk_size):
+                chunk = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": {"content": content[start:start + config.stream_chunk_size]}, "finish_reason": None}]
+                }
+                self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+                self.wfile.flush()
+            self.wfile.write(b"data: [DONE]\n\n")
+            return
+
+        self._send_json(200, {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+        })
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 8765, config: Optional[StubConfig] = None) -> ThreadingHTTPServer:
+    """Start the stub server on a daemon thread and return it (call `shutdown()` to stop it)"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": config or StubConfig()})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_load_test(base_url: str, total_requests: int, scheduler, workers: int = 16) -> dict:
+    """
+    Send `total_requests` chat completions through `scheduler` and report throughput
+
+    Returns:
+        Dictionary with successes, failures, elapsed seconds, requests per second and latency percentiles
+    """
+    from concurrent.futures import ThreadPoolExecutor
+    from openai import OpenAI
+    from src.utils.llm_scheduler import completion_usage, estimate_tokens
+
+    client = OpenAI(api_key="stub", base_url=base_url, max_retries=0)
+    messages = [{"role": "user", "content": "Categorise these transactions: ['Tesco', 'TfL']"}]
+    latencies = []
+    failures = []
+
+    def send_request(_):
+        t1 = time.perf_counter()
+        try:
+            scheduler.run(
+                lambda timeout: client.chat.completions.create(model="stub-model", messages=messages, timeout=timeout),
+                estimated_tokens=estimate_tokens(messages),
+                usage_fn=completion_usage
+            )
+            latencies.append(time.perf_counter() - t1)
+        except Exception as e:
+            failures.append(type(e).__name__)
+
+    t1 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        list(executor.map(send_request, range(total_requests)))
+    elapsed = time.perf_counter() - t1
+
+    latencies.sort()
+    percentile = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] if latencies else None
+    return {
+        "successes": len(latencies),
+        "failures": len(failures),
+        "elapsed_s": round(elapsed, 3),
+        "requests_per_s": round(total_requests / elapsed, 2),
+        "p50_s": percentile(0.50),
+        "p95_s": percentile(0.95),
+        "circuit_breaker": scheduler.circuit_breaker.state
+    }
+
+
+if __name__ == '__main__':
+    from src.utils.llm_scheduler import LLMScheduler
+
+    parser = argparse.ArgumentParser(description="Run the stub LLM server and load-test the scheduler against it")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--failure-status", type=int, default=500)
+    parser.add_argument("--server-rpm", type=float, default=None, help="Make the stub answer 429 above this rate")
+    parser.add_argument("--rpm", type=float, default=600, help="Scheduler requests per minute")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--serve-only", action="store_true", help="Only run the stub server")
+    args = parser.parse_args()
+
+    server = start_stub_server(port=args.port, config=StubConfig(
+        latency=args.latency,
+        failure_rate=args.failure_rate,
+        failure_status=args.failure_status,
+        requests_per_minute=args.server_rpm
+    ))
+    base_url = f"http://127.0.0.1:{args.port}/v1"
+    print(f"Stub LLM server listening on {base_url}")
+
+    if args.serve_only:
+        threading.Event().wait()
+    else:
+        scheduler = LLMScheduler(requests_per_minute=args.rpm, max_concurrency=args.concurrency, request_timeout=10, backoff_base=0.1)
+        print(json.dumps(run_load_test(base_url, args.requests, scheduler), indent=4))
+        server.shutdown()
@@ -0,0 +1,135 @@
+import os
+import sys
+from typing import Any, Dict, List, Optional, Set
+
+import numpy as np
+import pandas as pd
+
+from src.dataset_store import DatasetHandle
+
+
+def deep_size(value: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Approximate memory footprint of a value in bytes
+
+    DataFrames/Series are measured with `memory_usage(deep=True)`, containers
+    are walked recursively (each object is only counted once), and dataset
+    handles only count their own views since the frame is shared.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(deep=True).sum())
+    if isinstance(value, (pd.Series, pd.Index)):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return int(value.nbytes)
+    if isinstance(value, DatasetHandle):
+        return sys.getsizeof(value) + sum(int(positions.nbytes) for positions in value.views.values())
+
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    return size
+
+
+def process_rss_bytes() -> Optional[int]:
+    """Resident set size of this process (current on Linux, peak elsewhere), or None if unknown"""
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+
+    try:
+        import resource
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and kilobytes on Linux
+        return max_rss if sys.platform == "darwin" else max_rss * 1024
+    except ImportError:
+        return None
+
+
+def format_bytes(size: Optional[float]) -> str:
+    if size is None:
+        return "unknown"
+    for unit in ["B", "KB", "MB", "GB"]:
+        if abs(size) < 1024 or unit == "GB":
+            return f"{size:,.1f} {unit}" if unit != "B" else f"{int(size)} B"
+        size /= 1024
+
+
+def preview(value: Any, max_rows: int = 5, max_items: int = 20, max_chars: int = 500) -> Any:
+    """Small, cheap to render preview of a value, instead of sending the whole thing to the browser"""
+    if isinstance(value, pd.DataFrame):
+        return value.head(max_rows)
+    if isinstance(value, pd.Series):
+        return value.head(max_rows).to_frame()
+    if isinstance(value, dict):
+        items = list(value.items())[:max_items]
+        return {str(key): preview(item, max_rows, max_items, max_chars) for key, item in items}
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = list(value)[:max_items]
+        return [preview(item, max_rows, max_items, max_chars) for item in items]
+
+    text = repr(value) if not isinstance(value, str) else value
+    return text if len(text) <= max_chars else text[:max_chars] + "…"
+
+
+def cache_entry_stats() -> List[Dict[str, Any]]:
+    """
+    Number and total size of the st.cache_data/st.cache_resource entries, per cached function
+
+    Uses Streamlit's own cache stats providers, so it is best effort across Streamlit versions.
+    """
+    try:
+        from streamlit.runtime.caching import get_data_cache_stats_provider, get_resource_cache_stats_provider
+    except ImportError:
+        return []
+
+    rows: Dict[tuple, Dict[str, Any]] = {}
+    for provider in (get_data_cache_stats_provider(), get_resource_cache_stats_provider()):
+        stats = provider.get_stats()
+        # Newer Streamlit versions group the stats by metric family
+        if isinstance(stats, dict):
+            stats = [stat for family_stats in stats.values() for stat in family_stats]
+        for stat in stats:
+            key = (stat.category_name, stat.cache_name)
+            row = rows.setdefault(key, {"cache": stat.category_name, "function": stat.cache_name, "entries": 0, "bytes": 0})
+            row["entries"] += 1
+            row["bytes"] += stat.byte_length
+    return sorted(rows.values(), key=lambda row: row["bytes"], reverse=True)
+
+
+def active_session_states() -> Dict[str, Dict[str, Any]]:
+    """
+    Session state of every active session, keyed by session id
+
+    Relies on Streamlit internals (the runtime's session manager), so returns
+    an empty dict if they aren't available.
+    """
+    try:
+        from streamlit.runtime import Runtime
+        session_infos = Runtime.instance()._session_mgr.list_active_sessions()
+    except Exception:
+        return {}
+
+    states = {}
+    for session_info in session_infos:
+        try:
+            states[session_info.session.id] = dict(session_info.session.session_state.filtered_state)
+        except Exception:
+            continue
+    return states
@@ -0,0 +1,193 @@
+"""
+Synthetic Revolut-shaped statements, for benchmarks and local testing.
+
+Statements have the columns of a Revolut export, signed amounts (debits are
+negative), a configurable mix of transaction types, merchants and currencies,
+monthly subscriptions for the recurring payment detection, and EXCHANGE
+transactions as the two legs Revolut exports. The same seed always gives the
+same statement.
+
+    python -m src.utils.statement_generator --rows 100000 --output statement.xlsx
+"""
+import argparse
+from typing import Dict, Optional, Sequence
+
+import numpy as np
+import pandas as pd
+
+
+REVOLUT_COLUMNS = [
+    "Type", "Product", "Started Date", "Completed Date", "Description",
+    "Amount", "Fee", "Currency", "State", "Balance"
+]
+
+# Share of each type among the non-exchange transactions
+DEFAULT_TYPES = {
+    "CARD_PAYMENT": 0.7,
+    "TRANSFER": 0.1,
+    "TOPUP": 0.1,
+    "ATM": 0.05,
+    "CARD_REFUND": 0.03,
+    "REWARD": 0.02,
+}
+
+DEBIT_TYPES = {"CARD_PAYMENT", "ATM"}
+
+# Rough value of one unit in GBP, the generated rates wander around these
+REFERENCE_RATES = {"GBP": 1.0, "EUR": 0.86, "USD": 0.79, "CHF": 0.9, "JPY": 0.0053, "PLN": 0.2}
+
+SYLLABLES = ["ka", "lo", "mi", "ne", "ru", "sa", "to", "vi", "pe", "da", "go", "fu", "ri", "ban", "cor", "mel", "tas", "zen"]
+SUFFIXES = ["", " Store", " Cafe", " Market", " Ltd", " Online", " Express", " Kitchen"]
+
+
+def merchant_names(count: int) -> np.ndarray:
+    """
+    Distinct, letters-only merchant names (digits would be stripped when merchants are grouped)
+
+    Names are built from syllables like a number in base len(SYLLABLES), so any count is possible.
+    """
+    names = []
+    for i in range(count):
+        # Offset so every name has at least two syllables
+        syllables, n = [], i + len(SYLLABLES)
+        while n:
+            syllables.append(SYLLABLES[n % len(SYLLABLES)])
+            n //= len(SYLLABLES)
+        word = "".join(reversed(syllables))
+        names.append(f"{word.capitalize()}{SUFFIXES[i % len(SUFFIXES)]}")
+    return np.array(names, dtype=object)
+
+
+def generate_statement(
+    rows: int,
+    merchants: int = 200,
+    currencies: Sequence[str] = ("GBP",),
+    types: Optional[Dict[str, float]] = None,
+    start: str = "2023-01-01",
+    days: int = 730,
+    subscriptions: int = 10,
+    exchange_share: float = 0.0,
+    seed: int = 0
+) -> pd.DataFrame:
+    """
+    Revolut-shaped statement sorted by date
+
+    Args:
+        rows: Number of rows, exchange legs and subscription charges included
+        merchants: Number of distinct merchant descriptions
+        currencies: Currencies of the rows, the first one being the main account's
+        types: Type -> share of the non-exchange rows (defaults to DEFAULT_TYPES)
+        start: First day of the statement
+        days: Number of days the statement spans
+        subscriptions: Merchants charging a fixed amount every month, within the rows
+        exchange_share: Share of rows that are EXCHANGE legs (two per exchange)
+        seed: Random seed
+
+    Returns:
+        Statement with REVOLUT_COLUMNS
+    """
+    rng = np.random.default_rng(seed)
+    types = types or DEFAULT_TYPES
+    names = merchant_names(merchants + subscriptions)
+    start_date = pd.Timestamp(start)
+
+    # Monthly subscriptions, as many full months as the statement spans
+    months = max(days // 30, 1)
+    subscription_rows = min(subscriptions * months, rows)
+    subscription_ids = np.arange(subscription_rows) // months
+    subscription_dates = start_date + pd.to_timedelta(
+        (subscription_ids % 28) + 30.44 * (np.arange(subscription_rows) % months), unit="D"
+    ).floor("D")
+    subscription_amounts = np.round(4.99 + 5 * (subscription_ids % 4), 2)
+
+    exchanges = int(rows * exchange_share) // 2 if len(currencies) > 1 else 0
+    other_rows = rows - subscription_rows - 2 * exchanges
+
+    type_names = np.array(list(types), dtype=object)
+    shares = np.array(list(types.values()), dtype=float)
+    row_types = type_names[rng.choice(len(type_names), other_rows, p=shares / shares.sum())]
+    amounts = np.round(rng.gamma(2.0, 15.0, other_rows), 2)
+    amounts[np.isin(row_types, list(DEBIT_TYPES))] *= -1
+    # Most rows in the main currency, the others spread over the rest
+    currency_choice = np.asarray(currencies, dtype=object)
+    currency_weights = np.full(len(currencies), 0.2 / max(len(currencies) - 1, 1))
+    currency_weights[0] = 1.0 if len(currencies) == 1 else 0.8
+
+    frames = [
+        pd.DataFrame({
+            "Type": row_types,
+            "Started Date": start_date + pd.to_timedelta(rng.integers(0, days * 86400, other_rows), unit="s"),
+            "Description": names[rng.integers(0, merchants, other_rows)],
+            "Amount": amounts,
+            "Currency": currency_choice[rng.choice(len(currencies), other_rows, p=currency_weights)],
+        }),
+        pd.DataFrame({
+            "Type": "CARD_PAYMENT",
+            "Started Date": subscription_dates + pd.Timedelta(hours=9),
+            "Description": names[merchants + subscription_ids],
+            "Amount": -subscription_amounts,
+            "Currency": currencies[0],
+        }),
+    ]
+
+    if exchanges:
+        # Two legs at the same moment: money out of the main currency, into another one
+        moments = start_date + pd.to_timedelta(rng.integers(0, days * 86400, exchanges), unit="s")
+        bought = currency_choice[rng.integers(1, len(currencies), exchanges)]
+        sold_amounts = np.round(rng.gamma(2.0, 50.0, exchanges), 2)
+        rates = np.array([REFERENCE_RATES.get(currency, 1.0) for currency in bought]) / REFERENCE_RATES.get(currencies[0], 1.0)
+        frames.append(pd.DataFrame({
+            "Type": "EXCHANGE",
+            "Started Date": np.concatenate([moments, moments]),
+            "Description": np.concatenate([np.full(exchanges, "Exchanged to ", dtype=object) + bought, np.full(exchanges, f"Exchanged from {currencies[0]}", dtype=object)]),
+            "Amount": np.concatenate([-sold_amounts, np.round(sold_amounts / rates, 2)]),
+            "Currency": np.concatenate([np.full(exchanges, currencies[0], dtype=object), bought]),
+        }))
+
+    statement = pd.concat(frames, ignore_index=True).sort_values("Started Date", kind="stable").reset_index(drop=True)
+    # Card payments settle a day or two later, everything else straight away
+    settle_days = np.where(statement["Type"] == "CARD_PAYMENT", rng.integers(0, 3, len(statement)), 0)
+    statement["Completed Date"] = statement["Started Date"] + pd.to_timedelta(settle_days, unit="D")
+    statement["Product"] = "Current"
+    statement["Fee"] = 0.0
+    statement["State"] = "COMPLETED"
+    statement["Balance"] = statement.groupby("Currency")["Amount"].cumsum().round(2)
+    return statement[REVOLUT_COLUMNS]
+
+
+def generate_fx_rates(currencies: Sequence[str], base_currency: str = "GBP", start: str = "2023-01-01", days: int = 730, seed: int = 0) -> pd.DataFrame:
+    """Daily rates (Date, Currency, Rate) for an FX rate store, a small random walk around REFERENCE_RATES"""
+    rng = np.random.default_rng(seed)
+    dates = pd.date_range(start, periods=days, freq="D")
+    frames = []
+    for currency in currencies:
+        if currency == base_currency:
+            continue
+        reference = REFERENCE_RATES.get(currency, 1.0) / REFERENCE_RATES.get(base_currency, 1.0)
+        walk = np.exp(np.cumsum(rng.normal(0, 0.003, days)))
+        frames.append(pd.DataFrame({"Date": dates, "Currency": currency, "Rate": reference * walk}))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=["Date", "Currency", "Rate"])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Write a synthetic Revolut-shaped statement")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--merchants", type=int, default=200)
+    parser.add_argument("--currencies", default="GBP", help="Comma separated, the first is the main currency")
+    parser.add_argument("--start", default="2023-01-01")
+    parser.add_argument("--days", type=int, default=730)
+    parser.add_argument("--subscriptions", type=int, default=10)
+    parser.add_argument("--exchange-share", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", required=True, help=".xlsx or .csv file")
+    args = parser.parse_args()
+
+    statement = generate_statement(
+        args.rows, merchants=args.merchants, currencies=args.currencies.split(","), start=args.start,
+        days=args.days, subscriptions=args.subscriptions, exchange_share=args.exchange_share, seed=args.seed
+    )
+    if args.output.endswith(".csv"):
+        statement.to_csv(args.output, index=False)
+    else:
+        statement.to_excel(args.output, index=False)
+    print(f"Wrote {len(statement)} transactions to {args.output}")
@@ -1,22 +1,32 @@
 import streamlit as st
-import pandas as pd
-import plotly.express as px
-import json
 import os
 from src.logger import logger
+from src.metrics import metrics
 
 
 
 
 st.set_page_config(page_title="Simple Finance App", page_icon="💰", layout="wide")
 
+
+@st.cache_resource
+def start_metrics_endpoint(port: int):
+    """Expose the Prometheus metrics on http://127.0.0.1:<port>/metrics (started once per process)"""
+    logger.info(f"Serving metrics on port {port}")
+    return metrics.start_http_server(port)
+
+if os.getenv("METRICS_PORT"):
+    start_metrics_endpoint(int(os.getenv("METRICS_PORT")))
+
 login_page = st.Page("src/pages/login_page.py", title="Login Page" )
 main_page = st.Page("src/pages/main_page.py", title="Main Dashboard")
 waterfall_page = st.Page("src/pages/waterfall.py", title="Waterfall Chart") 
 session_state_page = st.Page("src/pages/show_session_state.py", title="Show Session State")
+# Hidden from the sidebar, only reachable at /metrics_admin and only shown to admins
+metrics_admin_page = st.Page("src/pages/metrics_admin.py", title="Metrics", url_path="metrics_admin", visibility="hidden")
 
 
-pg = st.navigation([login_page, main_page, waterfall_page, session_state_page])
+pg = st.navigation([login_page, main_page, waterfall_page, session_state_page, metrics_admin_page])
 pg.run()
 
 
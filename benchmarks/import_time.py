@@ -0,0 +1,111 @@
+"""
+Import-time benchmark for the app's cold start, based on `python -X importtime`.
+
+Each target is imported in a fresh interpreter after streamlit itself, so the
+numbers are what the app adds on top of streamlit. Results are appended to
+benchmarks/results/import_time.jsonl with the current commit, so regressions
+show up in the history.
+
+    python benchmarks/import_time.py            # measure and record
+    python benchmarks/import_time.py --check    # also fail if the login page pulls in heavy packages
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+from datetime import datetime, timezone
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_DIR = os.path.join(REPO_ROOT, "app")
+RESULTS_FILE = os.path.join(REPO_ROOT, "benchmarks", "results", "import_time.jsonl")
+
+# What each page/module imports when it is first run
+TARGETS = {
+    "streamlit_app": ["src.logger", "src.metrics"],
+    "login_page": ["src.pages.login_page"],
+    "llm_api": ["src.utils.llm_api"],
+}
+
+# Packages the login page must render without
+HEAVY_PACKAGES = ["plotly", "openai", "pandas", "pymongo"]
+
+
+def measure(modules, runs=5):
+    """
+    Import `modules` in fresh interpreters and parse the -X importtime output
+
+    Returns:
+        (median milliseconds, list of top-level packages imported on top of streamlit)
+    """
+    code = "import streamlit\n" + "\n".join(f"import {module}" for module in modules)
+    timings = []
+    packages = set()
+
+    for _ in range(runs):
+        # Run from a temporary directory so the logger's logs/ folder doesn't end up in the repo
+        with tempfile.TemporaryDirectory() as cwd:
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "-c", code],
+                cwd=cwd,
+                env={**os.environ, "PYTHONPATH": APP_DIR},
+                capture_output=True,
+                text=True
+            )
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing {modules} failed:\n{result.stderr[-2000:]}")
+
+        lines = [line for line in result.stderr.splitlines() if line.startswith("import time:") and "|" in line]
+        rows = []
+        for line in lines[1:]:
+            _, cumulative, name = line.split("|")
+            if cumulative.strip().isdigit():
+                rows.append((int(cumulative), name.rstrip()))
+
+        # Everything after streamlit's own top-level import line is caused by the app
+        streamlit_index = max(i for i, (_, name) in enumerate(rows) if name.strip() == "streamlit")
+        app_rows = rows[streamlit_index + 1:]
+        timings.append(sum(cumulative for cumulative, name in app_rows if not name.startswith("  ")) / 1000)
+        packages.update(name.strip().split(".")[0] for _, name in app_rows)
+
+    return statistics.median(timings), sorted(packages)
+
+
+def current_commit():
+    """The checked-out commit, marked -dirty when the tree has uncommitted changes (e.g. the ones being measured)"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--check", action="store_true", help="Exit with an error if the login page imports a heavy package")
+    parser.add_argument("--no-record", action="store_true", help="Don't append the results to the results file")
+    args = parser.parse_args()
+
+    record = {"commit": current_commit(), "time": datetime.now(timezone.utc).isoformat(), "python": sys.version.split()[0], "targets": {}}
+    for target, modules in TARGETS.items():
+        milliseconds, packages = measure(modules, runs=args.runs)
+        heavy = [package for package in HEAVY_PACKAGES if package in packages]
+        record["targets"][target] = {"import_ms": round(milliseconds, 1), "heavy_packages": heavy}
+        print(f"{target:<15} {milliseconds:8.1f} ms   heavy packages: {', '.join(heavy) or '-'}")
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+    heavy_on_login = record["targets"]["login_page"]["heavy_packages"]
+    if args.check and heavy_on_login:
+        print(f"The login page imports {', '.join(heavy_on_login)}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,285 @@
+"""
+Benchmark suite of the data pipeline, on synthetic statements.
+
+Times the steps every dashboard goes through, on statements made by
+src/utils/statement_generator.py so runs are reproducible without anyone's
+real export:
+
+    validate_transactions     column-wise validation of a large statement (--validate-rows), dates typed as read from an .xlsx
+    validate_transactions_csv the same with the dates as text, as read from a .csv
+    load_transactions         reading, validating and categorising an uploaded .xlsx
+    categorise_transactions   keyword and rule categorisation of a large statement
+    filter_and_aggregate      the expense summary fragment (filters, totals, chart)
+    build_aggregates          the precomputed aggregates (monthly rollups and what's derived from them)
+    update_aggregates         adding a bank sync's worth of new rows (1%) to them
+    detect_anomalies          duplicate and unusual charge flags of every debit
+    forecast_month            the budgets tab's month-end forecast, from the day x category rollup
+    create_waterfall_chart    the cash flow waterfall page's chart
+    db.*                      MongoDBManager calls against a local stand-in
+
+The database is an in-memory stand-in for Mongo (with an optional round-trip
+latency), or a real local server with --mongodb-uri.
+Results are appended to benchmarks/results/pipeline_time.jsonl with the
+commit, and --compare shows the change from the last recorded run of the same
+size and database, so regressions show up across commits.
+
+    python benchmarks/pipeline_time.py --rows 200000 --compare
+"""
+import argparse
+import copy
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from collections import namedtuple
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(REPO_ROOT, "benchmarks", "results", "pipeline_time.jsonl")
+
+from rerun_time import current_commit, time_call
+from rules_time import RULES
+from src.utils.statement_generator import generate_fx_rates, generate_statement
+
+CURRENCIES = ("GBP", "EUR", "USD")
+
+
+class InMemoryCollection:
+    """
+    Stand-in for a Mongo collection, with just the queries MongoDBManager makes
+
+    Documents are deep-copied in and out like they would be over the wire, and
+    every call waits `latency` seconds to stand for the round trip.
+    """
+
+    def __init__(self, latency: float = 0.0) -> None:
+        self.documents = []
+        self.latency = latency
+
+    def _wait(self):
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _matches(self, document, query):
+        for key, expected in query.items():
+            value = _get_path(document, key)
+            if isinstance(expected, dict) and "$exists" in expected:
+                if (value is not _MISSING) != expected["$exists"]:
+                    return False
+            elif value != expected:
+                return False
+        return True
+
+    def find_one(self, query, projection=None):
+        self._wait()
+        for document in self.documents:
+            if self._matches(document, query):
+                if projection:
+                    return copy.deepcopy({key: document[key] for key in projection if key in document})
+                return copy.deepcopy(document)
+        return None
+
+    def insert_one(self, document):
+        self._wait()
+        self.documents.append(copy.deepcopy(document))
+
+    def update_one(self, query, update, upsert=False):
+        self._wait()
+        document = next((document for document in self.documents if self._matches(document, query)), None)
+        result = UpdateResult(matched_count=int(document is not None))
+        if document is None:
+            if not upsert:
+                return result
+            document = {key: value for key, value in query.items() if not isinstance(value, dict)}
+            self.documents.append(document)
+        for path, value in update.get("$set", {}).items():
+            _set_path(document, path, copy.deepcopy(value))
+        for path, value in update.get("$addToSet", {}).items():
+            values = _get_path(document, path)
+            if values is _MISSING:
+                _set_path(document, path, [value])
+            elif value not in values:
+                values.append(value)
+        return result
+
+
+class InMemoryDatabase(dict):
+    """Collections are created on first use, like in Mongo"""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        super().__init__()
+        self.latency = latency
+
+    def __missing__(self, name):
+        self[name] = InMemoryCollection(self.latency)
+        return self[name]
+
+
+_MISSING = object()
+
+UpdateResult = namedtuple("UpdateResult", ["matched_count"])
+
+
+def _get_path(document, path):
+    for key in path.split("."):
+        if not isinstance(document, dict) or key not in document:
+            return _MISSING
+        document = document[key]
+    return document
+
+
+def _set_path(document, path, value):
+    *parents, last = path.split(".")
+    for key in parents:
+        document = document.setdefault(key, {})
+    document[last] = value
+
+
+def db_manager_for(args):
+    from src.login.mongodb_manager import MongoDBManager
+    if args.mongodb_uri:
+        manager = MongoDBManager(args.mongodb_uri, "benchmark")
+        manager.users_collection.delete_many({"google_id": "benchmark-user"})
+        return manager
+    # The client doesn't connect until it's used, and it never is once the database is swapped
+    manager = MongoDBManager("mongodb://127.0.0.1:27017", "benchmark")
+    manager.db = InMemoryDatabase(latency=args.db_latency_ms / 1000)
+    manager.users_collection = manager.db["users"]
+    return manager
+
+
+def previous_record(rows, load_rows, db):
+    if not os.path.exists(RESULTS_FILE):
+        return None
+    previous = None
+    with open(RESULTS_FILE) as f:
+        for line in f:
+            record = json.loads(line)
+            if (record["rows"], record["load_rows"], record["db"]) == (rows, load_rows, db):
+                previous = record
+    return previous
+
+
+def time_validation(rows, repeats):
+    """Validation of a large statement, timed before the other steps so its frames are freed before they run"""
+    from src.transactions.pipeline import TYPE_TO_DEBIT_CREDIT
+    from src.transactions.schema import validate_transactions
+
+    statement = generate_statement(rows, currencies=CURRENCIES, exchange_share=0.02, seed=1)
+    text_dates = statement.astype({"Started Date": str, "Completed Date": str})
+    return {
+        "validate_transactions": time_call(lambda: validate_transactions(statement, TYPE_TO_DEBIT_CREDIT.keys()), repeats),
+        "validate_transactions_csv": time_call(lambda: validate_transactions(text_dates, TYPE_TO_DEBIT_CREDIT.keys()), repeats),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=200000, help="Rows of the statement most steps run on")
+    parser.add_argument("--load-rows", type=int, default=10000, help="Rows of the uploaded .xlsx (reading Excel is slow)")
+    parser.add_argument("--validate-rows", type=int, default=1000000, help="Rows of the statement validated on its own")
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--mongodb-uri", help="Benchmark against this server instead of the in-memory stand-in")
+    parser.add_argument("--db-latency-ms", type=float, default=0.0, help="Round trip added to every stand-in call")
+    parser.add_argument("--compare", action="store_true", help="Show the change from the last recorded run of the same size")
+    parser.add_argument("--no-record", action="store_true")
+    args = parser.parse_args()
+
+    # The rate store is set up on import, so it has to point at the synthetic rates first
+    rates_dir = tempfile.TemporaryDirectory()
+    os.environ["FX_RATES_PATH"] = os.path.join(rates_dir.name, "fx_rates.csv")
+    generate_fx_rates(CURRENCIES).to_csv(os.environ["FX_RATES_PATH"], index=False)
+
+    # Bare mode warns about the missing script context on every call
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    import streamlit as st
+    from src.pages import main_page
+    from src.pages.waterfall import create_waterfall_chart
+    from src.transactions.anomalies import detect_anomalies
+    from src.transactions.budgets import forecast_month
+    from src.transactions.pipeline import build_aggregates, clean_statement, update_aggregates
+
+    record = {
+        "commit": current_commit(),
+        "time": datetime.now(timezone.utc).isoformat(),
+        "rows": args.rows,
+        "load_rows": args.load_rows,
+        "validate_rows": args.validate_rows,
+        "db": "mongodb" if args.mongodb_uri else f"in_memory+{args.db_latency_ms}ms",
+        "step_ms": {}
+    }
+    previous = previous_record(args.rows, args.load_rows, record["db"]) if args.compare else None
+
+    def report(name, milliseconds):
+        record["step_ms"][name] = milliseconds
+        change = ""
+        if previous and previous["step_ms"].get(name):
+            change = f"{milliseconds / previous['step_ms'][name] - 1:+8.1%} vs {previous['commit']}"
+        print(f"{name:<26} {milliseconds:10.2f} ms {change}")
+
+    for name, milliseconds in time_validation(args.validate_rows, args.repeats).items():
+        report(name, milliseconds)
+
+    statement = generate_statement(args.rows, currencies=CURRENCIES, exchange_share=0.02, seed=0)
+    upload = io.BytesIO()
+    statement.head(args.load_rows).to_excel(upload, index=False)
+    merchants = statement["Description"].unique()
+    st.session_state.categories = {
+        "Uncategorised": [],
+        "Shopping": list(merchants[:60]),
+        "Food": list(merchants[60:120]),
+        "Transport": list(merchants[120:160]),
+    }
+    st.session_state.category_rules = RULES
+
+    cleaned, _ = clean_statement(statement.copy())
+    dataset = main_page.dataset_store.put(main_page.categorise_transactions(cleaned.copy()))
+    credits_df, debits_df = dataset.view("credits"), dataset.view("debits")
+    synced = len(dataset.frame) // 100
+    history_aggregates = build_aggregates(dataset.frame.iloc[:-synced])
+    expense_summary = main_page.expense_summary_fragment.__wrapped__
+
+    db_manager = db_manager_for(args)
+    google_id = "benchmark-user"
+    db_manager.get_or_create_user_from_google({"sub": google_id, "email": "benchmark@example.com", "name": "Benchmark"})
+    db_manager.save_user_categories(google_id, st.session_state.categories)
+    db_manager.save_user_rules(google_id, RULES)
+    keywords = iter(range(10 ** 9))
+
+    def load_transactions():
+        upload.seek(0)
+        main_page.load_transactions(upload)
+
+    steps = {
+        "load_transactions": load_transactions,
+        "categorise_transactions": lambda: main_page.categorise_transactions(cleaned.copy()),
+        "filter_and_aggregate": lambda: expense_summary(dataset),
+        "build_aggregates": lambda: build_aggregates(dataset.frame),
+        "update_aggregates": lambda: update_aggregates(history_aggregates, dataset.frame.iloc[-synced:]),
+        "detect_anomalies": lambda: detect_anomalies(dataset.view("debits")),
+        "forecast_month": lambda: forecast_month(history_aggregates["day_category"]),
+        "create_waterfall_chart": lambda: create_waterfall_chart(credits_df, debits_df),
+        "db.get_user_categories": lambda: db_manager.get_user_categories(google_id),
+        "db.save_user_categories": lambda: db_manager.save_user_categories(google_id, st.session_state.categories),
+        "db.add_category_keyword": lambda: db_manager.add_category_keyword(google_id, "Food", f"keyword {next(keywords)}"),
+        "db.get_user_rules": lambda: db_manager.get_user_rules(google_id),
+        "db.get_user_budgets": lambda: db_manager.get_user_budgets(google_id),
+    }
+
+    for name, step in steps.items():
+        report(name, time_call(step, args.repeats))
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+    rates_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
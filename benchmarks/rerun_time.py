@@ -0,0 +1,135 @@
+"""
+Rerun wall time of the main dashboard per interaction type.
+
+Each interaction is timed by running exactly the code Streamlit reruns for it:
+before fragments every interaction re-ran the whole page (read + categorise +
+render everything), now a filter change only reruns the summary fragment, an
+editor edit only the editor fragment, and so on. Streamlit runs in bare mode
+here, so the numbers cover building and serialising elements but not the
+browser. Results are appended to benchmarks/results/rerun_time.jsonl.
+
+    python benchmarks/rerun_time.py --rows 20000
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "app"))
+RESULTS_FILE = os.path.join(REPO_ROOT, "benchmarks", "results", "rerun_time.jsonl")
+
+from src.utils.statement_generator import generate_statement
+
+
+def current_commit():
+    """The checked-out commit, marked -dirty when the tree has uncommitted changes (e.g. the ones being measured)"""
+    try:
+        return subprocess.run(["git", "describe", "--always", "--dirty"], cwd=REPO_ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return "unknown"
+
+
+def time_call(func, repeats):
+    timings = []
+    for _ in range(repeats):
+        t1 = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - t1) * 1000)
+    return round(statistics.median(timings), 2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=20000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-record", action="store_true")
+    args = parser.parse_args()
+
+    # Bare mode warns about the missing script context on every call
+    logging.getLogger("streamlit").setLevel(logging.ERROR)
+    import streamlit as st
+    from src.pages import main_page
+
+    statement = generate_statement(args.rows, seed=0)
+    workbook = io.BytesIO()
+    statement.to_excel(workbook, index=False)
+    merchants = statement["Description"].unique()
+    st.session_state.categories = {
+        "Uncategorised": [],
+        "Shopping": list(merchants[:60]),
+        "Food": list(merchants[60:120]),
+        "Transport": list(merchants[120:160]),
+    }
+    st.session_state.category_rules = [{"category": "Transport", "types": ["ATM"]}]
+    st.session_state.budgets = {"Shopping": 400.0, "Food": 250.0}
+
+    # Fragments don't run in bare mode, so their undecorated functions are timed instead
+    add_category = main_page.add_category_fragment.__wrapped__
+    category_editor = main_page.category_editor_fragment.__wrapped__
+    expense_summary = main_page.expense_summary_fragment.__wrapped__
+    ai_categorisation = main_page.ai_categorisation_fragment.__wrapped__
+    trends = main_page.trends_fragment.__wrapped__
+    budgets = main_page.budgets_fragment.__wrapped__
+    recurring_payments = main_page.recurring_payments_fragment.__wrapped__
+    category_rules = main_page.category_rules_fragment.__wrapped__
+
+    def render_everything(dataset):
+        add_category()
+        category_editor(dataset)
+        expense_summary(dataset)
+        main_page.payments_summary(dataset)
+        trends(dataset)
+        budgets(dataset)
+        recurring_payments(dataset)
+        category_rules()
+        ai_categorisation(dataset)
+
+    def full_rerun_uncached():
+        workbook.seek(0)
+        df = main_page.load_transactions(workbook)
+        st.session_state.dataset = main_page.dataset_store.put(df)
+        render_everything(st.session_state.dataset)
+
+    full_rerun_uncached()
+    dataset = st.session_state.dataset
+
+    interactions = {
+        # What every interaction cost before the dashboard was split into fragments
+        "full_rerun_uncached": full_rerun_uncached,
+        # Full reruns (e.g. Add Category, Apply Changes) once the statement is cached
+        "full_rerun_cached": lambda: render_everything(dataset),
+        "filter_change": lambda: expense_summary(dataset),
+        "editor_edit": lambda: category_editor(dataset),
+        "new_category_typing": add_category,
+        "habits_typing": lambda: ai_categorisation(dataset),
+        "trends_month_change": lambda: trends(dataset),
+        "budget_edit": lambda: budgets(dataset),
+        "recurring_filter_change": lambda: recurring_payments(dataset),
+    }
+
+    record = {
+        "commit": current_commit(),
+        "time": datetime.now(timezone.utc).isoformat(),
+        "rows": args.rows,
+        "rerun_ms": {}
+    }
+    for name, interaction in interactions.items():
+        milliseconds = time_call(interaction, args.repeats)
+        record["rerun_ms"][name] = milliseconds
+        print(f"{name:<24} {milliseconds:10.2f} ms")
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == '__main__':
+    main()
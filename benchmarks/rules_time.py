@@ -0,0 +1,76 @@
+"""
+Categorisation time with and without rules, on a large statement.
+
+Keyword lookup alone is the baseline, then the same categorisation runs with
+a set of typical rules (type, amount range, weekdays, day of month, date range
+and description regex). The rules should only cost a small multiple of the
+keyword lookup. Results are appended to benchmarks/results/rules_time.jsonl.
+
+    python benchmarks/rules_time.py --rows 1000000
+"""
+import argparse
+import json
+import os
+import sys
+from datetime import datetime, timezone
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_ROOT, "app"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+RESULTS_FILE = os.path.join(REPO_ROOT, "benchmarks", "results", "rules_time.jsonl")
+
+from rerun_time import current_commit, time_call
+from src.utils.statement_generator import generate_statement
+
+RULES = [
+    {"category": "Rent", "types": ["TRANSFER"], "min_amount": 40, "priority": 200},
+    {"category": "Cash", "types": ["ATM"], "priority": 150},
+    {"category": "Leisure", "types": ["CARD_PAYMENT"], "weekdays": [5, 6], "description_regex": r"(cafe|kitchen)$"},
+    {"category": "Bills", "days_of_month": [1, 2, 3], "max_amount": 20},
+    {"category": "Holiday", "date_from": "2024-07-01", "date_to": "2024-07-31", "min_amount": 100},
+    {"category": "Transport", "description_regex": r"^(lo|mi)\w+ (express|online)$", "priority": 50},
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--no-record", action="store_true")
+    args = parser.parse_args()
+
+    from src.transactions.pipeline import categorise, clean_statement
+
+    df, _ = clean_statement(generate_statement(args.rows, seed=0))
+    merchants = df["Description"].unique()
+    categories = {
+        "Uncategorised": [],
+        "Shopping": list(merchants[:60]),
+        "Food": list(merchants[60:120]),
+        "Transport": list(merchants[120:160]),
+    }
+
+    timings = {
+        "keywords": time_call(lambda: categorise(df.copy(), categories), args.repeats),
+        "keywords_and_rules": time_call(lambda: categorise(df.copy(), categories, RULES), args.repeats),
+    }
+    record = {
+        "commit": current_commit(),
+        "time": datetime.now(timezone.utc).isoformat(),
+        "rows": args.rows,
+        "rules": len(RULES),
+        "categorise_ms": timings,
+        "rules_overhead": round(timings["keywords_and_rules"] / timings["keywords"], 2),
+    }
+    for name, milliseconds in timings.items():
+        print(f"{name:<24} {milliseconds:10.2f} ms")
+    print(f"{'rules_overhead':<24} {record['rules_overhead']:10.2f} x")
+
+    if not args.no_record:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, "a") as f:
+            f.write(json.dumps(record) + "\n")
+
+
+if __name__ == '__main__':
+    main()
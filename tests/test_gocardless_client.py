@@ -0,0 +1,120 @@
+"""
+Incremental bank-feed sync against the local stub of the bank-data API.
+
+    pip install -e ".[dev]" && python -m pytest
+"""
+import pytest
+
+from src.utils.gocardless_client import BankFeedError, GoCardlessClient, sync_user_accounts
+from src.utils.gocardless_stub_server import BankStubConfig, InMemoryCursorStore, start_bank_stub_server
+
+
+ACCOUNTS = 3
+TRANSACTIONS_PER_ACCOUNT = 1000
+PAGE_SIZE = 100
+
+
+@pytest.fixture
+def stub():
+    return BankStubConfig(
+        accounts=ACCOUNTS,
+        transactions_per_account=TRANSACTIONS_PER_ACCOUNT,
+        page_size=PAGE_SIZE,
+        latency=0.0
+    )
+
+
+@pytest.fixture
+def client(stub):
+    # Port 0 picks a free port
+    server = start_bank_stub_server(port=0, config=stub)
+    client = GoCardlessClient("stub-id", "stub-key", base_url=f"http://127.0.0.1:{server.server_address[1]}/api/v2/", max_workers=4)
+    yield client
+    client.close()
+    server.shutdown()
+    server.server_close()
+
+
+def sync(client, store):
+    return sync_user_accounts(client, store, "stub-user", list(client.get_requisition_accounts("stub-requisition")))
+
+
+def test_initial_sync_returns_every_booked_row(stub, client):
+    result = sync(client, InMemoryCursorStore())
+
+    assert len(result.transactions) == ACCOUNTS * TRANSACTIONS_PER_ACCOUNT
+    assert result.transactions["Transaction ID"].is_unique
+    assert result.new_per_account == {account_id: TRANSACTIONS_PER_ACCOUNT for account_id in stub.transactions}
+    # Every page was reached by following the `next` links
+    assert stub.request_counts[("GET", "accounts")] == ACCOUNTS * TRANSACTIONS_PER_ACCOUNT // PAGE_SIZE
+
+
+def test_resync_returns_nothing_new(client):
+    store = InMemoryCursorStore()
+    sync(client, store)
+
+    result = sync(client, store)
+
+    assert len(result.transactions) == 0
+    assert set(result.new_per_account.values()) == {0}
+
+
+def test_new_transactions_are_synced_exactly_once(stub, client):
+    store = InMemoryCursorStore()
+    synced_ids = set(sync(client, store).transactions["Transaction ID"])
+
+    for account_id in stub.transactions:
+        stub.add_transactions(account_id, 5)
+    result = sync(client, store)
+
+    assert result.new_per_account == {account_id: 5 for account_id in stub.transactions}
+    assert result.transactions["Transaction ID"].is_unique
+    assert not synced_ids & set(result.transactions["Transaction ID"])
+
+
+def test_same_day_transactions_are_not_synced_again(stub, client):
+    store = InMemoryCursorStore()
+    sync(client, store)
+    for account_id in stub.transactions:
+        stub.add_transactions(account_id, 5, booking_date="2030-01-01")
+    first = sync(client, store)
+
+    # The cursor's day is fetched again, its transactions already synced have to be dropped
+    for account_id in stub.transactions:
+        stub.add_transactions(account_id, 3, booking_date="2030-01-01")
+    second = sync(client, store)
+
+    assert second.new_per_account == {account_id: 3 for account_id in stub.transactions}
+    assert not set(first.transactions["Transaction ID"]) & set(second.transactions["Transaction ID"])
+
+
+def test_access_token_is_reused(stub, client):
+    store = InMemoryCursorStore()
+    for _ in range(3):
+        sync(client, store)
+
+    assert stub.request_counts[("POST", "token")] == 1
+
+
+def test_reads_are_retried(stub, client):
+    stub.failures["GET"] = 1
+
+    result = sync(client, InMemoryCursorStore())
+
+    assert len(result.transactions) == ACCOUNTS * TRANSACTIONS_PER_ACCOUNT
+
+
+def test_posts_are_not_retried(stub, client):
+    stub.failures["POST"] = 1
+
+    with pytest.raises(BankFeedError):
+        sync(client, InMemoryCursorStore())
+    assert stub.request_counts[("POST", "token")] == 1
+
+
+def test_accounts_are_fetched_concurrently(stub, client):
+    stub.latency = 0.02
+
+    sync(client, InMemoryCursorStore())
+
+    assert stub.max_in_flight > 1